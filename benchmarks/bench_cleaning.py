@@ -0,0 +1,87 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# Make the pipeline modules in scripts/ importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from cleaning_rules import clean_outliers
+
+
+def make_frame(n_rows, seed=42):
+    """Synthetic cleaned-schema frame with heavy tails so every rule actually clips."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'latitude': rng.uniform(-40, 60, n_rows),
+        'longitude': rng.uniform(-120, 150, n_rows),
+        'aqi': rng.gamma(2.0, 30.0, n_rows),
+        'pm25': rng.gamma(2.0, 15.0, n_rows),
+        'pm10': rng.gamma(2.0, 30.0, n_rows),
+        'temperature': rng.normal(20, 8, n_rows),
+        'humidity': rng.normal(60, 25, n_rows),
+        'wind_speed': rng.exponential(3.0, n_rows),
+        'wind_direction': rng.uniform(0, 360, n_rows),
+        'pressure': rng.normal(1012, 8, n_rows),
+    })
+
+
+def legacy_clean(df):
+    """The original per-element cleaning from data_cleaning.py, kept for comparison."""
+    df = df.copy()
+
+    def robust_cap_floor(series, cap_multiplier=3, floor_multiplier=3):
+        median = series.median()
+        mad = np.median(np.abs(series - median))
+        cap = median + cap_multiplier * mad
+        floor = median - floor_multiplier * mad
+        return series.apply(lambda x: min(max(x, floor), cap))
+
+    for col in df.select_dtypes(include=['number']).columns:
+        df[col] = robust_cap_floor(df[col])
+    for col in ['aqi', 'pm25', 'pm10']:
+        df[col] = df[col].apply(lambda x: x if x <= df[col].quantile(0.99) else df[col].quantile(0.99))
+    df['humidity'] = df['humidity'].apply(lambda x: x if x >= 0 else 0)
+    df['wind_speed'] = df['wind_speed'].apply(lambda x: x if x <= df['wind_speed'].quantile(0.99) else df['wind_speed'].quantile(0.99))
+    df['pressure'] = df['pressure'].apply(lambda x: x if x >= df['pressure'].quantile(0.01) else df['pressure'].quantile(0.01))
+    return df
+
+
+def timed(func, *args, repeat=3):
+    """Best-of-`repeat` wall time in seconds, plus the last result."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark vectorized vs legacy outlier capping.")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Rows for the vectorized run")
+    parser.add_argument("--legacy-rows", type=int, default=5_000,
+                        help="Rows for the legacy run (it is O(N^2 log N), so keep this small)")
+    args = parser.parse_args()
+
+    small = make_frame(args.legacy_rows)
+    legacy_time, legacy_out = timed(legacy_clean, small, repeat=1)
+    small_time, (small_out, _) = timed(clean_outliers, small)
+    pd.testing.assert_frame_equal(legacy_out, small_out)
+    print(f"{args.legacy_rows:>10,} rows  legacy {legacy_time:9.3f}s  vectorized {small_time:9.4f}s  "
+          f"speedup {legacy_time / small_time:,.0f}x (outputs identical)")
+
+    large = make_frame(args.rows)
+    large_time, _ = timed(clean_outliers, large)
+    # Legacy cost is dominated by one quantile (O(N log N)) per row per column -> scales ~N^2
+    legacy_estimate = legacy_time * (args.rows / args.legacy_rows) ** 2
+    print(f"{args.rows:>10,} rows  legacy ~{legacy_estimate:,.0f}s (extrapolated)  vectorized {large_time:9.3f}s  "
+          f"speedup ~{legacy_estimate / large_time:,.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingRegressor
+
+# Make the pipeline modules in scripts/ importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from flat_ensemble import FlatEnsemble
+
+
+def make_features(n_rows, n_features, seed=42):
+    """Standardized features with a non-linear target, shaped like the model's training frame."""
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.normal(size=(n_rows, n_features)), columns=[f"feature_{i}" for i in range(n_features)])
+    y = 3 * X['feature_0'] + np.sin(X['feature_1']) + X['feature_2'] * X['feature_3'] + rng.normal(size=n_rows)
+    return X, y
+
+
+def best_time(func, repeats):
+    """Best of `repeats` calls, in seconds."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the flat-array evaluator against GradientBoostingRegressor.predict.")
+    parser.add_argument("--trees", type=int, default=200, help="n_estimators of the benchmark model")
+    parser.add_argument("--depth", type=int, default=5, help="max_depth of the benchmark model")
+    parser.add_argument("--features", type=int, default=24, help="Number of input features")
+    parser.add_argument("--train-rows", type=int, default=5000, help="Rows the benchmark model is fitted on")
+    parser.add_argument("--batch-sizes", default="1,10,100,1000,10000,100000", help="Comma-separated batch sizes")
+    parser.add_argument("--repeats", type=int, default=200, help="Timed calls for single-row latency")
+    args = parser.parse_args()
+
+    X, y = make_features(args.train_rows, args.features)
+    model = GradientBoostingRegressor(n_estimators=args.trees, max_depth=args.depth, learning_rate=0.05, subsample=0.8, random_state=42).fit(X, y)
+    start = time.perf_counter()
+    flat = FlatEnsemble.from_model(model)
+    print(f"Compiled {args.trees} trees of depth {args.depth} ({len(flat.feature):,} nodes) in {time.perf_counter() - start:.3f}s")
+
+    X_test, _ = make_features(max(int(size) for size in args.batch_sizes.split(",")), args.features, seed=7)
+    expected = model.predict(X_test)
+    assert np.array_equal(flat.predict(X_test), expected), "flat predictions differ from sklearn"
+    assert all(flat.predict_one(row) == value for row, value in zip(X_test.to_numpy()[:1000], expected)), "predict_one differs from sklearn"
+    print(f"Predictions identical to sklearn on {len(X_test):,} rows")
+
+    row_frame, row = X_test.iloc[:1], X_test.to_numpy()[0]
+    sklearn_row = best_time(lambda: model.predict(row_frame), args.repeats)
+    flat_row = best_time(lambda: flat.predict(row_frame), args.repeats)
+    one_row = best_time(lambda: flat.predict_one(row), args.repeats)
+    print(f"Single row  sklearn predict {sklearn_row * 1e6:8.1f} us  flat predict {flat_row * 1e6:8.1f} us  "
+          f"predict_one {one_row * 1e6:8.1f} us  ({sklearn_row / one_row:.0f}x)")
+
+    for size in (int(size) for size in args.batch_sizes.split(",")):
+        batch = X_test.iloc[:size]
+        repeats = max(3, min(50, 10000 // size))
+        sklearn_time = best_time(lambda: model.predict(batch), repeats)
+        flat_time = best_time(lambda: flat.predict(batch), repeats)
+        print(f"{size:>10,} rows  sklearn {size / sklearn_time:12,.0f} rows/s  flat {size / flat_time:12,.0f} rows/s  "
+              f"({sklearn_time / flat_time:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
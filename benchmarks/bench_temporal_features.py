@@ -0,0 +1,61 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# Make the pipeline modules in scripts/ importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from temporal_features import add_temporal_features
+
+
+def make_frame(n_rows, n_stations, seed=42):
+    """Hourly readings spread over `n_stations` stations, in random row order."""
+    rng = np.random.default_rng(seed)
+    station = rng.integers(0, n_stations, n_rows)
+    return pd.DataFrame({
+        'latitude': -40 + station * 0.01,
+        'longitude': -120 + station * 0.02,
+        'timestamp': pd.Timestamp('2024-01-01', tz='UTC') + pd.to_timedelta(rng.integers(0, 24 * 365 * 2, n_rows), unit='h'),
+        'aqi': rng.gamma(2.0, 30.0, n_rows),
+        'pm25': rng.gamma(2.0, 15.0, n_rows),
+        'pm10': rng.gamma(2.0, 30.0, n_rows),
+        'temperature': rng.normal(20, 8, n_rows),
+        'humidity': rng.uniform(10, 100, n_rows),
+        'wind_speed': rng.exponential(3.0, n_rows),
+    })
+
+
+def legacy_peak_count(df):
+    """The original per-group lambda from feature_engineering.py (a cumulative peak count)."""
+    df = df.sort_values(by=['latitude', 'longitude', 'timestamp'])
+    return df.groupby(['latitude', 'longitude'])['aqi'].transform(lambda x: (x > x.quantile(0.95)).astype(int).cumsum())
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the per-station temporal features.")
+    parser.add_argument("--sizes", default="100000:100,1000000:1000,4000000:4000",
+                        help="Comma-separated rows:stations pairs")
+    args = parser.parse_args()
+
+    for pair in args.sizes.split(","):
+        n_rows, n_stations = (int(x) for x in pair.split(":"))
+        df = make_frame(n_rows, n_stations)
+        legacy_time, _ = timed(legacy_peak_count, df)
+        new_time, out = timed(add_temporal_features, df)
+        n_features = out.shape[1] - df.shape[1]
+        print(f"{n_rows:>10,} rows {n_stations:>6,} stations  legacy peak count {legacy_time:7.3f}s  "
+              f"all {n_features} temporal features {new_time:7.3f}s  ({new_time / n_rows * 1e6:.2f} us/row)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+ARROW_CONTENT_TYPE = "application/vnd.apache.arrow.stream"
+
+
+def make_rows(n_rows, locations, rng):
+    """Hypothetical weather scenarios for stations picked from locations.json."""
+    picks = rng.integers(0, len(locations), n_rows)
+    timestamps = np.datetime64('2025-01-01T00:00') + rng.integers(0, 24 * 365, n_rows).astype('timedelta64[h]')
+    return [{
+        'latitude': locations[i]['latitude'],
+        'longitude': locations[i]['longitude'],
+        'timestamp': str(ts) + 'Z',
+        'wind_speed': float(rng.exponential(3.0)),
+        'wind_direction': float(rng.uniform(0, 360)),
+        'humidity': float(rng.uniform(10, 100)),
+        'temperature': float(rng.normal(20, 8)),
+        'pressure': float(rng.normal(1012, 8)),
+    } for i, ts in zip(picks, timestamps)]
+
+
+def encode(rows, data_format):
+    if data_format == "arrow":
+        import pyarrow as pa
+        table = pa.Table.from_pylist(rows)
+        sink = io.BytesIO()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue(), ARROW_CONTENT_TYPE
+    return json.dumps({'rows': rows}).encode(), "application/json"
+
+
+def post(url, body, content_type):
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': content_type}, method="POST")
+    start = time.perf_counter()
+    with urllib.request.urlopen(request) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def wait_for(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Service at {url} did not come up within {timeout}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the micro-batching prediction service.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL of a running service")
+    parser.add_argument("--spawn", action="store_true",
+                        help="Start scripts/prediction_service.py for the run (needs a saved model and feature pipeline)")
+    parser.add_argument("--concurrency", type=int, default=32, help="Clients sending requests at once")
+    parser.add_argument("--requests", type=int, default=2000, help="Total requests")
+    parser.add_argument("--rows-per-request", type=int, default=1, help="Rows in each request body")
+    parser.add_argument("--format", choices=["json", "arrow"], default="json")
+    args = parser.parse_args()
+
+    with open(os.path.join(repo_dir, "locations.json")) as f:
+        locations = json.load(f)
+    rng = np.random.default_rng(42)
+    bodies = [encode(make_rows(args.rows_per_request, locations, rng), args.format) for _ in range(min(args.requests, 256))]
+
+    server = None
+    if args.spawn:
+        port = args.url.rsplit(":", 1)[-1]
+        server = subprocess.Popen([sys.executable, "prediction_service.py"], cwd=os.path.join(repo_dir, "scripts"),
+                                  env={**os.environ, "SERVICE_PORT": port})
+    try:
+        wait_for(args.url + "/health")
+        predict_url = args.url + "/predict"
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            latencies = list(pool.map(lambda i: post(predict_url, *bodies[i % len(bodies)]), range(args.requests)))
+        elapsed = time.perf_counter() - start
+        with urllib.request.urlopen(args.url + "/metrics") as response:
+            server_metrics = json.load(response)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    latencies = np.array(latencies) * 1000
+    rows = args.requests * args.rows_per_request
+    print(f"{args.requests:,} requests x {args.rows_per_request} rows ({args.format}), concurrency {args.concurrency}")
+    print(f"client  p50 {np.percentile(latencies, 50):8.2f} ms  p99 {np.percentile(latencies, 99):8.2f} ms  "
+          f"{args.requests / elapsed:,.0f} req/s  {rows / elapsed:,.0f} rows/s")
+    print(f"server  p50 {server_metrics['latency_p50_ms']:8.2f} ms  p99 {server_metrics['latency_p99_ms']:8.2f} ms  "
+          f"mean batch {server_metrics['mean_batch_rows']:.1f} rows over {server_metrics['batches']:,} batches")
+
+
+if __name__ == "__main__":
+    main()
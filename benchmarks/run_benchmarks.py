@@ -0,0 +1,264 @@
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+# Make the pipeline modules in scripts/ importable
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.join(bench_dir, "..")
+sys.path.insert(0, os.path.join(repo_dir, "scripts"))
+
+import api_retrieval
+import backfill
+import data_cleaning
+import database_operations as db
+import feature_engineering
+import response_cache
+import retention
+import spatial_features
+import storage
+from cleaning_rules import clean_outliers
+from model import NON_FEATURE_COLUMNS
+from sklearn.ensemble import GradientBoostingRegressor, HistGradientBoostingRegressor
+
+from synthetic import iter_records, make_stations, start_fixture_api, write_recordings
+
+results_dir = os.path.join(bench_dir, "results")
+
+SIZES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+ROW_BY_ROW_LIMIT = 10_000 # insert_air_quality_data commits per row; time it on a prefix only
+BACKFILL_LIMIT = 1_000_000 # Recorded responses replayed by the backfill stage (~400 bytes each on disk)
+REGRESSION_THRESHOLD = 1.2 # Flag stages this many times slower than the baseline
+
+
+def git_commit():
+    """(short sha, dirty flag) of the working tree, or ('unknown', True) outside git."""
+    try:
+        sha = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=repo_dir, text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repo_dir, text=True).strip())
+        return sha, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", True
+
+
+class Suite:
+    """Runs every stage against a scratch directory; nothing under data/ is touched."""
+
+    def __init__(self, n_rows, n_locations, train_rows, workdir):
+        self.n_rows = n_rows
+        self.n_locations = n_locations
+        self.train_rows = train_rows
+        self.workdir = workdir
+        self.db_file = os.path.join(workdir, "air_quality_data.db")
+        self.results = {}
+        # Point the pipeline's module-level paths at the scratch directory
+        data_cleaning.db_path = self.db_file
+        spatial_features.station_table_path = os.path.join(workdir, "stations.json")
+        response_cache.cache_path = os.path.join(workdir, "api_cache.json")
+        retention.archive_dir = os.path.join(workdir, "archive")
+        retention.state_path = os.path.join(workdir, "maintenance_state.json")
+        backfill.state_path = os.path.join(workdir, "backfill_state.json")
+        storage.DATASETS = {name: {fmt: os.path.join(workdir, os.path.basename(path)) for fmt, path in paths.items()}
+                            for name, paths in storage.DATASETS.items()}
+
+    def timed(self, stage, func, rows):
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+        self.results[stage] = {'seconds': seconds, 'rows': rows, 'rows_per_second': rows / seconds if seconds else None}
+        print(f"  {stage:<22} {seconds:10.3f}s  {rows:>12,} rows  {rows / seconds if seconds else 0:>14,.0f} rows/s")
+        return result
+
+    def connect(self, path):
+        conn = db.create_database_connection(path)
+        db.create_air_quality_table(conn)
+        return conn
+
+    def ingest_api(self):
+        """One concurrent sweep against the local fixture, rate limiting off."""
+        server, base_url = start_fixture_api()
+        api_retrieval.API_BASE_URL = base_url
+        stations = make_stations(min(self.n_locations, 500))
+        locations = [{'latitude': lat, 'longitude': lon} for lat, lon in zip(stations['latitude'], stations['longitude'])]
+        conn = self.connect(os.path.join(self.workdir, "ingest.db"))
+        try:
+            self.timed('ingest_api', lambda: api_retrieval.fetch_and_store_all(
+                locations, rate_limiter=api_retrieval.TokenBucket(0), conn=conn), len(locations))
+        finally:
+            conn.close()
+            server.shutdown()
+
+    def replay(self):
+        """Backfill of recorded responses (NDJSON) into a fresh database: parse pool plus bulk writer."""
+        n = min(self.n_rows, BACKFILL_LIMIT)
+        path = write_recordings(os.path.join(self.workdir, "recordings.ndjson"), n, self.n_locations)
+        conn = self.connect(os.path.join(self.workdir, "backfill.db"))
+        try:
+            self.timed('ingest_backfill', lambda: backfill.run_backfill([path], conn), n)
+        finally:
+            conn.close()
+
+    def insert(self):
+        records = next(iter_records(min(self.n_rows, ROW_BY_ROW_LIMIT), self.n_locations, chunk_rows=ROW_BY_ROW_LIMIT))
+        conn = self.connect(os.path.join(self.workdir, "row_by_row.db"))
+        self.timed('insert_row_by_row', lambda: [db.insert_air_quality_data(conn, r) for r in records], len(records))
+        conn.close()
+
+        conn = self.connect(self.db_file)
+        self.timed('insert_bulk', lambda: sum(db.insert_air_quality_data_bulk(conn, chunk)
+                                             for chunk in iter_records(self.n_rows, self.n_locations)), self.n_rows)
+        conn.close()
+
+    def remove_duplicates(self):
+        """Legacy cleanup on a copy without the natural-key index and with 5% duplicated readings."""
+        path = os.path.join(self.workdir, "legacy.db")
+        shutil.copy(self.db_file, path)
+        conn = sqlite3.connect(path)
+        conn.execute(f"DROP INDEX {db.NATURAL_KEY_INDEX}")
+        columns = ", ".join(db.READING_COLUMNS)
+        conn.execute(f"INSERT INTO readings ({columns}) SELECT {columns} FROM readings WHERE id % 20 = 0")
+        conn.commit()
+        rows = conn.execute("SELECT COUNT(*) FROM readings").fetchone()[0]
+        self.timed('remove_duplicate_data', lambda: db.remove_duplicate_data(conn), rows)
+        conn.close()
+
+    def migrate(self):
+        """Migration of a legacy wide air_quality table (with 5% duplicates) to the stations schema."""
+        path = os.path.join(self.workdir, "legacy.db")
+        shutil.copy(self.db_file, path)
+        conn = sqlite3.connect(path)
+        columns = ", ".join(db.AIR_QUALITY_COLUMNS)
+        conn.executescript(f"""
+            CREATE TABLE legacy AS SELECT id, {columns} FROM air_quality;
+            INSERT INTO legacy SELECT id + (SELECT MAX(id) FROM legacy), {columns} FROM legacy WHERE id % 20 = 0;
+            DROP VIEW air_quality; DROP TABLE readings; DROP TABLE stations;
+            ALTER TABLE legacy RENAME TO air_quality;
+        """)
+        rows = conn.execute("SELECT COUNT(*) FROM air_quality").fetchone()[0]
+        self.timed('migrate_station_schema', lambda: db.migrate_to_station_schema(conn), rows)
+        conn.close()
+
+    def cleaning(self):
+        cleaned, _ = self.timed('clean_full', lambda: data_cleaning.run_full_cleaning(persist=False), self.n_rows)
+        self.timed('clean_capping', lambda: clean_outliers(cleaned), len(cleaned))
+        return cleaned
+
+    def features(self, cleaned):
+        featured, feature_pipeline = self.timed('features', lambda: feature_engineering.engineer_features(cleaned), len(cleaned))
+        return featured, feature_pipeline
+
+    def training(self, featured):
+        """Fixed-parameter fits, so timings compare across commits (the search itself is budgeted)."""
+        sample = featured.sample(min(len(featured), self.train_rows), random_state=42)
+        X, y = sample.drop(NON_FEATURE_COLUMNS, axis=1), sample['aqi']
+        gb = GradientBoostingRegressor(n_estimators=100, max_depth=3, random_state=42)
+        self.timed('train_gb', lambda: gb.fit(X, y), len(sample))
+        hist = HistGradientBoostingRegressor(max_iter=100, max_depth=3, random_state=42)
+        self.timed('train_hist', lambda: hist.fit(X, y), len(sample))
+        self.timed('predict_gb', lambda: gb.predict(X), len(sample))
+
+    def dashboard(self, featured, feature_pipeline):
+        """What the Streamlit app pays on a cache miss: read the featured dataset and summarise it."""
+        storage.save_dataset(featured, 'featured')
+        loaded = self.timed('streamlit_load', lambda: storage.load_dataset('featured'), len(featured))
+        self.timed('streamlit_summary', lambda: feature_engineering.build_dashboard_summary(loaded, feature_pipeline), len(loaded))
+
+    def run(self, stages):
+        if 'ingest' in stages:
+            self.ingest_api()
+        if 'backfill' in stages:
+            self.replay()
+        self.insert() # Builds the database every later stage reads
+        if 'dedupe' in stages:
+            self.remove_duplicates()
+        if 'migrate' in stages:
+            self.migrate()
+        if not stages & {'clean', 'features', 'train', 'dashboard'}:
+            return self.results
+        cleaned = self.cleaning()
+        if not stages & {'features', 'train', 'dashboard'}:
+            return self.results
+        featured, feature_pipeline = self.features(cleaned)
+        if 'train' in stages:
+            self.training(featured)
+        if 'dashboard' in stages:
+            self.dashboard(featured, feature_pipeline)
+        return self.results
+
+
+def save_results(size, n_rows, n_locations, results):
+    sha, dirty = git_commit()
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f"{sha}{'-dirty' if dirty else ''}.json")
+    payload = {'commit': sha, 'dirty': dirty, 'runs': {}}
+    if os.path.exists(path):
+        with open(path) as f:
+            payload = json.load(f)
+    payload['runs'][size] = {
+        'recorded_at': datetime.datetime.utcnow().isoformat(),
+        'rows': n_rows, 'locations': n_locations,
+        'python': sys.version.split()[0], 'storage_format': storage.DATA_FORMAT,
+        'stages': results,
+    }
+    with open(path, "w") as f:
+        json.dump(payload, f, indent=2)
+    print(f"Results saved to {path}")
+    return path
+
+
+def compare(size, results, baseline):
+    """Prints per-stage time ratios against a stored baseline commit; returns the regressed stages."""
+    path = os.path.join(results_dir, f"{baseline}.json")
+    with open(path) as f:
+        base = json.load(f)['runs'].get(size)
+    if base is None:
+        print(f"No '{size}' run stored for {baseline}.")
+        return []
+    regressions = []
+    print(f"\nvs {baseline} ({size}):")
+    for stage, current in results.items():
+        if stage not in base['stages']:
+            continue
+        ratio = current['seconds'] / base['stages'][stage]['seconds']
+        flag = "  REGRESSION" if ratio > REGRESSION_THRESHOLD else ""
+        print(f"  {stage:<22} {base['stages'][stage]['seconds']:10.3f}s -> {current['seconds']:10.3f}s  x{ratio:5.2f}{flag}")
+        if flag:
+            regressions.append(stage)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark suite for every pipeline stage on synthetic data.")
+    parser.add_argument("--size", choices=list(SIZES), default="10k", help="Synthetic table size")
+    parser.add_argument("--rows", type=int, help="Overrides --size with an exact row count")
+    parser.add_argument("--locations", type=int, default=100, help="Stations in the synthetic table")
+    parser.add_argument("--train-rows", type=int, default=200_000, help="Rows sampled for the training stages")
+    parser.add_argument("--stages", default="ingest,backfill,dedupe,migrate,clean,features,train,dashboard",
+                        help="Comma-separated subset of ingest,backfill,dedupe,migrate,clean,features,train,dashboard (insert always runs)")
+    parser.add_argument("--compare", metavar="COMMIT", help="Baseline results file name in benchmarks/results/ (e.g. a short sha)")
+    parser.add_argument("--no-save", action="store_true", help="Do not store the results")
+    args = parser.parse_args()
+
+    n_rows = args.rows or SIZES[args.size]
+    size = args.size if args.rows is None else str(args.rows)
+    print(f"Benchmarking {n_rows:,} rows over {args.locations} locations ({storage.DATA_FORMAT} storage)")
+    workdir = tempfile.mkdtemp(prefix="aq_bench_")
+    try:
+        results = Suite(n_rows, args.locations, args.train_rows, workdir).run(set(args.stages.split(",")))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if not args.no_save:
+        save_results(size, n_rows, args.locations, results)
+    if args.compare and compare(size, results, args.compare):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
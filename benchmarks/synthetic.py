@@ -0,0 +1,130 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+POLLUTANTS = np.array(['p2', 'p1', 'o3', 'n2'])
+
+
+def make_stations(n_locations, seed=42):
+    """Station coordinates and names, spread over the inhabited latitudes."""
+    rng = np.random.default_rng(seed)
+    return {
+        'latitude': np.round(rng.uniform(-45, 65, n_locations), 6),
+        'longitude': np.round(rng.uniform(-180, 180, n_locations), 6),
+        'city': np.array([f"City {i}" for i in range(n_locations)]),
+        'state': np.array([f"State {i % 50}" for i in range(n_locations)]),
+        'country': np.array([f"Country {i % 20}" for i in range(n_locations)]),
+    }
+
+
+def iter_records(n_rows, n_locations, chunk_rows=100_000, duplicate_fraction=0.0, seed=42):
+    """Yields lists of processed-record dicts (the shape process_air_quality_data returns).
+
+    Rows are hourly readings, round-robin over the stations, with a diurnal AQI cycle, weather
+    correlated with it, and heavy tails so the outlier caps have work to do. duplicate_fraction
+    re-emits that share of each chunk's readings, as a re-run of the API sweep would.
+    """
+    rng = np.random.default_rng(seed)
+    stations = make_stations(n_locations, seed)
+    start = np.datetime64('2024-01-01T00:00:00')
+    for offset in range(0, n_rows, chunk_rows):
+        n = min(chunk_rows, n_rows - offset)
+        row = np.arange(offset, offset + n)
+        station = row % n_locations
+        hour = row // n_locations
+        timestamps = (start + hour.astype('timedelta64[h]')).astype(str)
+        diurnal = 1 + 0.3 * np.sin(2 * np.pi * (hour % 24) / 24)
+        aqi = np.round(rng.gamma(2.0, 25.0, n) * diurnal)
+        temperature = rng.normal(18, 9, n)
+        columns = {
+            'timestamp': np.char.add(timestamps, '.000Z'),
+            'latitude': stations['latitude'][station],
+            'longitude': stations['longitude'][station],
+            'city': stations['city'][station],
+            'state': stations['state'][station],
+            'country': stations['country'][station],
+            'aqi': aqi,
+            'main_pollutant': POLLUTANTS[rng.integers(0, len(POLLUTANTS), n)],
+            'pm25': np.round(aqi * rng.uniform(0.3, 0.6, n)),
+            'pm10': aqi,
+            'temperature': np.round(temperature),
+            'humidity': np.round(np.clip(rng.normal(65, 20, n) - temperature / 3, 2, 100)),
+            'wind_speed': np.round(rng.exponential(3.0, n), 2),
+            'wind_direction': np.round(rng.uniform(0, 360, n)),
+            'pressure': np.round(rng.normal(1012, 9, n)),
+        }
+        keys = list(columns)
+        values = [columns[k].tolist() for k in keys]
+        records = [dict(zip(keys, row_values), o3=None, no2=None, so2=None, co=None) for row_values in zip(*values)]
+        if duplicate_fraction:
+            repeat = rng.choice(n, int(n * duplicate_fraction), replace=False)
+            records += [records[i] for i in repeat]
+        yield records
+
+
+def api_response(latitude, longitude, ts="2025-01-01T00:00:00.000Z"):
+    """A nearest_city payload in the AirVisual shape, deterministic per location."""
+    seed = int(abs(latitude * 1000) + abs(longitude * 10)) % 500
+    return {
+        "status": "success",
+        "data": {
+            "city": f"City {seed}", "state": "State", "country": "Country",
+            "location": {"type": "Point", "coordinates": [longitude, latitude]},
+            "current": {
+                "pollution": {"ts": ts, "aqius": 20 + seed % 150, "mainus": "p2", "aqicn": 10 + seed % 80},
+                "weather": {"ts": ts, "tp": 5 + seed % 30, "hu": 30 + seed % 60, "ws": 1 + seed % 7,
+                            "wd": seed % 360, "pr": 990 + seed % 40},
+            },
+        },
+    }
+
+
+def record_response(record):
+    """The nearest_city payload that process_air_quality_data turns back into `record`."""
+    return {
+        "status": "success",
+        "data": {
+            "city": record['city'], "state": record['state'], "country": record['country'],
+            "location": {"type": "Point", "coordinates": [record['longitude'], record['latitude']]},
+            "current": {
+                "pollution": {"ts": record['timestamp'], "aqius": record['aqi'], "mainus": record['main_pollutant'],
+                              "aqicn": record['pm25']},
+                "weather": {"ts": record['timestamp'], "tp": record['temperature'], "hu": record['humidity'],
+                            "ws": record['wind_speed'], "wd": record['wind_direction'], "pr": record['pressure']},
+            },
+        },
+    }
+
+
+def write_recordings(path, n_rows, n_locations, seed=42):
+    """Writes n_rows recorded responses as NDJSON (the input of backfill.py); returns the path."""
+    with open(path, "w") as f:
+        for records in iter_records(n_rows, n_locations, seed=seed):
+            f.writelines(json.dumps(record_response(r)) + "\n" for r in records)
+    return path
+
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        body = json.dumps(api_response(float(query['lat'][0]), float(query['lon'][0]))).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_fixture_api(port=0):
+    """Serves /v2/nearest_city on localhost in a daemon thread; returns (server, base URL)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), _FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v2"
@@ -0,0 +1,232 @@
+import os
+import time
+import queue
+import atexit
+import logging
+import smtplib
+import datetime
+import threading
+from collections import deque
+from email.mime.text import MIMEText
+from dotenv import load_dotenv
+
+load_dotenv() # Load the env file with the email logins
+
+ALERT_SMTP_HOST = os.getenv("ALERT_SMTP_HOST", "smtp.gmail.com")
+ALERT_SMTP_PORT = int(os.getenv("ALERT_SMTP_PORT", "465"))
+ALERT_SMTP_SSL = os.getenv("ALERT_SMTP_SSL", "1") == "1" # 0: plain SMTP (STARTTLS when offered), e.g. a local stand-in server
+ALERT_SMTP_IDLE_SECONDS = float(os.getenv("ALERT_SMTP_IDLE_SECONDS", "240")) # Close the pooled connection after this long unused
+ALERT_BATCH_SECONDS = float(os.getenv("ALERT_BATCH_SECONDS", "5")) # Alerts arriving this soon after the first share one email
+ALERT_COOLDOWN_SECONDS = float(os.getenv("ALERT_COOLDOWN_SECONDS", "21600")) # The same alert is not re-sent within this window
+ALERT_MAX_PER_HOUR = int(os.getenv("ALERT_MAX_PER_HOUR", "6")) # Emails in any rolling hour; later alerts wait and are merged, <= 0 disables
+ALERT_FLUSH_TIMEOUT = float(os.getenv("ALERT_FLUSH_TIMEOUT", "30")) # How long exit waits for queued alerts to be sent
+
+def format_alert_body(messages):
+    alert_message = "Wagwan Data Scientist,\n\n"
+    alert_message += "This is an automated alert from the Air Quality Project data pipeline.\n\n"
+    alert_message += "The following data inconsistencies have been detected during the validation process:\n\n"
+    alert_message += "\n".join([f"- {msg}" for msg in messages])
+    alert_message += f"\n\nTimestamp of alert: {datetime.datetime.utcnow()} (UTC)\n\n"
+    alert_message += "Sincerely,\n\nThe Air Quality Project Automated Alert System"
+    alert_message += "\n\nYour buoy Richie🐣"
+    return alert_message
+
+class SMTPPool:
+    """One logged-in SMTP connection, reused across emails.
+
+    Reopened when the server has dropped it; closed by the dispatcher once idle. Not thread-safe:
+    only the dispatcher thread sends.
+    """
+
+    def __init__(self, host=ALERT_SMTP_HOST, port=ALERT_SMTP_PORT, use_ssl=ALERT_SMTP_SSL, username=None, password=None):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.username = username
+        self.password = password
+        self.smtp = None
+        self.connections = 0
+
+    def _connect(self):
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=30)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=30)
+            smtp.ehlo()
+            if smtp.has_extn("starttls"):
+                smtp.starttls()
+        if self.password:
+            smtp.login(self.username, self.password)
+        self.connections += 1
+        return smtp
+
+    def send_message(self, msg):
+        for attempt in range(2):
+            if self.smtp is None:
+                self.smtp = self._connect()
+            try:
+                self.smtp.send_message(msg)
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError): # Server timed the pooled connection out
+                self.smtp = None
+                if attempt:
+                    raise
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.smtp = None
+
+class AlertDispatcher:
+    """Sends alerts from a background thread, so callers never wait on the mail server.
+
+    submit() queues a {key: message} dict and returns at once. The thread gathers everything that
+    arrives within batch_seconds into one email, drops keys already sent within cooldown_seconds,
+    and keeps to max_per_hour emails per rolling hour; alerts held back by the limit are merged
+    into the next email. All emails go over one pooled SMTP connection.
+    """
+
+    def __init__(self, pool, sender=None, recipient=None, subject="Data Inconsistency Alert",
+                 batch_seconds=ALERT_BATCH_SECONDS, cooldown_seconds=ALERT_COOLDOWN_SECONDS,
+                 max_per_hour=ALERT_MAX_PER_HOUR, idle_seconds=ALERT_SMTP_IDLE_SECONDS, formatter=format_alert_body):
+        self.pool = pool
+        self.sender = sender
+        self.recipient = recipient
+        self.subject = subject
+        self.batch_seconds = batch_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.max_per_hour = max_per_hour
+        self.idle_seconds = idle_seconds
+        self.formatter = formatter
+        self.queue = queue.Queue()
+        self.last_sent = {} # key -> monotonic time it was last emailed
+        self.sent_times = deque() # Email send times in the last hour
+        self.unfinished = 0
+        self.done = threading.Condition()
+        self.thread = None
+        self.stats = {'submitted': 0, 'emails': 0, 'sent': 0, 'suppressed': 0, 'failed': 0}
+
+    def submit(self, alerts):
+        """Queues alerts for the next email: a {key: message} dict, or messages that are their own keys."""
+        alerts = dict(alerts) if isinstance(alerts, dict) else {msg: msg for msg in alerts}
+        if not alerts:
+            return
+        with self.done:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="alert-dispatcher", daemon=True)
+                self.thread.start()
+            self.unfinished += 1
+        self.stats['submitted'] += len(alerts)
+        self.queue.put(alerts)
+
+    def flush(self, timeout=None):
+        """Waits until every submitted alert is sent, suppressed or failed; False on timeout."""
+        with self.done:
+            return self.done.wait_for(lambda: self.unfinished == 0, timeout)
+
+    def close(self, timeout=ALERT_FLUSH_TIMEOUT):
+        """Flushes, stops the thread and closes the SMTP connection."""
+        if self.thread is None:
+            return
+        if not self.flush(timeout):
+            logging.warning(f"Alert dispatcher closed with {self.unfinished} batches unsent.")
+        self.queue.put(None)
+        self.thread.join(timeout)
+        self.thread = None
+
+    def _collect(self, pending, deadline):
+        """Merges queued alerts into `pending` until `deadline`; returns (batches taken, stop requested)."""
+        taken = 0
+        while True:
+            try:
+                alerts = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                return taken, False
+            if alerts is None:
+                return taken, True
+            pending.update(alerts)
+            taken += 1
+
+    def _rate_wait(self, now):
+        while self.sent_times and now - self.sent_times[0] >= 3600:
+            self.sent_times.popleft()
+        if self.max_per_hour <= 0 or len(self.sent_times) < self.max_per_hour:
+            return 0.0
+        return 3600 - (now - self.sent_times[0])
+
+    def _cooling(self, key, now):
+        return key in self.last_sent and now - self.last_sent[key] < self.cooldown_seconds
+
+    def _finish(self, batches):
+        with self.done:
+            self.unfinished -= batches
+            self.done.notify_all()
+
+    def _run(self):
+        while True:
+            try:
+                first = self.queue.get(timeout=self.idle_seconds)
+            except queue.Empty:
+                self.pool.close() # Idle: give the connection back until the next alert
+                continue
+            if first is None:
+                break
+            pending = dict(first)
+            taken, stop = self._collect(pending, time.monotonic() + self.batch_seconds)
+            taken += 1
+            while not stop:
+                wait = self._rate_wait(time.monotonic())
+                if wait <= 0 or all(self._cooling(k, time.monotonic()) for k in pending):
+                    break
+                # Rate limited: keep gathering, so the next email carries everything
+                more, stop = self._collect(pending, time.monotonic() + wait)
+                taken += more
+            if stop and self._rate_wait(time.monotonic()) > 0:
+                logging.warning(f"Alert rate limit reached at shutdown; {len(pending)} alerts not sent.")
+            else:
+                self._send(pending)
+            self._finish(taken)
+            if stop:
+                break
+        self.pool.close()
+
+    def _send(self, pending):
+        now = time.monotonic()
+        fresh = {key: msg for key, msg in pending.items() if not self._cooling(key, now)}
+        self.stats['suppressed'] += len(pending) - len(fresh)
+        if not fresh:
+            logging.info(f"{len(pending)} alerts already sent within the cooldown; suppressed.")
+            return
+        msg = MIMEText(self.formatter(list(fresh.values())))
+        msg['Subject'] = self.subject
+        msg['From'] = self.sender
+        msg['To'] = self.recipient
+        try:
+            self.pool.send_message(msg)
+        except Exception as e:
+            self.stats['failed'] += len(fresh)
+            logging.error(f"Failed to send alert email: {e}")
+            return
+        for key in fresh:
+            self.last_sent[key] = now
+        self.sent_times.append(now)
+        self.stats['emails'] += 1
+        self.stats['sent'] += len(fresh)
+        logging.info(f"Alert email sent successfully ({len(fresh)} alerts, {len(pending) - len(fresh)} suppressed).")
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def get_dispatcher():
+    """The process-wide dispatcher, configured from the environment; flushed at exit."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            sender = os.getenv("SENDER_EMAIL")
+            pool = SMTPPool(username=sender, password=os.getenv("SENDER_PASSWORD"))
+            _dispatcher = AlertDispatcher(pool, sender=sender, recipient=os.getenv("RECEIVER_EMAIL"))
+            atexit.register(_dispatcher.close)
+        return _dispatcher
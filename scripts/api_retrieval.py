@@ -5,17 +5,31 @@ import sqlite3
 import time
 import schedule
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from database_operations import (
     create_database_connection,
     create_air_quality_table,
     insert_air_quality_data,
-    remove_duplicate_data
+    insert_air_quality_data_bulk,
+    upsert_stations
 )
 from dotenv import load_dotenv
+from metrics import METRICS
+from response_cache import ResponseCache, API_CACHE_ENABLED
 
 load_dotenv()
 API_KEY = os.getenv("API_KEY")
 LOCATIONS_FILE = "locations.json" # Configuration file for locations
+API_BASE_URL = os.getenv("API_BASE_URL", "https://api.airvisual.com/v2") # Override to point at a local stub server
+INGESTION_MODE = os.getenv("INGESTION_MODE", "staggered") # "staggered" (one location per interval) or "concurrent" (full sweep)
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "8"))
+API_RATE_LIMIT_PER_MINUTE = float(os.getenv("API_RATE_LIMIT_PER_MINUTE", "5")) # AirVisual Community plan: 5 calls/minute, <= 0 disables
+API_RATE_LIMIT_BURST = int(os.getenv("API_RATE_LIMIT_BURST", "5"))
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "10"))
+DB_FILE = "data/raw/air_quality_data.db"
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
@@ -33,15 +47,68 @@ def load_locations():
         logging.error(f"Error loading locations: {e}")
         return []
 
-def get_air_quality_data(latitude, longitude):
-    """Retrieves air quality data from the AirVisual API."""
-    url = f"https://api.airvisual.com/v2/nearest_city?lat={latitude}&lon={longitude}&key={API_KEY}"
+def prepare_database(conn):
+    """Creates (or migrates) the schema and registers the configured locations as stations."""
+    create_air_quality_table(conn)
+    with conn:
+        upsert_stations(conn, load_locations())
+
+class TokenBucket:
+    """Thread-safe token bucket that keeps API calls within the AirVisual quota."""
+
+    def __init__(self, rate_per_minute, capacity=1):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available, then consumes it."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def create_session(pool_size=MAX_CONCURRENT_REQUESTS):
+    """Creates a keep-alive HTTP session with a connection pool sized for the worker count."""
+    session = requests.Session()
+    retries = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def get_air_quality_data(latitude, longitude, session=None, cache=None):
+    """Retrieves air quality data from the AirVisual API.
+
+    With a `cache`, a cached response is returned without a call while its reading is still current.
+    """
+    if cache is not None:
+        cached = cache.get(latitude, longitude)
+        if cached is not None:
+            return cached
+    url = f"{API_BASE_URL}/nearest_city"
+    params = {"lat": latitude, "lon": longitude, "key": API_KEY}
+    start = time.perf_counter()
     try:
-        response = requests.get(url)
+        response = (session or requests).get(url, params=params, timeout=REQUEST_TIMEOUT)
         response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
         data = response.json()
+        METRICS.observe_api_latency(time.perf_counter() - start)
+        if cache is not None and data.get('status') == 'success':
+            cache.put(latitude, longitude, data)
         return data
     except requests.exceptions.RequestException as e:
+        METRICS.observe_api_latency(time.perf_counter() - start, ok=False)
         print(f"API request failed: {e}")
         return None
 
@@ -80,39 +147,159 @@ def process_air_quality_data(data):
             'wind_direction': weather['wd'],
             'pressure': weather['pr']
         }
-        print("Processed Data:", processed_data) # Print the processed batch
+        logging.debug(f"Processed data: {processed_data}")
         return processed_data
     else:
-        print("process_air_quality_data: data was invalid")
+        logging.warning("process_air_quality_data: data was invalid")
         return None
 
-def fetch_and_store_data(location): #modified to accept one location
-    """Fetches air quality data for the provided location and stores it in the database."""
-    conn = create_database_connection("data/raw/air_quality_data.db")
+def load_response_cache():
+    """The persistent response cache, or None when API_CACHE_ENABLED is off."""
+    return ResponseCache.load() if API_CACHE_ENABLED else None
+
+def fetch_and_store_data(location, conn=None, cache=None): #modified to accept one location
+    """Fetches air quality data for the provided location and stores it in the database.
+
+    Pass a long-lived `conn` to reuse it across calls; otherwise a connection is opened and closed here.
+    The write is skipped when the station's reading ts has not changed since the last stored one.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = create_database_connection(DB_FILE)
+    if cache is None:
+        cache = load_response_cache()
     if conn:
         latitude = location["latitude"]
         longitude = location["longitude"]
-        api_data = get_air_quality_data(latitude, longitude)
+        api_data = get_air_quality_data(latitude, longitude, cache=cache)
         if api_data:
             processed_data = process_air_quality_data(api_data)
+            if processed_data and cache is not None and not cache.new_readings([processed_data]):
+                logging.info(f"Reading {processed_data['timestamp']} for ({latitude}, {longitude}) already stored; skipping write.")
+                processed_data = None
             if processed_data:
                 try:
                     insert_air_quality_data(conn, processed_data)
+                    if cache is not None:
+                        cache.mark_stored([processed_data])
                 except sqlite3.IntegrityError as e:
                     logging.warning(f"Database Integrity Error: {e}. Data not inserted: {processed_data}")
                 except Exception as e:
                     logging.error(f"Database Error: {e}. Data not inserted: {processed_data}")
-        remove_duplicate_data(conn)  # call to remove duplicates
-        conn.close()
+        if cache is not None:
+            cache.save()
+        if own_conn:
+            conn.close()
     else:
         logging.error("Failed to connect to the database.")
 
 
-def run_scheduler():
-    """Runs the scheduler to fetch and store data hourly."""
+def fetch_all_air_quality_data(locations, max_workers=MAX_CONCURRENT_REQUESTS, rate_limiter=None, session=None, cache=None):
+    """Fetches air quality data for all locations concurrently over a pooled session.
+
+    Returns a list of (location, api_data) pairs in the same order as `locations`. Locations served
+    from `cache` use neither an API call nor a rate-limit token.
+    """
+    if rate_limiter is None:
+        rate_limiter = TokenBucket(API_RATE_LIMIT_PER_MINUTE, API_RATE_LIMIT_BURST)
+    own_session = session is None
+    if own_session:
+        session = create_session(max_workers)
+
+    def fetch(location):
+        if cache is not None:
+            cached = cache.get(location["latitude"], location["longitude"])
+            if cached is not None:
+                return cached
+        rate_limiter.acquire()
+        return get_air_quality_data(location["latitude"], location["longitude"], session=session, cache=cache)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(fetch, locations))
+    finally:
+        if own_session:
+            session.close()
+    return list(zip(locations, results))
+
+def fetch_and_store_all(locations=None, max_workers=MAX_CONCURRENT_REQUESTS, rate_limiter=None, session=None, conn=None, cache=None):
+    """Fetches every location in one concurrent sweep and bulk-writes the results in one transaction.
+
+    Readings whose station ts is unchanged since the last stored one are not written, so re-runs
+    within the hour make no API calls and no writes. `cache` defaults to the persistent response cache.
+    """
+    if locations is None:
+        locations = load_locations()
+    if not locations:
+        return 0
+    if cache is None:
+        cache = load_response_cache()
+
+    with METRICS.stage('ingest.fetch') as record:
+        hits_before = cache.hits if cache is not None else 0
+        responses = fetch_all_air_quality_data(locations, max_workers, rate_limiter, session, cache)
+        record['rows'] = len(responses)
+        record['cache_hits'] = cache.hits - hits_before if cache is not None else 0
+    logging.info(f"Fetched {len(responses)} locations in {record['seconds']:.2f}s ({record['cache_hits']} from cache).")
+    records = [process_air_quality_data(api_data) for _, api_data in responses]
+    if cache is not None:
+        fetched = sum(1 for r in records if r)
+        records = cache.new_readings(records)
+        logging.info(f"{fetched - len(records)} readings already stored or repeated in this sweep; {len(records)} to store.")
+        if not records:
+            cache.save()
+            return 0
+
+    own_conn = conn is None
+    if own_conn:
+        conn = create_database_connection(DB_FILE)
+    if not conn:
+        logging.error("Failed to connect to the database.")
+        return 0
+    stored = 0
+    try:
+        stored = insert_air_quality_data_bulk(conn, records)
+        if cache is not None:
+            cache.mark_stored(records)
+    except sqlite3.Error as e:
+        logging.error(f"Database Error: {e}. Sweep of {len(records)} records not inserted.")
+    finally:
+        if cache is not None:
+            cache.save()
+        if own_conn:
+            conn.close()
+    logging.info(f"Stored {stored} new readings from {len(responses)} locations.")
+    return stored
+
+def run_ingestion(conn=None):
+    """Runs a single concurrent sweep (no scheduler loop); used as the pipeline's ingestion stage."""
+    own_conn = conn is None
+    if own_conn:
+        conn = create_database_connection(DB_FILE)
+    if not conn:
+        logging.error("Failed to connect to the database.")
+        return 0
+    try:
+        prepare_database(conn)
+        return fetch_and_store_all(conn=conn)
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def run_scheduler(mode=INGESTION_MODE, conn=None):
+    """Runs the scheduler to fetch and store data hourly over one long-lived connection."""
     all_locations = load_locations()
     if not all_locations:
         return
+    cache = load_response_cache() # Loaded once and shared by every scheduled call
+
+    if mode == "concurrent":
+        logging.info(f"Scheduling a concurrent sweep of {len(all_locations)} locations every hour.")
+        schedule.every().hour.at(":00").do(fetch_and_store_all, all_locations, conn=conn, cache=cache)
+        while True:
+            schedule.run_pending()
+            time.sleep(1)
 
     interval_minutes = 60 / len(all_locations)  # Calculate interval.
     logging.info(f"Scheduling requests every {interval_minutes} minutes.")
@@ -121,7 +308,7 @@ def run_scheduler():
         for i, location in enumerate(all_locations):
             minute_offset = i * interval_minutes
             schedule.every().hour.at(f":{int(minute_offset):02}") \
-                .do(fetch_and_store_data, location)
+                .do(fetch_and_store_data, location, conn, cache)
 
     schedule_requests() # Schedule for the current hour.
 
@@ -130,10 +317,12 @@ def run_scheduler():
         time.sleep(1)
 
 if __name__ == "__main__":
-    conn = create_database_connection("data/raw/air_quality_data.db")
+    conn = create_database_connection(DB_FILE)
     if conn:
-        create_air_quality_table(conn)
-        conn.close()
-        run_scheduler()
+        prepare_database(conn)
+        try:
+            run_scheduler(conn=conn)
+        finally:
+            conn.close()
     else:
         logging.error("Failed to connect to the database.")
\ No newline at end of file
@@ -1,28 +1,29 @@
-import subprocess
+import os
 import schedule
 import time
 import logging
+from pipeline import Pipeline
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def run_script(script_name):
+PERSIST_INTERMEDIATES = os.getenv("PERSIST_INTERMEDIATES", "1") == "1" # Write cleaned/featured CSVs and the model each run
+
+def run_pipeline(pipeline):
+    """Runs every stage in-process; a failing stage stops the stages that depend on it."""
     try:
-        logging.info(f"Running {script_name}...")
-        subprocess.run(['python', script_name], check=True)
-        logging.info(f"{script_name} executed successfully.")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error running {script_name}: {e}")
+        logging.info("Running pipeline...")
+        pipeline.run()
+        logging.info("All stages executed.")
+    except Exception as e:
+        logging.error(f"Error running pipeline: {e}")
 
-def run_all_scripts():
-    run_script('api_retrieval.py')
-    run_script('data_cleaning.py')
-    run_script('feature_engineering.py')
-    run_script('model.py')
-    logging.info("All scripts executed.")
+if __name__ == "__main__":
+    # One long-lived pipeline, so imports and the cleaned frame are reused between hourly runs
+    pipeline = Pipeline(persist=PERSIST_INTERMEDIATES)
 
-# Schedule the pipeline to run hourly
-schedule.every().hour.at(":00").do(run_all_scripts)
+    # Schedule the pipeline to run hourly
+    schedule.every().hour.at(":00").do(run_pipeline, pipeline)
 
-while True:
-    schedule.run_pending()
-    time.sleep(1)
\ No newline at end of file
+    while True:
+        schedule.run_pending()
+        time.sleep(1)
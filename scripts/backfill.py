@@ -0,0 +1,184 @@
+import os
+import gzip
+import json
+import logging
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from api_retrieval import DB_FILE, prepare_database, process_air_quality_data
+from database_operations import create_database_connection, insert_air_quality_data_bulk
+from metrics import METRICS
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+state_path = os.path.join(script_dir, "..", "data", "raw", "backfill_state.json")
+
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", str(os.cpu_count() or 1))) # Parser processes; 1 parses in this process
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "20000")) # Recorded responses per parse task and per insert transaction
+
+# Recordings: one response per line (.ndjson, .jsonl) or one response or list of responses per file (.json), optionally gzipped
+NDJSON_EXTENSIONS = (".ndjson", ".jsonl")
+RECORDING_EXTENSIONS = NDJSON_EXTENSIONS + (".json",)
+
+def _base_name(path):
+    return path[:-3] if path.endswith(".gz") else path
+
+def find_recordings(paths):
+    """Recording files under `paths` (files or directories), directory contents in name order."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root, name) for name in sorted(names) if _base_name(name).endswith(RECORDING_EXTENSIONS))
+        else:
+            files.append(path)
+    return files
+
+def _open(path):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+def iter_documents(path, offset=0):
+    """Yields (end offset, raw JSON document) from `offset` on; offsets are in the uncompressed stream."""
+    with _open(path) as f:
+        f.seek(offset)
+        if _base_name(path).endswith(NDJSON_EXTENSIONS):
+            for line in f:
+                offset += len(line)
+                if line.strip():
+                    yield offset, line
+        else:
+            doc = f.read()
+            if doc.strip():
+                yield offset + len(doc), doc
+
+def parse_responses(docs):
+    """Runs raw response documents through process_air_quality_data; returns (records, invalid count).
+
+    Module-level so it can run in the process pool.
+    """
+    records, invalid = [], 0
+    for doc in docs:
+        try:
+            parsed = json.loads(doc)
+        except ValueError:
+            invalid += 1
+            continue
+        for response in parsed if isinstance(parsed, list) else [parsed]:
+            record = None
+            if isinstance(response, dict) and response.get('status') == 'success':
+                try:
+                    record = process_air_quality_data(response)
+                except (KeyError, IndexError, TypeError): # Truncated or reshaped payload
+                    pass
+            if record:
+                records.append(record)
+            else:
+                invalid += 1
+    return records, invalid
+
+def _signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def load_backfill_state(db_file, path=None):
+    """Checkpoint of a backfill into `db_file`: {'database', 'files': {path: {'signature', 'offset'}}}."""
+    try:
+        with open(path or state_path, "r") as f:
+            state = json.load(f)
+        if state.get('database') == db_file:
+            return state
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    return {'database': db_file, 'files': {}}
+
+def save_backfill_state(state, path=None):
+    path = path or state_path
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+def _iter_batches(files, state, batch_size):
+    """Yields (documents, {file: end offset}) batches, starting each file at its checkpoint.
+
+    A file whose size or mtime changed since its checkpoint is replayed from the start.
+    """
+    docs, marks = [], {}
+    for path in files:
+        key = os.path.abspath(path)
+        signature = _signature(path)
+        entry = state['files'].get(key)
+        offset = entry['offset'] if entry and entry['signature'] == signature else 0
+        state['files'][key] = {'signature': signature, 'offset': offset}
+        for end, doc in iter_documents(path, offset):
+            docs.append(doc)
+            marks[key] = end
+            if len(docs) >= batch_size:
+                yield docs, marks
+                docs, marks = [], {}
+    if docs:
+        yield docs, marks
+
+def run_backfill(paths, conn, workers=BACKFILL_WORKERS, batch_size=BACKFILL_BATCH_SIZE, state_file=None, restart=False):
+    """Ingests recorded AirVisual responses from NDJSON/JSON files or directories into the database.
+
+    Batches are parsed across `workers` processes while the previous ones are written with
+    insert_air_quality_data_bulk, in file order. The checkpoint advances after each committed batch,
+    so an interrupted backfill resumes where it stopped; a batch committed just before an interruption
+    is replayed and skipped by the (station_id, timestamp) unique index. Returns a summary dict.
+    """
+    db_file = conn.execute("PRAGMA database_list").fetchone()[2]
+    state = {'database': db_file, 'files': {}} if restart else load_backfill_state(db_file, state_file)
+    files = find_recordings(paths)
+    summary = {'files': len(files), 'records': 0, 'invalid': 0, 'stored': 0}
+
+    def store(result, marks):
+        records, invalid = result
+        summary['records'] += len(records)
+        summary['invalid'] += invalid
+        summary['stored'] += insert_air_quality_data_bulk(conn, records)
+        for key, end in marks.items():
+            state['files'][key]['offset'] = end
+        save_backfill_state(state, state_file)
+        logging.info(f"Backfilled {summary['records']} readings ({summary['stored']} new, {summary['invalid']} invalid).")
+
+    with METRICS.stage('backfill') as record:
+        if workers <= 1:
+            for docs, marks in _iter_batches(files, state, batch_size):
+                store(parse_responses(docs), marks)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                pending = deque() # Bounded, so memory stays at ~workers batches however large the recordings are
+                for docs, marks in _iter_batches(files, state, batch_size):
+                    pending.append((executor.submit(parse_responses, docs), marks))
+                    if len(pending) > workers:
+                        future, marks = pending.popleft()
+                        store(future.result(), marks)
+                while pending:
+                    future, marks = pending.popleft()
+                    store(future.result(), marks)
+        save_backfill_state(state, state_file) # Also records files with nothing to replay
+        record['rows'] = summary['records']
+    logging.info(f"Backfill of {len(files)} files done in {record['seconds']:.2f}s: {summary['stored']} new readings "
+                 f"of {summary['records']}, {summary['invalid']} invalid responses skipped.")
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfills the database from recorded AirVisual responses.")
+    parser.add_argument("paths", nargs="+", help="NDJSON/JSON recordings (optionally .gz) or directories of them")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS, help="Parser processes")
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE, help="Responses per insert transaction")
+    parser.add_argument("--db", default=DB_FILE, help="Database file, relative to the repository root")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and replay every file")
+    args = parser.parse_args()
+
+    conn = create_database_connection(args.db)
+    if conn:
+        try:
+            prepare_database(conn)
+            run_backfill(args.paths, conn, args.workers, args.batch_size, restart=args.restart)
+        finally:
+            conn.close()
+    else:
+        logging.error("Failed to connect to the database.")
@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+from quantile_sketch import QuantileSketch, QUANTILE_SKETCH_SIZE
+from schema import INTEGER_COLUMNS
+
+# Declarative outlier rules, applied in order. Each rule's statistics are computed once per
+# column on the output of the previous rule, then applied with a single vectorized clip.
+#   mad            -> clip to median +/- multiplier * MAD
+#   quantile_cap   -> clip the top tail at quantile q
+#   quantile_floor -> clip the bottom tail at quantile q
+#   bounds         -> hard lower/upper limits
+# "columns": "numeric" selects every numeric column of the frame being fitted, except the id keys.
+CLEANING_RULES = [
+    {'rule': 'mad', 'columns': 'numeric', 'cap_multiplier': 3, 'floor_multiplier': 3},
+    # AQI, PM25, PM10 (High-end outliers are valid pollution events)
+    {'rule': 'quantile_cap', 'columns': ['aqi', 'pm25', 'pm10'], 'q': 0.99},
+    # Wind Speed (High end is valid)
+    {'rule': 'quantile_cap', 'columns': ['wind_speed'], 'q': 0.99},
+    # Pressure (Low end is valid)
+    {'rule': 'quantile_floor', 'columns': ['pressure'], 'q': 0.01},
+    # Humidity (Low end is valid)
+    {'rule': 'bounds', 'columns': ['humidity'], 'lower': 0},
+]
+
+def _rule_columns(df, rule):
+    if rule['columns'] == 'numeric':
+        return [col for col in df.select_dtypes(include=['number']).columns if col not in INTEGER_COLUMNS]
+    return [col for col in rule['columns'] if col in df.columns]
+
+def _fit_rule(values, rule):
+    """Returns (lower, upper) arrays for a 2-D block of column values; NaN means unbounded."""
+    n_cols = values.shape[1]
+    unbounded = np.full(n_cols, np.nan)
+    if rule['rule'] == 'mad':
+        median = np.nanmedian(values, axis=0)
+        mad = np.nanmedian(np.abs(values - median), axis=0)
+        return median - rule['floor_multiplier'] * mad, median + rule['cap_multiplier'] * mad
+    if rule['rule'] == 'quantile_cap':
+        return unbounded, np.nanquantile(values, rule['q'], axis=0)
+    if rule['rule'] == 'quantile_floor':
+        return np.nanquantile(values, rule['q'], axis=0), unbounded
+    if rule['rule'] == 'bounds':
+        lower = np.full(n_cols, rule.get('lower', np.nan), dtype=float)
+        upper = np.full(n_cols, rule.get('upper', np.nan), dtype=float)
+        return lower, upper
+    raise ValueError(f"Unknown cleaning rule: {rule['rule']}")
+
+def _clip_block(values, lower, upper):
+    # NaN bounds mean "no bound"; NaN values stay NaN
+    lower = np.where(np.isnan(lower), -np.inf, lower)
+    upper = np.where(np.isnan(upper), np.inf, upper)
+    return np.clip(values, lower, upper)
+
+def fit_cleaning_rules(df, rules=CLEANING_RULES):
+    """Computes every rule's bounds once per column.
+
+    Returns a JSON-serialisable list of {'rule', 'bounds': {column: [lower, upper]}} steps,
+    with None for an open bound, so the result can be persisted and reused on new rows.
+    """
+    work = {}
+    fitted = []
+    for rule in rules:
+        columns = _rule_columns(df, rule)
+        if not columns:
+            continue
+        values = np.column_stack([work[col] if col in work else df[col].to_numpy(dtype=float) for col in columns])
+        lower, upper = _fit_rule(values, rule)
+        clipped = _clip_block(values, lower, upper)
+        for i, col in enumerate(columns):
+            work[col] = clipped[:, i]
+        fitted.append({
+            'rule': rule['rule'],
+            'bounds': {
+                col: [None if np.isnan(lo) else float(lo), None if np.isnan(hi) else float(hi)]
+                for col, lo, hi in zip(columns, lower, upper)
+            },
+        })
+    return fitted
+
+def fit_cleaning_rules_streaming(chunks, rules=CLEANING_RULES, sketch_size=QUANTILE_SKETCH_SIZE):
+    """fit_cleaning_rules for data that does not fit in memory.
+
+    `chunks` is a callable returning a fresh iterator of prepared frames; it is called once for a
+    first pass that sketches every rule column, plus once per 'mad' rule to sketch the absolute
+    deviations from its median. Quantile rules need no extra pass: clipping is monotonic, so the
+    quantile of the clipped column is the earlier steps' clips applied to the sketched quantile.
+    Exact (same bounds as fit_cleaning_rules) while a column has at most `sketch_size` values.
+    """
+    sketches = {}
+    columns_per_rule = None
+    for chunk in chunks():
+        if columns_per_rule is None:
+            columns_per_rule = [_rule_columns(chunk, rule) for rule in rules]
+            sketches = {col: QuantileSketch(sketch_size) for columns in columns_per_rule for col in columns}
+        for col, sketch in sketches.items():
+            sketch.update(chunk[col].to_numpy(dtype=float))
+    if columns_per_rule is None:
+        return []
+
+    fitted = []
+
+    def quantiles_after_previous_steps(columns, q):
+        values = np.array([sketches[col].quantile(q) for col in columns])
+        for step in fitted:
+            lower = np.array([step['bounds'].get(col, [None, None])[0] for col in columns], dtype=float)
+            upper = np.array([step['bounds'].get(col, [None, None])[1] for col in columns], dtype=float)
+            values = _clip_block(values, lower, upper)
+        return values
+
+    for rule, columns in zip(rules, columns_per_rule):
+        if not columns:
+            continue
+        n_cols = len(columns)
+        if rule['rule'] == 'mad':
+            median = quantiles_after_previous_steps(columns, 0.5)
+            deviations = [QuantileSketch(sketch_size) for _ in columns]
+            for chunk in chunks():
+                values = apply_cleaning_rules(chunk[columns], fitted).to_numpy(dtype=float)
+                for sketch, column_deviation in zip(deviations, np.abs(values - median).T):
+                    sketch.update(column_deviation)
+            mad = np.array([sketch.quantile(0.5) for sketch in deviations])
+            lower, upper = median - rule['floor_multiplier'] * mad, median + rule['cap_multiplier'] * mad
+        elif rule['rule'] == 'quantile_cap':
+            lower, upper = np.full(n_cols, np.nan), quantiles_after_previous_steps(columns, rule['q'])
+        elif rule['rule'] == 'quantile_floor':
+            lower, upper = quantiles_after_previous_steps(columns, rule['q']), np.full(n_cols, np.nan)
+        else:
+            lower, upper = _fit_rule(np.empty((0, n_cols)), rule)
+        fitted.append({
+            'rule': rule['rule'],
+            'bounds': {
+                col: [None if np.isnan(lo) else float(lo), None if np.isnan(hi) else float(hi)]
+                for col, lo, hi in zip(columns, lower, upper)
+            },
+        })
+    return fitted
+
+def apply_cleaning_rules(df, fitted):
+    """Applies fitted bounds with one vectorized clip per rule step."""
+    df = df.copy()
+    for step in fitted:
+        columns = [col for col in step['bounds'] if col in df.columns]
+        if not columns:
+            continue
+        lower = np.array([np.nan if step['bounds'][col][0] is None else step['bounds'][col][0] for col in columns])
+        upper = np.array([np.nan if step['bounds'][col][1] is None else step['bounds'][col][1] for col in columns])
+        values = df[columns].to_numpy(dtype=float)
+        # Clip in float64, store back in each column's own dtype (float32 under the pipeline schema)
+        df[columns] = pd.DataFrame(_clip_block(values, lower, upper), columns=columns, index=df.index).astype(df[columns].dtypes)
+    return df
+
+def clean_outliers(df, rules=CLEANING_RULES):
+    """Fits and applies the rule table in one call."""
+    fitted = fit_cleaning_rules(df, rules)
+    return apply_cleaning_rules(df, fitted), fitted
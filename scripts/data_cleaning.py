@@ -1,153 +1,388 @@
 import pandas as pd
 import sqlite3
 import os
+import json
 import numpy as np
 import logging
-import smtplib
-from email.mime.text import MIMEText
 import datetime
 
-from dotenv import load_dotenv
-
-load_dotenv() # Load the env file with the email logins
+from cleaning_rules import fit_cleaning_rules, fit_cleaning_rules_streaming, apply_cleaning_rules
+import storage
+from schema import apply_schema, log_memory
+from metrics import METRICS
+from retention import load_history, iter_history, load_recent_history
+from alerts import get_dispatcher
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def load_data_from_sqlite(db_path):
-    conn = sqlite3.connect(db_path)
-    query = "SELECT * FROM air_quality"
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
 # Get the script Directory
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
 # Path to the SQLite database
 db_path = os.path.join(script_dir, "..", "data", "raw", "air_quality_data.db")
 
-df = load_data_from_sqlite(db_path)
-
+# Path to the incremental-cleaning watermark/state (the cleaned output itself lives in storage)
+state_path = os.path.join(script_dir, "..", "data", "processed", "cleaning_state.json")
 
+CLEANING_MODE = os.getenv("CLEANING_MODE", "incremental") # "incremental" or "full" (rebuild the cleaned dataset)
+STATS_WINDOW_ROWS = int(os.getenv("CLEANING_STATS_WINDOW_ROWS", "50000")) # Recent rows used for the capping statistics
+CHUNK_ROWS = int(os.getenv("CLEANING_CHUNK_ROWS", "0")) # >0: full rebuilds stream the table in chunks of this many rows
 
-# ... (Data Cleaning Logic) ...
+EMPTY_COLUMNS = ['o3', 'no2', 'so2', 'co']
+CLEANED_SCHEMA_VERSION = 2 # Bump when the cleaned dataset's columns change (2: station_id); older state forces a full rebuild
 
-# 1. Outlier Handling and Data Cleaning Logic
+def load_data_from_sqlite(db_path):
+    """Loads the full history: archived readings (see retention.py) plus the hot table."""
+    conn = sqlite3.connect(db_path)
+    df = apply_schema(load_history(conn))
+    conn.close()
+    return df
 
-# Drop empty columns
-df = df.drop(['o3', 'no2', 'so2', 'co'], axis=1)
+def load_new_rows_from_sqlite(db_path, after_id):
+    """Loads only rows added after the watermark, using the rowid primary key index."""
+    conn = sqlite3.connect(db_path)
+    query = "SELECT * FROM air_quality WHERE id > ? ORDER BY id"
+    df = apply_schema(pd.read_sql_query(query, conn, params=(after_id,)))
+    conn.close()
+    return df
 
-# Timestamp conversion
-df['timestamp'] = pd.to_datetime(df['timestamp'])
+def load_recent_window_from_sqlite(db_path, window_rows):
+    """Loads the most recent `window_rows` rows, used to recompute the capping statistics.
 
-# Remove redundant ID column
-df = df.drop('id', axis=1)
+    Tops up from the archive when the hot table holds fewer, so a freshly archived database does not
+    fit its caps on a handful of new rows.
+    """
+    conn = sqlite3.connect(db_path)
+    df = apply_schema(load_recent_history(conn, window_rows))
+    conn.close()
+    return df
 
-# Handle Duplicates
-df = df.drop_duplicates()
+def iter_data_from_sqlite(db_path, chunksize, after_id=0):
+    """Yields the archived then the hot readings, `chunksize` rows at a time, so memory is bounded by one chunk."""
+    conn = sqlite3.connect(db_path)
+    try:
+        for chunk in iter_history(conn, chunksize, after_id):
+            yield apply_schema(chunk)
+    finally:
+        conn.close()
 
-# Handle Inconsistencies
-df['city'] = df['city'].str.strip()
 
-# Outlier Handling
-def robust_cap_floor(series, cap_multiplier=3, floor_multiplier=3):
-    median = series.median()
-    mad = np.median(np.abs(series - median))
-    cap = median + cap_multiplier * mad
-    floor = median - floor_multiplier * mad
-    return series.apply(lambda x: min(max(x, floor), cap))
+# ... (Data Cleaning Logic) ...
 
-# Apply robust capping/flooring to numerical columns
-numerical_cols = df.select_dtypes(include=['number']).columns
-for col in numerical_cols:
-    df[col] = robust_cap_floor(df[col])
+# 1. Outlier Handling and Data Cleaning Logic
+def prepare_data(df):
+    """Drops empty/redundant columns, parses timestamps and normalises text fields."""
+    # Drop empty columns
+    df = df.drop(EMPTY_COLUMNS, axis=1)
 
-# Conditional Outlier Handling
-# AQI, PM25, PM10 (High-end outliers are valid pollution events)
-for col in ['aqi', 'pm25', 'pm10']:
-    df[col] = df[col].apply(lambda x: x if x <= df[col].quantile(0.99) else df[col].quantile(0.99))
+    # Timestamp conversion
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
 
-# Humidity (Low end is valid)
-df['humidity'] = df['humidity'].apply(lambda x: x if x >= 0 else 0)
+    # Remove redundant ID column
+    df = df.drop('id', axis=1)
 
-# Wind Speed (High end is valid)
-df['wind_speed'] = df['wind_speed'].apply(lambda x: x if x <= df['wind_speed'].quantile(0.99) else df['wind_speed'].quantile(0.99))
+    # Handle Duplicates
+    df = df.drop_duplicates()
 
-# Pressure (Low end is valid)
-df['pressure'] = df['pressure'].apply(lambda x: x if x >= df['pressure'].quantile(0.01) else df['pressure'].quantile(0.01))
+    # Handle Inconsistencies
+    df['city'] = df['city'].str.strip()
+    return apply_schema(df) # The strip returns plain strings; back to a categorical
 
-# Store the cleaned data
-# Construct the path to save cleaned_data.csv
-csv_path = os.path.join(script_dir, "..", "data", "processed", "cleaned_data.csv")
+# Outlier Handling: see the rule table in cleaning_rules.CLEANING_RULES
 
-# Save the cleaned data to the CSV file
-df.to_csv(csv_path, index=False)
+def load_cleaning_state():
+    """Loads the persisted watermark and capping statistics, or None on first run or after a schema change."""
+    try:
+        with open(state_path, "r") as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if state.get('schema_version') != CLEANED_SCHEMA_VERSION:
+        logging.info("Cleaned dataset predates the current schema; it will be rebuilt.")
+        return None
+    return state
+
+def make_cleaning_state(last_id, last_timestamp, stats):
+    return {
+        'schema_version': CLEANED_SCHEMA_VERSION,
+        'last_id': int(last_id),
+        'last_timestamp': str(last_timestamp),
+        'stats': stats,
+        'updated_at': datetime.datetime.utcnow().isoformat(),
+    }
 
+def save_cleaning_state(state):
+    with open(state_path, "w") as f:
+        json.dump(state, f, indent=2)
+
+def run_full_cleaning(persist=True):
+    """Cleans the whole table and resets the watermark.
+
+    Returns (cleaned DataFrame, state). With persist=True, rewrites the cleaned dataset and the state file.
+    """
+    with METRICS.stage('clean.load') as record:
+        raw = load_data_from_sqlite(db_path)
+        record['rows'] = len(raw)
+    if raw.empty:
+        logging.info("No rows to clean.")
+        return prepare_data(raw), None
+    log_memory('raw', raw)
+    with METRICS.stage('clean.rules') as record:
+        df = prepare_data(raw)
+        stats = fit_cleaning_rules(df)
+        df = apply_cleaning_rules(df, stats)
+        record['rows'] = len(df)
+    state = make_cleaning_state(raw['id'].max(), raw['timestamp'].max(), stats)
+
+    if persist:
+        # Save the cleaned data
+        with METRICS.stage('clean.write') as record:
+            storage.save_dataset(df, 'cleaned')
+            record['rows'] = len(df)
+        save_cleaning_state(state)
+    logging.info(f"Full cleaning rebuilt {len(df)} rows.")
+    return df, state
+
+def run_streaming_cleaning(persist=True, chunksize=None):
+    """Full rebuild in bounded memory, for histories too large to load at once.
+
+    Two read passes fit the capping statistics with streaming quantile sketches (values, then
+    deviations from the median for MAD); a third cleans and writes one chunk at a time.
+    Duplicate rows are dropped within each chunk; the natural-key unique index keeps them from
+    reaching the table in the first place. Returns (rows cleaned, state, validation report of all chunks).
+    """
+    chunksize = chunksize or CHUNK_ROWS
+
+    def prepared_chunks():
+        return (prepare_data(chunk) for chunk in iter_data_from_sqlite(db_path, chunksize))
+
+    with METRICS.stage('clean.sketch'):
+        stats = fit_cleaning_rules_streaming(prepared_chunks)
+    rows, last_id, last_timestamp, report = 0, None, None, None
+    if persist:
+        storage.clear_dataset('cleaned')
+    with METRICS.stage('clean.stream') as record:
+        for number, chunk in enumerate(iter_data_from_sqlite(db_path, chunksize)):
+            df = apply_cleaning_rules(prepare_data(chunk), stats)
+            if persist: # New files per chunk: no partition is read back or rewritten
+                storage.save_dataset_chunk(df, 'cleaned', number)
+            report = merge_validation_reports(report, run_validation(df))
+            rows += len(df)
+            # Archived chunks come first and can hold later ids (backfilled readings), so keep running maxima
+            last_id = chunk['id'].max() if last_id is None else max(last_id, chunk['id'].max())
+            last_timestamp = chunk['timestamp'].max() if last_timestamp is None else max(last_timestamp, chunk['timestamp'].max())
+        record['rows'] = rows
+    if last_id is None:
+        logging.info("No rows to clean.")
+        return 0, None, None
+
+    state = make_cleaning_state(last_id, last_timestamp, stats)
+    if persist:
+        save_cleaning_state(state)
+    logging.info(f"Streaming cleaning rebuilt {rows} rows in chunks of {chunksize}.")
+    return rows, state, report
+
+def run_incremental_cleaning(state, persist=True):
+    """Cleans only rows added since the watermark in `state`.
+
+    Returns (new cleaned rows, updated state). With persist=True, appends to the cleaned dataset and saves the state.
+    """
+    with METRICS.stage('clean.load') as record:
+        raw = load_new_rows_from_sqlite(db_path, state['last_id'])
+        record['rows'] = len(raw)
+    if raw.empty:
+        logging.info(f"No new rows since id {state['last_id']}.")
+        return prepare_data(raw), state
+
+    # Statistics come from a bounded window of recent history, never a full rescan
+    with METRICS.stage('clean.rules') as record:
+        window = prepare_data(load_recent_window_from_sqlite(db_path, STATS_WINDOW_ROWS))
+        stats = fit_cleaning_rules(window)
+        df = apply_cleaning_rules(prepare_data(raw), stats)
+        record['rows'] = len(df)
+    state = make_cleaning_state(raw['id'].max(), raw['timestamp'].max(), stats)
+
+    if persist:
+        with METRICS.stage('clean.write') as record:
+            storage.save_dataset(df, 'cleaned', append=True)
+            record['rows'] = len(df)
+        save_cleaning_state(state)
+    logging.info(f"Incremental cleaning cleaned {len(df)} rows (ids {raw['id'].min()}-{raw['id'].max()}).")
+    return df, state
+
+def run_cleaning(full_refresh=None, persist=True):
+    """Runs incremental cleaning, falling back to a full rebuild when requested or when no state exists."""
+    if full_refresh is None:
+        full_refresh = CLEANING_MODE == "full"
+    state = load_cleaning_state()
+    if full_refresh or state is None or not storage.dataset_exists('cleaned'):
+        df, _ = run_full_cleaning(persist)
+    else:
+        df, _ = run_incremental_cleaning(state, persist)
+    return df
 
 
 # 2. Data Validation and Alerting
+# Declarative validation checks, evaluated together in one vectorized pass (see run_validation).
+#   not_null -> the column has no missing values
+#   min      -> no value below 'lower' (at or below it with 'exclusive'); missing values pass
+#   range    -> every value within ['lower', 'upper']; missing values fail
+VALIDATION_RULES = [
+    {'check': 'timestamp', 'rule': 'not_null', 'column': 'timestamp'},
+    {'check': 'aqi_range', 'rule': 'min', 'column': 'aqi', 'lower': 0},
+    {'check': 'pm25_range', 'rule': 'min', 'column': 'pm25', 'lower': 0},
+    {'check': 'pm10_range', 'rule': 'min', 'column': 'pm10', 'lower': 0},
+    {'check': 'humidity_range', 'rule': 'range', 'column': 'humidity', 'lower': 0, 'upper': 100},
+    {'check': 'wind_direction_range', 'rule': 'range', 'column': 'wind_direction', 'lower': 0, 'upper': 360},
+    {'check': 'pressure_range', 'rule': 'min', 'column': 'pressure', 'lower': 900, 'exclusive': True}, # A logical minimum
+]
+MAX_REPORTED_READINGS = 20 # Failing readings listed per report
+MAX_REPORTED_STATIONS = 5 # Stations named per failed check in an alert
+
+def _failure_matrix(df, rules):
+    """(rules x rows) boolean failures, plus the rule columns' values for the statistics.
+
+    One contiguous row per rule, so every statistic is a contiguous reduction.
+    """
+    values = np.empty((len(rules), len(df)))
+    for i, r in enumerate(rules):
+        values[i] = df[r['column']].isna().to_numpy() if r['rule'] == 'not_null' else df[r['column']].to_numpy(dtype=float, na_value=np.nan)
+    lower = np.array([
+        -np.inf if r.get('lower') is None else np.nextafter(r['lower'], np.inf) if r.get('exclusive') else r['lower']
+        for r in rules
+    ], dtype=float)[:, None]
+    upper = np.array([np.inf if r.get('upper') is None else r['upper'] for r in rules], dtype=float)[:, None]
+    not_null = [i for i, r in enumerate(rules) if r['rule'] == 'not_null']
+    nan_fails = [i for i, r in enumerate(rules) if r['rule'] == 'range']
+    missing = np.isnan(values)
+    # In place, to keep to one (rules x rows) temporary; NaN compares False, so it only fails via nan_fails
+    failed = np.less(values, lower)
+    failed |= np.greater(values, upper)
+    failed[nan_fails] |= missing[nan_fails]
+    failed[not_null] = values[not_null] > 0 # not_null rows hold the missing mask (1.0 = missing)
+    return failed, values, missing
+
+def run_validation(df, rules=VALIDATION_RULES):
+    """Evaluates every validation rule in one vectorized pass and reports what failed where.
+
+    Returns a JSON-serialisable report: the row count, and per check the failing row count, the
+    column's min/max and missing count, and failing rows per station; plus the number of readings
+    failing any check and the first MAX_REPORTED_READINGS of them as [station, timestamp].
+    Reports of chunks combine with merge_validation_reports.
+    """
+    rules = [r for r in rules if r['column'] in df.columns]
+    report = {'rows': len(df), 'failed_rows': 0, 'failed_readings': [], 'checks': {}}
+    if df.empty or not rules:
+        for r in rules:
+            report['checks'][r['check']] = {'failed_rows': 0, 'min': None, 'max': None, 'missing': 0, 'stations': {}}
+        return report
+    failed, values, missing = _failure_matrix(df, rules)
+    failed_counts = np.count_nonzero(failed, axis=1)
+    missing_counts = np.count_nonzero(missing, axis=1)
+    mins = np.fmin.reduce(values, axis=1) # NaN-skipping, no warning for all-missing columns
+    maxs = np.fmax.reduce(values, axis=1)
+    if failed_counts.any(): # Station breakdown only when something failed
+        station_keys = df['station_id'] if 'station_id' in df.columns else df['latitude'].astype(str) + "," + df['longitude'].astype(str)
+        codes, stations = pd.factorize(station_keys, use_na_sentinel=False)
+        stations = np.asarray(stations).astype(str)
+
+    for i, r in enumerate(rules):
+        check = {'failed_rows': int(failed_counts[i]), 'missing': int(missing_counts[i]) if r['rule'] != 'not_null' else int(failed_counts[i]),
+                 'min': None, 'max': None, 'stations': {}}
+        if r['rule'] != 'not_null':
+            check['min'] = None if np.isnan(mins[i]) else float(mins[i])
+            check['max'] = None if np.isnan(maxs[i]) else float(maxs[i])
+        if check['failed_rows']:
+            counts = np.bincount(codes[failed[i]], minlength=len(stations))
+            check['stations'] = {stations[j]: int(counts[j]) for j in np.flatnonzero(counts)}
+        report['checks'][r['check']] = check
+
+    if failed_counts.any():
+        row_failed = failed.any(axis=0)
+        report['failed_rows'] = int(row_failed.sum())
+        first = np.flatnonzero(row_failed)[:MAX_REPORTED_READINGS]
+        timestamps = [str(ts) for ts in df['timestamp'].iloc[first]] if 'timestamp' in df.columns else [None] * len(first)
+        report['failed_readings'] = [[station, ts] for station, ts in zip(stations[codes[first]].tolist(), timestamps)]
+    return report
+
+def merge_validation_reports(a, b):
+    """Combines the reports of two disjoint sets of rows (e.g. consecutive chunks)."""
+    if a is None:
+        return b
+    merged = {'rows': a['rows'] + b['rows'], 'failed_rows': a['failed_rows'] + b['failed_rows'],
+              'failed_readings': (a['failed_readings'] + b['failed_readings'])[:MAX_REPORTED_READINGS], 'checks': {}}
+    for name in a['checks'].keys() | b['checks'].keys():
+        empty = {'failed_rows': 0, 'min': None, 'max': None, 'missing': 0, 'stations': {}}
+        x, y = a['checks'].get(name, empty), b['checks'].get(name, empty)
+        stations = dict(x['stations'])
+        for station, count in y['stations'].items():
+            stations[station] = stations.get(station, 0) + count
+        merged['checks'][name] = {
+            'failed_rows': x['failed_rows'] + y['failed_rows'], 'missing': x['missing'] + y['missing'],
+            'min': min((v for v in (x['min'], y['min']) if v is not None), default=None),
+            'max': max((v for v in (x['max'], y['max']) if v is not None), default=None),
+            'stations': stations,
+        }
+    return merged
+
 def validate_data(df):
-    checks = {
-        'timestamp': df['timestamp'].isnull().sum() == 0,
-        'aqi_range': df['aqi'].min() >= 0,
-        'pm25_range': df['pm25'].min() >= 0,
-        'pm10_range': df['pm10'].min() >= 0,
-        'humidity_range': df['humidity'].between(0, 100).all(),
-        'wind_direction_range': df['wind_direction'].between(0, 360).all(),
-        'pressure_range': df['pressure'].min() > 900, # A logical minimum
+    """{check: passed} for every validation rule."""
+    return {check: result['failed_rows'] == 0 for check, result in run_validation(df)['checks'].items()}
+
+def _check_details(rule, result):
+    if rule['rule'] == 'not_null':
+        details = f"Null {rule['column']}s found: {result['failed_rows']}"
+    elif rule['rule'] == 'min':
+        details = f"Min {rule['column']}: {result['min']}, {result['failed_rows']} rows {'at or ' if rule.get('exclusive') else ''}below {rule['lower']}"
+    else:
+        details = f"{rule['column']} values outside {rule['lower']}-{rule['upper']} range: {result['failed_rows']} rows"
+    worst = sorted(result['stations'].items(), key=lambda item: -item[1])[:MAX_REPORTED_STATIONS]
+    if worst:
+        more = len(result['stations']) - len(worst)
+        details += "; stations " + ", ".join(f"{station} ({count})" for station, count in worst) + (f" and {more} more" if more else "")
+    return details
+
+def validation_messages(report, rules=VALIDATION_RULES):
+    """{check: alert message} for every failed check of a report."""
+    return {
+        r['check']: f"Data validation failed: {r['check']} ({_check_details(r, report['checks'][r['check']])})"
+        for r in rules if report['checks'].get(r['check'], {}).get('failed_rows')
     }
-    return checks
-
-def send_alert_email(message):
-    sender_email = os.getenv("SENDER_EMAIL")
-    sender_password = os.getenv("SENDER_PASSWORD")
-    receiver_email = os.getenv("RECEIVER_EMAIL")
 
-    msg = MIMEText(message)
-    msg['Subject'] = "Data Inconsistency Alert"
-    msg['From'] = sender_email
-    msg['To'] = receiver_email
-
-    try:
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
-            smtp.login(sender_email, sender_password)
-            smtp.send_message(msg)
-        logging.info("Alert email sent successfully.")
-    except Exception as e:
-        logging.error(f"Failed to send alert email: {e}")
-
-def check_for_inconsistencies(df):
-    validation_results = validate_data(df)
-    error_messages = []
-    for check, result in validation_results.items():
-        if not result:
-            error_messages.append(f"Data validation failed: {check} ({get_error_details(df, check)})")
-            logging.error(f"Data validation failed: {check} ({get_error_details(df, check)})")
+def find_inconsistencies(df):
+    messages = list(validation_messages(run_validation(df)).values())
+    for message in messages:
+        logging.error(message)
+    return messages
+
+def check_for_inconsistencies(df, report=None):
+    """Validates `df` (unless its `report` is already known) and queues an alert for the failed checks; returns the report."""
+    if report is None:
+        with METRICS.stage('validate') as record:
+            report = run_validation(df)
+            record['rows'] = report['rows']
+    send_inconsistency_alert(validation_messages(report))
+    return report
+
+def send_inconsistency_alert(error_messages):
+    """Hands failed checks ({check: message}, or a list of messages) to the background alert dispatcher.
+
+    Returns at once; the email is batched, rate-limited and sent over a pooled SMTP connection,
+    and a check already alerted within ALERT_COOLDOWN_SECONDS is not repeated.
+    """
     if error_messages:
-        alert_message = "Wagwan Data Scientist,\n\n"
-        alert_message += "This is an automated alert from the Air Quality Project data pipeline.\n\n"
-        alert_message += "The following data inconsistencies have been detected during the validation process:\n\n"
-        alert_message += "\n".join([f"- {msg}" for msg in error_messages])
-        alert_message += f"\n\nTimestamp of alert: {datetime.datetime.utcnow()} (UTC)\n\n"
-        alert_message += "Sincerely,\n\nThe Air Quality Project Automated Alert System"
-        alert_message += "\n\nYour buoy Richie🐣"
-        send_alert_email(alert_message)
-
-def get_error_details(df, check):
-    if check == 'timestamp':
-        return f"Null timestamps found: {df['timestamp'].isnull().sum()}"
-    elif check == 'aqi_range':
-        return f"Min AQI: {df['aqi'].min()}"
-    elif check == 'pm25_range':
-        return f"Min PM25: {df['pm25'].min()}"
-    elif check == 'pm10_range':
-        return f"Min PM10: {df['pm10'].min()}"
-    elif check == 'humidity_range':
-        return f"Humidity values outside 0-100 range: {df[~df['humidity'].between(0, 100)].shape[0]} rows"
-    elif check == 'wind_direction_range':
-        return f"Wind direction values outside 0-360 range: {df[~df['wind_direction'].between(0, 360)].shape[0]} rows"
-    elif check == 'pressure_range':
-        return f"Min Pressure: {df['pressure'].min()}"
-    return "Details not available"
-
-check_for_inconsistencies(df)
-
+        for message in (error_messages.values() if isinstance(error_messages, dict) else error_messages):
+            logging.error(message)
+        get_dispatcher().submit(error_messages)
+
+if __name__ == "__main__":
+    full_rebuild = CLEANING_MODE == "full" or load_cleaning_state() is None or not storage.dataset_exists('cleaned')
+    if CHUNK_ROWS > 0 and full_rebuild:
+        # Each chunk is validated as it is written; one alert covers the whole run
+        _, _, report = run_streaming_cleaning()
+        if report is not None:
+            send_inconsistency_alert(validation_messages(report))
+    else:
+        df = run_cleaning()
+        if not df.empty:
+            check_for_inconsistencies(df)
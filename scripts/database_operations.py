@@ -1,8 +1,60 @@
 import sqlite3
 import logging
 import os
+from metrics import METRICS
+from rollups import create_rollup_tables, rebuild_rollups, update_rollups, last_reading_id
 
-def create_database_connection(db_file):
+AIR_QUALITY_COLUMNS = (
+    "timestamp", "latitude", "longitude", "city", "state", "country",
+    "aqi", "main_pollutant", "pm25", "pm10", "o3", "no2", "so2", "co",
+    "temperature", "humidity", "wind_speed", "wind_direction", "pressure",
+)
+
+# Normalized layout: one `stations` row per station location, a compact `readings` fact table
+# keyed by integer station_id, and an `air_quality` view that joins them back into the original
+# wide row for readers.
+STATION_COLUMNS = ("latitude", "longitude", "city", "state", "country")
+READING_COLUMNS = ("station_id", "timestamp") + tuple(c for c in AIR_QUALITY_COLUMNS if c not in STATION_COLUMNS + ("timestamp",))
+
+# Natural key of a reading: one row per station per reported timestamp; also the per-station range-scan index
+NATURAL_KEY_COLUMNS = ("station_id", "timestamp")
+NATURAL_KEY_INDEX = "idx_readings_station_timestamp"
+
+# Locations seeded from locations.json have no names yet; the first API reading for them fills them in
+INSERT_STATION_SQL = f"""
+    INSERT INTO stations ({", ".join(STATION_COLUMNS)})
+    VALUES ({", ".join("?" for _ in STATION_COLUMNS)})
+    ON CONFLICT (latitude, longitude) DO UPDATE SET
+        city = excluded.city, state = excluded.state, country = excluded.country
+    WHERE stations.city IS NULL AND excluded.city IS NOT NULL
+"""
+
+SELECT_STATION_SQL = "SELECT station_id, city FROM stations WHERE latitude = ? AND longitude = ?"
+
+# Duplicates of the natural key are skipped by the unique index in O(log N) per row, and readings
+# already moved to the archive (see retention.py) by the archived_keys primary key
+INSERT_READING_SQL = f"""
+    INSERT OR IGNORE INTO readings ({", ".join(READING_COLUMNS)})
+    SELECT {", ".join(f"?{i}" for i in range(1, len(READING_COLUMNS) + 1))}
+    WHERE NOT EXISTS (SELECT 1 FROM archived_keys WHERE station_id = ?1 AND timestamp = ?2)
+"""
+
+# The wide air_quality row: the legacy table's columns and order, plus station_id
+AIR_QUALITY_SELECT = f"""
+    SELECT r.id, {", ".join(("r." if c not in STATION_COLUMNS else "s.") + c for c in AIR_QUALITY_COLUMNS)}, r.station_id
+    FROM readings r JOIN stations s ON s.station_id = r.station_id
+"""
+
+def configure_connection(conn):
+    """Applies write-friendly pragmas: WAL journal, one fsync per checkpoint, in-memory temp storage."""
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL;")
+    cursor.execute("PRAGMA synchronous=NORMAL;")
+    cursor.execute("PRAGMA temp_store=MEMORY;")
+    cursor.execute("PRAGMA cache_size=-20000;") # ~20 MB page cache
+    cursor.execute("PRAGMA busy_timeout=5000;")
+
+def create_database_connection(db_file, tune=True):
     """Creates a database connection to the SQLite database."""
     print(f"Attempting to connect to: {db_file}")
     conn = None
@@ -13,101 +65,205 @@ def create_database_connection(db_file):
         full_path = os.path.join(script_dir,"..", db_file)
         print(f"Attempting to connect to: {full_path}")
         conn = sqlite3.connect(full_path)
+        if tune:
+            configure_connection(conn)
         return conn
     except sqlite3.Error as e:
         print(f"Error connecting to database: {e}")
     return conn
 
 def create_air_quality_table(conn):
-    """Creates the air quality data table in the database."""
+    """Creates the stations and readings tables, the air_quality view and the rollups, migrating a legacy table first."""
     try:
         print("Creating table...")
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS air_quality (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT,
-                latitude REAL,
-                longitude REAL,
-                city TEXT,
-                state TEXT,
-                country TEXT,
-                aqi REAL,
-                main_pollutant TEXT,
-                pm25 REAL,
-                pm10 REAL,
-                o3 REAL,
-                no2 REAL,
-                so2 REAL,
-                co REAL,
-                temperature REAL,
-                humidity REAL,
-                wind_speed REAL,
-                wind_direction REAL,
-                pressure REAL
-            );
-        """)
+        migrate_to_station_schema(conn)
+        _create_station_schema(conn)
+        rollups_created = create_rollup_tables(conn)
         conn.commit()
+        if rollups_created:
+            rebuild_rollups(conn)
         print("Air Quality Table Created")
     except sqlite3.Error as e:
         print(f"Error creating table: {e}")
 
+def _create_station_schema(conn, view=True):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS stations (
+            station_id INTEGER PRIMARY KEY,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            city TEXT,
+            state TEXT,
+            country TEXT,
+            UNIQUE (latitude, longitude)
+        );
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS readings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            station_id INTEGER NOT NULL REFERENCES stations (station_id),
+            timestamp TEXT NOT NULL,
+            aqi REAL,
+            main_pollutant TEXT,
+            pm25 REAL,
+            pm10 REAL,
+            o3 REAL,
+            no2 REAL,
+            so2 REAL,
+            co REAL,
+            temperature REAL,
+            humidity REAL,
+            wind_speed REAL,
+            wind_direction REAL,
+            pressure REAL
+        );
+    """)
+    conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {NATURAL_KEY_INDEX} ON readings ({', '.join(NATURAL_KEY_COLUMNS)});")
+    # Natural keys of archived readings, so re-fetched or replayed readings are not stored twice
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS archived_keys (
+            station_id INTEGER NOT NULL,
+            timestamp TEXT NOT NULL,
+            PRIMARY KEY (station_id, timestamp)
+        ) WITHOUT ROWID;
+    """)
+    if not view: # The view needs the legacy table's name to be free
+        return
+    # Same columns and order as the legacy table, plus station_id; `WHERE id > ?` still uses the rowid
+    conn.execute(f"CREATE VIEW IF NOT EXISTS air_quality AS {AIR_QUALITY_SELECT};")
+
+def migrate_to_station_schema(conn):
+    """One-off migration of a legacy wide `air_quality` table to stations + readings + view.
+
+    Keeps reading ids (the cleaning watermark) and the first stored reading of each natural key,
+    matching INSERT OR IGNORE. Safe to call repeatedly; returns the number of readings migrated,
+    0 when there is nothing to migrate.
+    """
+    legacy = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'air_quality'").fetchone()
+    if not legacy:
+        return 0
+    station = ", ".join(STATION_COLUMNS)
+    values = ", ".join(f"a.{c}" for c in READING_COLUMNS[2:])
+    with conn:
+        _create_station_schema(conn, view=False)
+        # First-seen names win for a location, as with INSERT OR IGNORE at ingest
+        conn.execute(f"INSERT OR IGNORE INTO stations ({station}) SELECT {station} FROM air_quality "
+                     "WHERE latitude IS NOT NULL AND longitude IS NOT NULL ORDER BY id;")
+        migrated = conn.execute(f"""
+            INSERT OR IGNORE INTO readings (id, {", ".join(READING_COLUMNS)})
+            SELECT a.id, s.station_id, a.timestamp, {values}
+            FROM air_quality a JOIN stations s ON s.latitude = a.latitude AND s.longitude = a.longitude
+            WHERE a.timestamp IS NOT NULL
+            ORDER BY a.id;
+        """).rowcount
+        total = conn.execute("SELECT COUNT(*) FROM air_quality").fetchone()[0]
+        conn.execute("DROP TABLE air_quality;")
+    _create_station_schema(conn)
+    conn.commit()
+    conn.execute("VACUUM;") # Return the legacy table's pages to the filesystem
+    stations = conn.execute("SELECT COUNT(*) FROM stations").fetchone()[0]
+    logging.info(f"Migrated {migrated} readings of {stations} stations to the normalized schema; "
+                 f"dropped {total - migrated} duplicate or unkeyed rows.")
+    return migrated
+
+def upsert_stations(conn, records):
+    """Registers the stations of a batch of records (or locations.json entries) and returns their ids.
+
+    Returns {(latitude, longitude): station_id}. Names are taken from the first record seen for a location.
+    Runs inside the caller's transaction.
+    """
+    stations = {}
+    for record in records:
+        if record:
+            stations.setdefault((record['latitude'], record['longitude']), tuple(record.get(c) for c in STATION_COLUMNS[2:]))
+    if not stations:
+        return {}
+    ids, pending = {}, []
+    for key, names in stations.items():
+        row = conn.execute(SELECT_STATION_SQL, key).fetchone() # UNIQUE (latitude, longitude) index
+        if row is None or (row[1] is None and names[0] is not None):
+            pending.append(key + names)
+        else:
+            ids[key] = row[0]
+    if pending:
+        conn.executemany(INSERT_STATION_SQL, pending)
+        ids.update({tuple(p[:2]): conn.execute(SELECT_STATION_SQL, p[:2]).fetchone()[0] for p in pending})
+    return ids
+
+def _to_rows(conn, records):
+    """Resolves station ids and orders each record's values to match READING_COLUMNS."""
+    records = [record for record in records if record]
+    station_ids = upsert_stations(conn, records)
+    return [(station_ids[(r['latitude'], r['longitude'])],) + tuple(r[c] for c in READING_COLUMNS[1:]) for r in records]
 
 def insert_air_quality_data(conn, data):
-    """Inserts air quality data into the database."""
+    """Inserts air quality data into the database, skipping readings already stored.
+
+    Returns 1 if the row was inserted, 0 if it was a duplicate.
+    """
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO air_quality (
-                timestamp, latitude, longitude, city, state, country,
-                aqi, main_pollutant, pm25, pm10, o3, no2, so2, co,
-                temperature, humidity, wind_speed, wind_direction, pressure
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                data["timestamp"],
-                data["latitude"],
-                data["longitude"],
-                data["city"],
-                data["state"],
-                data["country"],
-                data["aqi"],
-                data["main_pollutant"],
-                data["pm25"],
-                data["pm10"],
-                data["o3"],
-                data["no2"],
-                data["so2"],
-                data["co"],
-                data["temperature"],
-                data["humidity"],
-                data["wind_speed"],
-                data["wind_direction"],
-                data["pressure"],
-            ),
-        )
-        conn.commit()
+        with conn:
+            after_id = last_reading_id(conn)
+            cursor = conn.execute(INSERT_READING_SQL, _to_rows(conn, [data])[0])
+            if cursor.rowcount:
+                update_rollups(conn, after_id)
+        return cursor.rowcount
     except sqlite3.IntegrityError as e:
         raise e
     except Exception as e:
         logging.error(f"Database Error: {e}")
         raise e
 
+def insert_air_quality_data_bulk(conn, records):
+    """Inserts a batch of processed records with executemany inside a single transaction.
+
+    Returns the number of rows actually inserted (duplicates are skipped). The hourly and daily
+    rollups are updated with exactly those rows in the same transaction.
+    """
+    if not any(records):
+        return 0
+    try:
+        with METRICS.stage('db.insert') as record, conn: # one transaction, one commit for the whole batch
+            rows = _to_rows(conn, records)
+            after_id = last_reading_id(conn)
+            before = conn.total_changes
+            conn.executemany(INSERT_READING_SQL, rows)
+            record['rows'] = conn.total_changes - before
+            if record['rows']:
+                update_rollups(conn, after_id)
+        return record['rows']
+    except sqlite3.IntegrityError as e:
+        raise e
+    except Exception as e:
+        logging.error(f"Database Error during bulk insert: {e}")
+        raise e
+
 def remove_duplicate_data(conn): #added function
-    """Removes duplicate air quality data from the database."""
+    """Removes duplicate air quality data from the database.
+
+    Full-table scan; ingestion never creates duplicates while the (station_id, timestamp) unique
+    index exists. Kept for ad-hoc cleanup of databases where that index was dropped.
+    """
     try:
-        sql_delete_duplicates = """
-            DELETE FROM air_quality
+        sql_delete_duplicates = f"""
+            DELETE FROM readings
             WHERE rowid NOT IN (
                 SELECT MIN(rowid)
-                FROM air_quality
-                GROUP BY timestamp, latitude, longitude, city, state, country, aqi, main_pollutant, pm25, pm10, o3, no2, so2, co, temperature, humidity, wind_speed, wind_direction, pressure
+                FROM readings
+                GROUP BY {", ".join(READING_COLUMNS)}
             );
         """
         cur = conn.cursor()
         cur.execute(sql_delete_duplicates)
         conn.commit()
         logging.info("Duplicate data removed.")
+        rebuild_rollups(conn)
     except sqlite3.Error as e:
-        logging.error(f"Error removing duplicate data: {e}")
\ No newline at end of file
+        logging.error(f"Error removing duplicate data: {e}")
+
+if __name__ == "__main__":
+    # One-off migration of an existing database in place
+    conn = create_database_connection("data/raw/air_quality_data.db")
+    if conn:
+        create_air_quality_table(conn)
+        conn.close()
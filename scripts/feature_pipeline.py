@@ -0,0 +1,103 @@
+import os
+import datetime
+import logging
+import numpy as np
+import pandas as pd
+import joblib
+from sklearn.preprocessing import StandardScaler
+from sklearn.preprocessing import PolynomialFeatures
+from schema import INTEGER_COLUMNS
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+# Saved next to gb_best_model.joblib
+feature_pipeline_path = os.path.join(script_dir, "feature_pipeline.joblib")
+
+FEATURE_PIPELINE_VERSION = 3 # Bump when the fitted attributes below change shape
+TARGET_COLUMN = 'aqi'
+POLY_INPUT_COLUMNS = ['hour', 'day_of_week', 'month']
+
+class FeaturePipeline:
+    """Fitted scaling, correlation-based selection and interaction terms from feature_engineering.
+
+    Fit once on the training frame, persist with save_feature_pipeline, then apply the same
+    transform to a single slider row or a whole batch at serving time.
+    """
+
+    def __init__(self, correlation_threshold=0.9):
+        self.correlation_threshold = correlation_threshold
+        self.version = FEATURE_PIPELINE_VERSION
+
+    def fit(self, df):
+        numeric_df = df.select_dtypes(include=['number']).drop(columns=INTEGER_COLUMNS, errors='ignore') # Keys pass through
+        self.numeric_columns_ = list(numeric_df.columns)
+        # Defaults for inputs the caller does not provide, and slider bounds, in raw units
+        self.fill_values_ = numeric_df.mean().to_dict()
+        self.bounds_ = {col: (float(numeric_df[col].min()), float(numeric_df[col].max())) for col in self.numeric_columns_}
+
+        #-----5. Feature Scaling (Normalization/Standardization)-----#
+        # StandardScaler: Standardizes features to have zero mean and unit variance.
+        self.scaler_ = StandardScaler().fit(numeric_df)
+        scaled = pd.DataFrame(self.scaler_.transform(numeric_df), columns=self.numeric_columns_, index=df.index)
+
+        #-----6. Feature Selection (Dimensionality Reduction)-----#
+        # Correlation Analysis: Remove highly correlated features.
+        corr_matrix = scaled.corr()
+        upper = corr_matrix.abs().where(np.triu(np.ones(corr_matrix.shape), k=1).astype(bool))
+        self.dropped_columns_ = [column for column in upper.columns if any(upper[column] > self.correlation_threshold)]
+
+        #-----7. Interaction Features (Non-Linear Relationships)-----#
+        # Polynomial Features (Degree 2, interactions only) of the scaled time features
+        self.poly_ = PolynomialFeatures(degree=2, interaction_only=True).fit(scaled[POLY_INPUT_COLUMNS])
+        names = self.poly_.get_feature_names_out(POLY_INPUT_COLUMNS)
+        # Degree-1 terms are the inputs themselves; keep only the new interaction terms
+        keep = self.poly_.powers_.sum(axis=1) > 1
+        self.interaction_names_ = list(names[keep])
+        self.interaction_powers_ = self.poly_.powers_[keep]
+
+        self.fitted_at_ = datetime.datetime.utcnow().isoformat()
+        return self
+
+    def transform(self, df):
+        """Applies the fitted transforms with plain NumPy; one row or many, same code path.
+
+        Numeric inputs that are missing (or NaN) take their training means.
+        """
+        values = df.reindex(columns=self.numeric_columns_).to_numpy(dtype=float)
+        fill = np.array([self.fill_values_[col] for col in self.numeric_columns_])
+        values = np.where(np.isnan(values), fill, values)
+        scaled = (values - self.scaler_.mean_) / self.scaler_.scale_
+
+        kept = [col for col in self.numeric_columns_ if col not in self.dropped_columns_]
+        kept_idx = [self.numeric_columns_.index(col) for col in kept]
+        time_idx = [self.numeric_columns_.index(col) for col in POLY_INPUT_COLUMNS]
+        time_values = scaled[:, time_idx]
+        interactions = np.prod(time_values[:, None, :] ** self.interaction_powers_[None, :, :], axis=2)
+
+        block = pd.DataFrame(
+            np.hstack([scaled[:, kept_idx], interactions]),
+            columns=kept + self.interaction_names_,
+            index=df.index,
+        )
+        # Keep the caller's column order, with non-numeric columns passed through untouched
+        passthrough = [col for col in df.columns if col not in self.numeric_columns_]
+        order = [col for col in df.columns if col not in self.dropped_columns_] + \
+            [col for col in kept if col not in df.columns] + self.interaction_names_
+        return pd.concat([df[passthrough], block], axis=1)[order]
+
+    def inverse_transform_target(self, values):
+        """Maps scaled AQI (the model's target) back to AQI units."""
+        idx = self.numeric_columns_.index(TARGET_COLUMN)
+        return np.asarray(values) * self.scaler_.scale_[idx] + self.scaler_.mean_[idx]
+
+def save_feature_pipeline(feature_pipeline, path=feature_pipeline_path):
+    joblib.dump(feature_pipeline, path)
+    logging.info(f"Saved feature pipeline v{feature_pipeline.version} ({feature_pipeline.fitted_at_}) to {path}")
+
+def load_feature_pipeline(path=feature_pipeline_path):
+    feature_pipeline = joblib.load(path)
+    if getattr(feature_pipeline, 'version', None) != FEATURE_PIPELINE_VERSION:
+        raise ValueError(
+            f"Feature pipeline at {path} is version {getattr(feature_pipeline, 'version', None)}, "
+            f"expected {FEATURE_PIPELINE_VERSION}; re-run feature_engineering.py"
+        )
+    return feature_pipeline
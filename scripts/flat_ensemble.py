@@ -0,0 +1,109 @@
+import os
+import numpy as np
+from sklearn.dummy import DummyRegressor
+from sklearn.ensemble import GradientBoostingRegressor
+
+FLAT_BATCH_NODES = int(os.getenv("FLAT_BATCH_NODES", "65536")) # Trees x rows walked at once; sized so the working arrays stay in cache
+
+class FlatEnsemble:
+    """A fitted GradientBoostingRegressor flattened into contiguous NumPy node arrays.
+
+    The nodes of every tree are concatenated into `feature`, `threshold`, `children` (absolute
+    right and left child indices, interleaved) and `value` (leaf value times the learning rate).
+    Leaves point to themselves, so every row takes exactly `depth` steps with no leaf test. Predictions repeat
+    sklearn's arithmetic: inputs cast to float32, `x <= threshold` to go left, and
+    init + lr * value added tree by tree in order, so they equal model.predict bit for bit.
+    """
+
+    def __init__(self, feature, threshold, children, value, roots, depth, init, n_features_in_, feature_names_in_=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.depth = depth
+        self.init = init
+        self.n_features_in_ = n_features_in_
+        if feature_names_in_ is not None:
+            self.feature_names_in_ = feature_names_in_
+
+    @classmethod
+    def from_model(cls, model):
+        """Compiles a fitted GradientBoostingRegressor; raises ValueError for anything it cannot reproduce exactly."""
+        if not isinstance(model, GradientBoostingRegressor):
+            raise ValueError(f"Only GradientBoostingRegressor can be flattened, not {type(model).__name__}.")
+        if model.init_ == "zero":
+            init = 0.0
+        elif isinstance(model.init_, DummyRegressor): # Constant init prediction (the default mean/median/quantile)
+            init = float(np.asarray(model.init_.constant_, dtype=np.float64).ravel()[0])
+        else:
+            raise ValueError("Only constant init estimators can be flattened.")
+
+        trees = [estimator.tree_ for estimator in model.estimators_[:, 0]]
+        sizes = np.array([tree.node_count for tree in trees])
+        offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        feature = np.concatenate([tree.feature for tree in trees])
+        threshold = np.concatenate([tree.threshold for tree in trees]).astype(np.float64)
+        left = np.concatenate([tree.children_left + offset for tree, offset in zip(trees, offsets)])
+        right = np.concatenate([tree.children_right + offset for tree, offset in zip(trees, offsets)])
+        # sklearn adds `learning_rate * value` per tree; the same double product, precomputed
+        value = np.concatenate([tree.value[:, 0, 0] for tree in trees]).astype(np.float64) * model.learning_rate
+
+        leaf = feature < 0
+        nodes = np.arange(len(feature))
+        left[leaf] = right[leaf] = nodes[leaf]
+        feature[leaf] = 0
+        threshold[leaf] = 0.0
+        # Interleaved [right, left] per node: the next node is children[2 * node + (x <= threshold)]
+        children = np.column_stack([right, left]).ravel().astype(np.intp)
+        return cls(feature.astype(np.intp), threshold, children, value, offsets.astype(np.intp), max(tree.max_depth for tree in trees),
+                   init, model.n_features_in_, getattr(model, 'feature_names_in_', None))
+
+    def _as_float32(self, X):
+        if hasattr(X, 'columns') and hasattr(self, 'feature_names_in_') and list(X.columns) != self.feature_names_in_.tolist():
+            X = X[self.feature_names_in_.tolist()]
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X has shape {X.shape}; expected (n_rows, {self.n_features_in_}).")
+        if not np.isfinite(X).all(): # As sklearn, which rejects NaN/inf for this estimator
+            raise ValueError("Input X contains NaN or infinity.")
+        return X
+
+    def predict(self, X):
+        """Vectorized batch evaluation: all trees walk a block of rows together, one level per step."""
+        X = self._as_float32(X)
+        n_trees, n_features = len(self.roots), X.shape[1]
+        out = np.full(len(X), self.init)
+        block_rows = max(1, FLAT_BATCH_NODES // n_trees)
+        for start in range(0, len(X), block_rows):
+            block = X[start:start + block_rows]
+            row_offsets = (np.arange(len(block)) * n_features)[None, :]
+            node = np.repeat(self.roots[:, None], len(block), axis=1) # (trees, rows)
+            values = block.ravel()
+            # Scratch arrays reused across levels; fresh temporaries per step cost more than the arithmetic
+            index = np.empty_like(node)
+            go_left = np.empty(node.shape, dtype=bool)
+            for _ in range(self.depth):
+                self.feature.take(node, out=index)
+                index += row_offsets
+                np.less_equal(values.take(index), self.threshold.take(node), out=go_left)
+                np.left_shift(node, 1, out=index)
+                np.add(index, go_left, out=index, casting='unsafe')
+                self.children.take(index, out=node)
+            acc = out[start:start + block_rows]
+            for tree_values in self.value.take(node): # Tree by tree, the order sklearn sums in
+                acc += tree_values
+        return out
+
+    def predict_one(self, x):
+        """Low-overhead path for a single row (a 1-D sequence of n_features_in_ values, in feature order)."""
+        x = np.asarray(x, dtype=np.float32)
+        if x.shape != (self.n_features_in_,) or not np.isfinite(x).all():
+            raise ValueError(f"Expected {self.n_features_in_} finite feature values.")
+        node = self.roots
+        for _ in range(self.depth):
+            node = self.children.take(2 * node + (x.take(self.feature.take(node)) <= self.threshold.take(node)))
+        total = self.init
+        for value in self.value.take(node).tolist(): # Sequential double additions, as sklearn
+            total += value
+        return total
@@ -0,0 +1,220 @@
+import os
+import io
+import json
+import time
+import datetime
+import logging
+import threading
+import cProfile
+import pstats
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError: # Windows: no getrusage, peak RSS is not reported
+    resource = None
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+metrics_dir = os.getenv("METRICS_DIR", os.path.join(script_dir, "..", "data", "metrics"))
+
+# "off", "slowest" (profile every stage, keep the slowest one's dump) or a stage name
+PROFILE_MODE = os.getenv("PROFILE_MODE", "off")
+# Upper bounds (seconds) of the API latency histogram buckets, Prometheus-style
+API_LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+RSS_SAMPLE_SECONDS = float(os.getenv("RSS_SAMPLE_SECONDS", "0.05")) # Per-stage RSS sampling interval; <= 0 disables it
+
+def peak_rss_mb():
+    """Peak resident set size of this process over its lifetime, in MB; None where getrusage is unavailable.
+
+    A high-water mark that never goes down, so it is reported per process, not per stage.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak / 1024 ** 2 if os.uname().sysname == "Darwin" else peak / 1024
+
+def current_rss_mb():
+    """Current resident set size in MB, from /proc/self/statm; None where that is unavailable (not Linux)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+
+class RSSSampler:
+    """Samples this process's RSS from a background thread while any stage is open.
+
+    Each open stage keeps the highest sample seen since it began, so its figure is its own peak
+    and not an earlier stage's. Spikes shorter than the interval can be missed.
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self.enabled = interval > 0 and current_rss_mb() is not None
+        self.open = {} # token -> highest RSS sampled since the stage began
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def begin(self):
+        if not self.enabled:
+            return None
+        token = object()
+        with self.lock:
+            self.open[token] = current_rss_mb()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+                self.thread.start()
+        return token
+
+    def end(self, token):
+        """The stage's sampled peak RSS in MB, or None when sampling is off."""
+        if token is None:
+            return None
+        rss = current_rss_mb()
+        with self.lock:
+            return max(self.open.pop(token), rss)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            rss = current_rss_mb()
+            with self.lock:
+                if not self.open: # Stops with the last stage; begin() starts a new thread
+                    self.thread = None
+                    return
+                for token, peak in self.open.items():
+                    self.open[token] = max(peak, rss)
+
+class LatencyHistogram:
+    """Cumulative-bucket histogram, safe to observe from the ingestion worker threads."""
+
+    def __init__(self, buckets=API_LATENCY_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self.lock:
+            self.count += 1
+            self.sum += seconds
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    self.counts[i] += 1
+
+    def to_dict(self):
+        return {'buckets': dict(zip(map(str, self.buckets), self.counts)), 'count': self.count, 'sum': self.sum}
+
+class RunMetrics:
+    """Per-run stage wall times, rows processed, sampled peak RSS per stage and API latencies."""
+
+    def __init__(self, profile_mode=PROFILE_MODE):
+        self.profile_mode = profile_mode
+        self.rss_sampler = RSSSampler()
+        self.reset()
+
+    def reset(self):
+        self.run_started = datetime.datetime.utcnow()
+        self.stages = {}
+        self.api_latency = LatencyHistogram()
+        self.api_errors = 0
+        self.profiles = {}
+        self.profiling = False
+
+    @contextmanager
+    def stage(self, name):
+        """Times a block; set record['rows'] inside it to report the rows it processed.
+
+        Nested stages are recorded under their own names (e.g. 'clean.load' inside 'clean').
+        """
+        record = {'rows': None}
+        profiler = None
+        if self.profile_mode in ("slowest", name) and not self.profiling: # Only one profiler can be active
+            profiler = cProfile.Profile()
+            profiler.enable()
+            self.profiling = True
+        rss_token = self.rss_sampler.begin()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                self.profiling = False
+                self.profiles[name] = profiler
+            record['sampled_peak_rss_mb'] = self.rss_sampler.end(rss_token)
+            self.stages[name] = record
+
+    def observe_api_latency(self, seconds, ok=True):
+        self.api_latency.observe(seconds)
+        if not ok:
+            self.api_errors += 1
+
+    def to_dict(self):
+        return {
+            'run_started': self.run_started.isoformat(),
+            'total_seconds': sum(s['seconds'] for name, s in self.stages.items() if '.' not in name),
+            'process_peak_rss_mb': peak_rss_mb(),
+            'stages': self.stages,
+            'api_latency_seconds': self.api_latency.to_dict(),
+            'api_errors': self.api_errors,
+        }
+
+    def to_prometheus(self):
+        """Prometheus text exposition format (e.g. for node_exporter's textfile collector)."""
+        lines = [
+            "# TYPE aq_stage_seconds gauge",
+            *[f'aq_stage_seconds{{stage="{name}"}} {s["seconds"]:.6f}' for name, s in self.stages.items()],
+            "# TYPE aq_stage_rows gauge",
+            *[f'aq_stage_rows{{stage="{name}"}} {s["rows"]}' for name, s in self.stages.items() if s['rows'] is not None],
+        ]
+        sampled = {name: s['sampled_peak_rss_mb'] for name, s in self.stages.items() if s['sampled_peak_rss_mb'] is not None}
+        if sampled:
+            lines.append("# TYPE aq_stage_sampled_peak_rss_megabytes gauge")
+            lines += [f'aq_stage_sampled_peak_rss_megabytes{{stage="{name}"}} {mb:.1f}' for name, mb in sampled.items()]
+        if peak_rss_mb() is not None:
+            lines += ["# TYPE aq_process_peak_rss_megabytes gauge", f"aq_process_peak_rss_megabytes {peak_rss_mb():.1f}"]
+        histogram = self.api_latency
+        lines.append("# TYPE aq_api_request_seconds histogram")
+        lines += [f'aq_api_request_seconds_bucket{{le="{bound}"}} {count}' for bound, count in zip(histogram.buckets, histogram.counts)]
+        lines += [
+            f'aq_api_request_seconds_bucket{{le="+Inf"}} {histogram.count}',
+            f"aq_api_request_seconds_sum {histogram.sum:.6f}",
+            f"aq_api_request_seconds_count {histogram.count}",
+            "# TYPE aq_api_errors_total counter",
+            f"aq_api_errors_total {self.api_errors}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def dump_profile(self, directory):
+        """Writes the profiled stage (the slowest one in "slowest" mode) as a .prof file and logs its top calls."""
+        candidates = {name: profiler for name, profiler in self.profiles.items() if name in self.stages}
+        if not candidates:
+            return None
+        name = max(candidates, key=lambda n: self.stages[n]['seconds'])
+        path = os.path.join(directory, f"profile_{name}_{self.run_started:%Y%m%dT%H%M%S}.prof")
+        candidates[name].dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(candidates[name], stream=summary).sort_stats('cumulative').print_stats(15)
+        logging.info(f"Profile of stage '{name}' written to {path}:\n{summary.getvalue()}")
+        return path
+
+    def write(self, directory=metrics_dir):
+        """Writes run_<timestamp>.json, latest.json and latest.prom (plus a profile dump if enabled)."""
+        os.makedirs(directory, exist_ok=True)
+        payload = self.to_dict()
+        with open(os.path.join(directory, f"run_{self.run_started:%Y%m%dT%H%M%S}.json"), "w") as f:
+            json.dump(payload, f, indent=2)
+        with open(os.path.join(directory, "latest.json"), "w") as f:
+            json.dump(payload, f, indent=2)
+        with open(os.path.join(directory, "latest.prom"), "w") as f:
+            f.write(self.to_prometheus())
+        self.dump_profile(directory)
+        return payload
+
+# Process-wide registry; the pipeline resets it at the start of every run
+METRICS = RunMetrics()
@@ -1,36 +1,69 @@
 import pandas as pd
 import numpy as np
 import os
-from sklearn.model_selection import train_test_split, GridSearchCV, cross_val_score
-from sklearn.ensemble import GradientBoostingRegressor
+import json
+import time
+import datetime
+import logging
+from sklearn.base import clone
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401 (enables HalvingRandomSearchCV)
+from sklearn.model_selection import (
+    train_test_split, GridSearchCV, RandomizedSearchCV, HalvingRandomSearchCV, ParameterGrid
+)
+from sklearn.ensemble import GradientBoostingRegressor, HistGradientBoostingRegressor
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 import joblib
+import storage
+from schema import log_memory
+from metrics import METRICS
+from flat_ensemble import FlatEnsemble
 
-# Load feature-engineered data
 script_dir = os.path.dirname(os.path.abspath(__file__))
-csv_path = os.path.join(script_dir, "..", "data", "processed", "featured_data.csv")
-df = pd.read_csv(csv_path)
-
-# Prepare data
-X = df.drop(['aqi', 'timestamp', 'latitude', 'longitude', 'city', 'state', 'country', 'main_pollutant'], axis=1)
-y = df['aqi']
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-
-# Gradient Boosting with GridSearchCV
-gb = GradientBoostingRegressor(random_state=42)
-gb_params = {
-    'n_estimators': [100, 200],
-    'learning_rate': [0.01, 0.05, 0.1],
-    'max_depth': [3, 5],
-    'min_samples_split': [2, 5, 10],
-    'min_samples_leaf': [1, 2, 4],
-    'subsample': [0.8, 1.0]
+model_path = os.path.join(script_dir, "gb_best_model.joblib")
+model_state_path = os.path.join(script_dir, "model_state.json")
+
+NON_FEATURE_COLUMNS = ['aqi', 'timestamp', 'latitude', 'longitude', 'city', 'state', 'country', 'main_pollutant', 'station_id']
+
+MODEL_TYPE = os.getenv("MODEL_TYPE", "gb") # "gb" (GradientBoostingRegressor) or "hist" (HistGradientBoostingRegressor)
+SEARCH_MODE = os.getenv("SEARCH_MODE", "grid") # "grid", "random" or "halving"
+SEARCH_TIME_BUDGET = float(os.getenv("SEARCH_TIME_BUDGET", "300")) # Seconds, used by "random" and "halving"
+
+# Estimator and hyperparameter grid per model type
+MODEL_SPACES = {
+    'gb': (GradientBoostingRegressor(random_state=42), {
+        'n_estimators': [100, 200],
+        'learning_rate': [0.01, 0.05, 0.1],
+        'max_depth': [3, 5],
+        'min_samples_split': [2, 5, 10],
+        'min_samples_leaf': [1, 2, 4],
+        'subsample': [0.8, 1.0]
+    }),
+    # Histogram-based boosting bins features once, so it is much faster on long histories
+    'hist': (HistGradientBoostingRegressor(random_state=42), {
+        'max_iter': [100, 200],
+        'learning_rate': [0.01, 0.05, 0.1],
+        'max_depth': [3, 5],
+        'min_samples_leaf': [10, 20, 40],
+        'l2_regularization': [0.0, 1.0],
+    }),
 }
-gb_grid = GridSearchCV(gb, gb_params, cv=5, scoring='neg_mean_absolute_error')
-gb_grid.fit(X_train, y_train)
-gb_best = gb_grid.best_estimator_
-gb_predictions = gb_best.predict(X_test)
-gb_cv_scores = cross_val_score(gb_best, X_train, y_train, cv=5, scoring='neg_mean_absolute_error')
+# Incremental retraining: full search on a cadence or on drift, cheap warm-start updates in between
+RETRAIN_MODE = os.getenv("RETRAIN_MODE", "incremental") # "incremental" or "full" (search every run)
+FULL_SEARCH_INTERVAL_HOURS = float(os.getenv("FULL_SEARCH_INTERVAL_HOURS", "168")) # Weekly
+DRIFT_TOLERANCE = float(os.getenv("DRIFT_TOLERANCE", "1.5")) # New-row MAE above this x the search holdout MAE triggers a search
+WARM_START_TREES = int(os.getenv("WARM_START_TREES", "10")) # Trees added per incremental update
+MAX_WARM_START_TREES = int(os.getenv("MAX_WARM_START_TREES", "100")) # Beyond this, refit with the stored params instead
+INCREMENTAL_WINDOW_ROWS = int(os.getenv("INCREMENTAL_WINDOW_ROWS", "20000")) # Most recent rows used by updates
+# Name of the ensemble-size parameter per model type
+SIZE_PARAMS = {'gb': 'n_estimators', 'hist': 'max_iter'}
+
+MODEL_NAMES = {'gb': "Gradient Boosting", 'hist': "Histogram Gradient Boosting"}
+
+def load_featured_data(start=None, end=None):
+    """Loads the feature-engineered dataset written by feature_engineering, optionally for a time range."""
+    df = storage.load_dataset('featured', start=start, end=end)
+    log_memory('load_featured', df)
+    return df
 
 # Evaluation
 def evaluate_model(predictions, y_test, model_name, cv_scores):
@@ -38,15 +71,207 @@ def evaluate_model(predictions, y_test, model_name, cv_scores):
     rmse = np.sqrt(mean_squared_error(y_test, predictions))
     r2 = r2_score(y_test, predictions)
     print(f"{model_name} MAE: {mae:.2f}, RMSE: {rmse:.2f}, R2: {r2:.2f}, CV MAE: {np.mean(cv_scores):.2f}")
+    return {'mae': mae, 'rmse': rmse, 'r2': r2, 'cv_mae': float(np.mean(cv_scores))}
+
+def _time_budgeted_candidates(estimator, X_train, y_train, time_budget, cv, n_jobs):
+    """Estimates how many candidates fit in `time_budget` seconds from one timed probe fit."""
+    start = time.perf_counter()
+    clone(estimator).fit(X_train, y_train)
+    probe = time.perf_counter() - start
+    workers = joblib.cpu_count() if n_jobs == -1 else n_jobs
+    budget_fits = time_budget * workers / max(probe, 1e-3)
+    logging.info(f"Probe fit took {probe:.2f}s; budget allows ~{budget_fits:.0f} full-size fits on {workers} workers.")
+    return max(1, int(budget_fits / cv))
+
+def build_search(X_train, y_train, model_type=MODEL_TYPE, search_mode=SEARCH_MODE, time_budget=SEARCH_TIME_BUDGET, cv=5, n_jobs=-1):
+    """Builds the hyperparameter search for the chosen model and search strategy.
+
+    grid     -> exhaustive GridSearchCV over the whole grid (all cores)
+    random   -> RandomizedSearchCV with as many candidates as fit in the time budget
+    halving  -> HalvingRandomSearchCV (successive halving on n_samples); candidates are
+                dropped early on small subsamples, so it can start from more of them
+    """
+    estimator, param_grid = MODEL_SPACES[model_type]
+    estimator = clone(estimator)
+    common = dict(cv=cv, scoring='neg_mean_absolute_error', n_jobs=n_jobs)
+    if search_mode == "grid":
+        return GridSearchCV(estimator, param_grid, **common)
+
+    grid_size = len(ParameterGrid(param_grid))
+    n_candidates = min(grid_size, _time_budgeted_candidates(estimator, X_train, y_train, time_budget, cv, n_jobs))
+    if search_mode == "random":
+        return RandomizedSearchCV(estimator, param_grid, n_iter=n_candidates, random_state=42, **common)
+    if search_mode == "halving":
+        factor = 3
+        # Early rounds run on 1/factor^k of the data, so roughly `factor` times more candidates fit the budget
+        n_candidates = min(grid_size, max(factor, n_candidates * factor))
+        return HalvingRandomSearchCV(estimator, param_grid, n_candidates=n_candidates, factor=factor, random_state=42, **common)
+    raise ValueError(f"Unknown SEARCH_MODE: {search_mode}")
+
+def report_search(search):
+    """Logs wall-clock cost per candidate (fit + score over all folds) so the hourly retrain can be budgeted."""
+    results = pd.DataFrame(search.cv_results_)
+    n_splits = search.n_splits_
+    results['candidate_seconds'] = (results['mean_fit_time'] + results['mean_score_time']) * n_splits
+    columns = ['rank_test_score', 'mean_test_score', 'candidate_seconds', 'params']
+    if 'n_resources' in results.columns:
+        columns.insert(0, 'iter')
+        columns.insert(1, 'n_resources')
+    print(results.sort_values('candidate_seconds', ascending=False)[columns].to_string(index=False))
+    logging.info(
+        f"{len(results)} candidate evaluations: {results['candidate_seconds'].sum():.1f}s of fit/score time, "
+        f"median {results['candidate_seconds'].median():.2f}s per candidate."
+    )
+    return results
+
+def best_cv_scores(search):
+    """Per-fold test scores of the chosen candidate, taken from cv_results_ rather than refitting."""
+    best = search.best_index_
+    return np.array([search.cv_results_[f'split{i}_test_score'][best] for i in range(search.n_splits_)])
+
+def train_model(df, model_type=MODEL_TYPE, search_mode=SEARCH_MODE, time_budget=SEARCH_TIME_BUDGET):
+    """Tunes and fits the Gradient Boosting model on a feature-engineered DataFrame.
+
+    Returns the best estimator and a dict of evaluation metrics.
+    """
+    # Prepare data
+    X = df.drop(NON_FEATURE_COLUMNS, axis=1, errors='ignore') # station_id is absent in datasets built before the stations table
+    y = df['aqi']
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+    # Hyperparameter search over all cores
+    with METRICS.stage('train.search') as record:
+        search = build_search(X_train, y_train, model_type, search_mode, time_budget)
+        search.fit(X_train, y_train)
+        record['rows'] = len(X_train)
+    search_seconds = record['seconds']
+    logging.info(f"{type(search).__name__} ({model_type}) finished in {search_seconds:.1f}s; best params: {search.best_params_}")
+    report_search(search)
+
+    gb_best = search.best_estimator_
+    gb_predictions = gb_best.predict(X_test)
+    gb_cv_scores = best_cv_scores(search)
 
-evaluate_model(gb_predictions, y_test, "Gradient Boosting", gb_cv_scores)
+    metrics = evaluate_model(gb_predictions, y_test, MODEL_NAMES[model_type], gb_cv_scores)
+    metrics.update(best_params=search.best_params_, search_seconds=search_seconds, search_mode=search_mode, model_type=model_type)
 
-# Feature Importance Analysis
-feature_importance = gb_best.feature_importances_
-feature_names = X.columns
-feature_importance_df = pd.DataFrame({'Feature': feature_names, 'Importance': feature_importance})
-feature_importance_df = feature_importance_df.sort_values(by='Importance', ascending=False)
-print(feature_importance_df)
+    # Feature Importance Analysis
+    if hasattr(gb_best, 'feature_importances_'):
+        feature_importance = gb_best.feature_importances_
+        feature_names = X.columns
+        feature_importance_df = pd.DataFrame({'Feature': feature_names, 'Importance': feature_importance})
+        feature_importance_df = feature_importance_df.sort_values(by='Importance', ascending=False)
+        print(feature_importance_df)
+    return gb_best, metrics
 
 # Save the best model
-joblib.dump(gb_best, 'gb_best_model.joblib')
\ No newline at end of file
+def save_model(model, path=model_path):
+    joblib.dump(model, path)
+
+def load_model(path=model_path):
+    return joblib.load(path)
+
+def compile_model(model):
+    """Export step for serving: a GradientBoostingRegressor becomes a FlatEnsemble, other models are returned as is.
+
+    The flat arrays give the same predictions bit for bit with far less per-call overhead,
+    which is what single-row requests pay for; see flat_ensemble.
+    """
+    if isinstance(model, GradientBoostingRegressor):
+        return FlatEnsemble.from_model(model)
+    return model
+
+def load_model_state(path=model_state_path):
+    """Loads the retraining state (chosen params, last search, trained-through timestamp), or None."""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def save_model_state(state, path=model_state_path):
+    with open(path, "w") as f:
+        json.dump(state, f, indent=2, default=str)
+
+def make_model_state(df, metrics):
+    """Retraining state recorded after a full search."""
+    now = datetime.datetime.utcnow().isoformat()
+    return {
+        'model_type': metrics['model_type'],
+        'best_params': metrics['best_params'],
+        'baseline_mae': float(metrics['mae']),
+        'last_search_at': now,
+        'updated_at': now,
+        'trained_through': pd.Timestamp(df['timestamp'].max()).isoformat(),
+        'warm_start_trees': 0,
+    }
+
+def full_search_due(state, now=None):
+    """True when there is no usable state or the search cadence has elapsed."""
+    if RETRAIN_MODE == "full" or state is None:
+        return True
+    now = now or datetime.datetime.utcnow()
+    elapsed = now - datetime.datetime.fromisoformat(state['last_search_at'])
+    return elapsed.total_seconds() >= FULL_SEARCH_INTERVAL_HOURS * 3600
+
+def update_model(previous_model, df, state):
+    """Cheap hourly update between full searches.
+
+    Checks the previous model on rows newer than state['trained_through']; if its MAE drifted past
+    DRIFT_TOLERANCE x the search holdout MAE, returns None so the caller runs a full search.
+    Otherwise adds WARM_START_TREES trees fitted on the most recent INCREMENTAL_WINDOW_ROWS rows,
+    or, once MAX_WARM_START_TREES have been added, refits the stored params on that window.
+    Returns (model, metrics, new state).
+    """
+    timestamps = pd.to_datetime(df['timestamp'], utc=True)
+    new_rows = df[timestamps > pd.Timestamp(state['trained_through'])]
+    if new_rows.empty:
+        logging.info("No new rows since the last training run; keeping the current model.")
+        return previous_model, {'mode': 'unchanged', 'new_rows': 0}, state
+
+    X_new = new_rows.drop(NON_FEATURE_COLUMNS, axis=1, errors='ignore')
+    new_mae = mean_absolute_error(new_rows['aqi'], previous_model.predict(X_new))
+    if new_mae > DRIFT_TOLERANCE * state['baseline_mae']:
+        logging.warning(f"Drift: MAE on {len(new_rows)} new rows is {new_mae:.3f} vs baseline {state['baseline_mae']:.3f}.")
+        return None
+
+    window = df.loc[timestamps.sort_values().index[-INCREMENTAL_WINDOW_ROWS:]]
+    X_window = window.drop(NON_FEATURE_COLUMNS, axis=1, errors='ignore')
+    size_param = SIZE_PARAMS[state['model_type']]
+    state = dict(state)
+    if state['warm_start_trees'] + WARM_START_TREES <= MAX_WARM_START_TREES:
+        model = previous_model
+        model.set_params(warm_start=True, **{size_param: model.get_params()[size_param] + WARM_START_TREES})
+        state['warm_start_trees'] += WARM_START_TREES
+        mode = 'warm_start'
+    else:
+        model = clone(MODEL_SPACES[state['model_type']][0]).set_params(**state['best_params'])
+        state['warm_start_trees'] = 0
+        mode = 'refit'
+    with METRICS.stage('train.update') as record:
+        model.fit(X_window, window['aqi'])
+        record['rows'] = len(window)
+    fit_seconds = record['seconds']
+
+    state['trained_through'] = pd.Timestamp(timestamps.max()).isoformat()
+    state['updated_at'] = datetime.datetime.utcnow().isoformat()
+    logging.info(f"Incremental {mode} on {len(window)} rows ({len(new_rows)} new) took {fit_seconds:.2f}s; new-row MAE {new_mae:.3f}.")
+    metrics = {'mode': mode, 'new_rows': len(new_rows), 'new_rows_mae': new_mae, 'fit_seconds': fit_seconds}
+    return model, metrics, state
+
+def predict_aqi(model, feature_pipeline, raw_features):
+    """Predicts AQI (in AQI units) for one or many rows of raw, unscaled inputs.
+
+    Missing inputs take their training means; the fitted feature pipeline is applied once,
+    vectorized over the whole batch.
+    """
+    features = feature_pipeline.transform(raw_features)[model.feature_names_in_.tolist()]
+    if isinstance(model, FlatEnsemble) and len(features) == 1: # Compiled model: skip the batch machinery for one row
+        return feature_pipeline.inverse_transform_target(np.array([model.predict_one(features.to_numpy(dtype=np.float32)[0])]))
+    return feature_pipeline.inverse_transform_target(model.predict(features))
+
+if __name__ == "__main__":
+    df = load_featured_data()
+    gb_best, metrics = train_model(df)
+    save_model(gb_best)
+    save_model_state(make_model_state(df, metrics))
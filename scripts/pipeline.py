@@ -0,0 +1,159 @@
+import os
+import logging
+import pandas as pd
+
+import api_retrieval
+import data_cleaning
+import feature_engineering
+import model
+import retention
+import storage
+from schema import log_memory
+from metrics import METRICS
+from feature_pipeline import save_feature_pipeline, load_feature_pipeline, feature_pipeline_path
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+class Pipeline:
+    """Runs ingestion -> cleaning -> feature engineering -> training in one process.
+
+    DataFrames are passed between stages in memory. The cleaned frame and its watermark, and the
+    model with its feature pipeline, are kept between runs (and picked up from disk by a new process),
+    so after the first run each hourly run
+    only cleans the newly ingested rows and only warm-starts the model (see model.RETRAIN_MODE).
+    With persist=True the intermediates (cleaned/featured CSVs, model) are also written to disk.
+    """
+
+    def __init__(self, ingest=True, persist=True):
+        self.ingest = ingest
+        self.persist = persist
+        self.cleaned = None
+        self.cleaning_state = None
+        self.new_cleaned = None
+        self.validation_report = None
+        self.model = None
+        self.feature_pipeline = None
+        self.model_state = None
+        self.timings = {}
+
+    def _timed(self, stage, func, *args, **kwargs):
+        with METRICS.stage(stage) as record:
+            result = func(*args, **kwargs)
+            first = result[0] if isinstance(result, tuple) else result
+            if isinstance(first, pd.DataFrame):
+                record['rows'] = len(first)
+            elif isinstance(first, int):
+                record['rows'] = first
+        elapsed = record['seconds']
+        self.timings[stage] = elapsed
+        logging.info(f"Stage '{stage}' finished in {elapsed:.2f}s.")
+        return result
+
+    def _resume(self):
+        """Picks up the persisted watermark and cleaned dataset, as run_cleaning does; False if either is missing."""
+        state = data_cleaning.load_cleaning_state()
+        if state is None or not storage.dataset_exists('cleaned'):
+            return False
+        self.cleaned, self.cleaning_state = storage.load_dataset('cleaned'), state
+        logging.info(f"Resuming from the cleaned dataset on disk (watermark id {state['last_id']}).")
+        return True
+
+    def _rebuild(self):
+        """Full cleaning; streamed through the persisted dataset when CLEANING_CHUNK_ROWS is set."""
+        if data_cleaning.CHUNK_ROWS > 0 and self.persist:
+            rows, self.cleaning_state, self.validation_report = data_cleaning.run_streaming_cleaning()
+            self.cleaned = storage.load_dataset('cleaned') if rows else pd.DataFrame()
+        else:
+            self.cleaned, self.cleaning_state = data_cleaning.run_full_cleaning(self.persist)
+
+    def clean(self):
+        """Full cleaning on the first run (or in CLEANING_MODE=full), incremental afterwards.
+
+        A new process resumes from the watermark and cleaned dataset on disk, so only the first run
+        ever, or one after a schema change, rebuilds.
+        """
+        self.validation_report = None # Set when a streaming rebuild already validated every chunk
+        full = data_cleaning.CLEANING_MODE == "full"
+        if not full and self.cleaning_state is None:
+            full = not self._resume()
+        if full:
+            self._rebuild()
+            self.new_cleaned = self.cleaned
+        else:
+            new_rows, self.cleaning_state = data_cleaning.run_incremental_cleaning(self.cleaning_state, self.persist)
+            self.new_cleaned = new_rows
+            if not new_rows.empty:
+                self.cleaned = pd.concat([self.cleaned, new_rows], ignore_index=True)
+        return self.cleaned
+
+    def _load_previous(self):
+        """Loads the last saved model and feature pipeline once per process; False if unavailable."""
+        if self.model is None or self.feature_pipeline is None:
+            if not (os.path.exists(model.model_path) and os.path.exists(feature_pipeline_path)):
+                return False
+            try:
+                self.model = model.load_model()
+                self.feature_pipeline = load_feature_pipeline()
+            except (OSError, ValueError) as e:
+                logging.warning(f"Could not load the previous model/feature pipeline: {e}")
+                return False
+        return True
+
+    def train(self, cleaned):
+        """Warm-start update between full searches; a full search on cadence, drift or first run.
+
+        The feature pipeline is only re-fitted with a full search, so the warm-started trees keep
+        seeing the same scaled feature space they were trained on.
+        """
+        state = self.model_state if self.model_state is not None else model.load_model_state()
+        update = None
+        if not model.full_search_due(state) and self._load_previous():
+            featured, feature_pipeline = self._timed('features', feature_engineering.engineer_features, cleaned, self.feature_pipeline)
+            update = self._timed('train', model.update_model, self.model, featured, state)
+        if update is not None:
+            trained_model, metrics, state = update
+        else:
+            featured, feature_pipeline = self._timed('features_refit', feature_engineering.engineer_features, cleaned)
+            trained_model, metrics = self._timed('search', model.train_model, featured)
+            state = model.make_model_state(featured, metrics)
+        self.model, self.feature_pipeline, self.model_state = trained_model, feature_pipeline, state
+        return featured, feature_pipeline, trained_model, metrics
+
+    def run(self):
+        """Runs every stage once and returns the trained model, feature pipeline, metrics and per-stage timings."""
+        self.timings = {}
+        METRICS.reset()
+        results = {}
+        if self.ingest:
+            results['ingested'] = self._timed('ingest', api_retrieval.run_ingestion)
+
+        cleaned = self._timed('clean', self.clean)
+        # Only the rows cleaned in this run; the alert email goes out from a background thread
+        results['validation'] = data_cleaning.check_for_inconsistencies(self.new_cleaned, self.validation_report)
+        # Archival, vacuum and analyze, at most daily; never archives rows past the cleaning watermark
+        watermark = self.cleaning_state['last_id'] if self.cleaning_state else None
+        results['maintenance'] = self._timed('maintenance', retention.run_maintenance, watermark)
+        if cleaned.empty:
+            logging.warning("No cleaned data available; skipping feature engineering and training.")
+            results['timings'] = dict(self.timings)
+            results['run_metrics'] = METRICS.write()
+            return results
+
+        log_memory('clean', cleaned)
+        featured, feature_pipeline, trained_model, metrics = self.train(cleaned)
+        log_memory('features', featured)
+        if self.persist:
+            self._timed('save_features', feature_engineering.save_featured_data, featured)
+            save_feature_pipeline(feature_pipeline)
+            feature_engineering.save_dashboard_summary(feature_engineering.build_dashboard_summary(featured, feature_pipeline))
+            self._timed('save_model', model.save_model, trained_model)
+            model.save_model_state(self.model_state)
+
+        results.update(featured=featured, feature_pipeline=feature_pipeline, model=trained_model, metrics=metrics, timings=dict(self.timings))
+        results['run_metrics'] = METRICS.write()
+        summary = ", ".join(f"{stage}={elapsed:.2f}s" for stage, elapsed in self.timings.items())
+        logging.info(f"Pipeline finished in {sum(self.timings.values()):.2f}s ({summary}).")
+        return results
+
+if __name__ == "__main__":
+    Pipeline().run()
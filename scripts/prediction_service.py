@@ -0,0 +1,331 @@
+import os
+import io
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from model import load_model, predict_aqi, model_path
+from feature_pipeline import load_feature_pipeline, feature_pipeline_path
+from feature_engineering import add_weather_features
+
+try:
+    import pyarrow as pa
+    HAS_PYARROW = True
+except ImportError: # JSON only
+    HAS_PYARROW = False
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8000"))
+MAX_BATCH_ROWS = int(os.getenv("MAX_BATCH_ROWS", "4096")) # Rows coalesced into one predict call
+MAX_BATCH_DELAY_MS = float(os.getenv("MAX_BATCH_DELAY_MS", "5")) # How long the first request in a batch waits for company
+LATENCY_WINDOW = int(os.getenv("LATENCY_WINDOW", "10000")) # Requests kept for the p50/p99 figures
+
+ARROW_CONTENT_TYPE = "application/vnd.apache.arrow.stream"
+WEATHER_INPUTS = {'wind_speed', 'wind_direction', 'humidity', 'temperature'}
+
+def file_signature(path):
+    """(mtime_ns, size) of a file, or None if it is missing."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def prepare_inputs(df):
+    """Raw request rows -> the raw feature frame predict_aqi expects.
+
+    A 'timestamp' column fills in hour/day_of_week/month when they are not given, and the wind
+    components and humidity/temperature interaction are derived when all their inputs are present.
+    Anything still missing takes its training mean inside the feature pipeline.
+    """
+    df = df.copy()
+    if 'timestamp' in df.columns:
+        timestamps = pd.to_datetime(df['timestamp'], utc=True)
+        for col, values in (('hour', timestamps.dt.hour), ('day_of_week', timestamps.dt.dayofweek), ('month', timestamps.dt.month)):
+            if col not in df.columns:
+                df[col] = values
+    if WEATHER_INPUTS.issubset(df.columns):
+        df = add_weather_features(df)
+    return df
+
+def decode_request(body, content_type):
+    """JSON (a list of row objects, or {"rows": [...]}) or an Arrow IPC stream -> DataFrame."""
+    if content_type.startswith(ARROW_CONTENT_TYPE):
+        if not HAS_PYARROW:
+            raise ValueError("Arrow requests need pyarrow installed")
+        return pa.ipc.open_stream(io.BytesIO(body)).read_all().to_pandas()
+    payload = json.loads(body)
+    rows = payload.get('rows') if isinstance(payload, dict) else payload
+    if not isinstance(rows, list) or not rows:
+        raise ValueError('Expected a non-empty JSON list of rows or {"rows": [...]}')
+    return pd.DataFrame.from_records(rows)
+
+def validate_inputs(df, numeric_columns):
+    """Coerces one request's rows to the types prepare_inputs expects; raises ValueError naming the bad column.
+
+    Run per request before batching, so a malformed request is rejected with a 400 on its own
+    instead of failing every request coalesced with it.
+    """
+    df = df.copy()
+    if 'timestamp' in df.columns:
+        try:
+            df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Invalid timestamp: {e}") from None
+    for col in df.columns.intersection(list(numeric_columns)):
+        try:
+            df[col] = pd.to_numeric(df[col], errors='raise').astype(float)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Column '{col}' must be numeric: {e}") from None
+        if np.isinf(df[col]).any():
+            raise ValueError(f"Column '{col}' contains infinite values")
+    return df
+
+def encode_response(predictions, accept):
+    """Returns (body, content type); Arrow when the client asks for it, JSON otherwise."""
+    if HAS_PYARROW and accept.startswith(ARROW_CONTENT_TYPE):
+        table = pa.table({'aqi': predictions})
+        sink = io.BytesIO()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue(), ARROW_CONTENT_TYPE
+    return json.dumps({'aqi': predictions.tolist()}).encode(), "application/json"
+
+class ServiceMetrics:
+    """Request latency percentiles and throughput since startup."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.batch_rows = deque(maxlen=window)
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+        self.errors = 0
+
+    def record_request(self, seconds, rows):
+        self.latencies.append(seconds)
+        self.requests += 1
+        self.rows += rows
+
+    def record_batch(self, rows):
+        self.batch_rows.append(rows)
+        self.batches += 1
+
+    def snapshot(self):
+        uptime = time.perf_counter() - self.started
+        latencies = np.array(self.latencies) * 1000
+        return {
+            'uptime_seconds': round(uptime, 3),
+            'requests': self.requests,
+            'rows': self.rows,
+            'batches': self.batches,
+            'errors': self.errors,
+            'latency_p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+            'latency_p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+            'mean_batch_rows': float(np.mean(self.batch_rows)) if self.batch_rows else None,
+            'requests_per_second': self.requests / uptime if uptime else 0.0,
+            'rows_per_second': self.rows / uptime if uptime else 0.0,
+        }
+
+class MicroBatcher:
+    """Coalesces concurrent predict requests into one vectorized predict_aqi call.
+
+    The first queued request waits at most max_delay_ms for others; a batch closes early once it
+    reaches max_rows. While a batch is being scored in a worker thread, new requests keep queuing,
+    so batches grow on their own under load.
+    """
+
+    def __init__(self, predict, metrics, max_rows=MAX_BATCH_ROWS, max_delay_ms=MAX_BATCH_DELAY_MS):
+        self.predict = predict
+        self.metrics = metrics
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000
+        self.queue = asyncio.Queue()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(self, df):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((df, future))
+        return await future
+
+    async def _collect(self):
+        batch = [await self.queue.get()]
+        rows = len(batch[0][0])
+        deadline = asyncio.get_running_loop().time() + self.max_delay
+        while rows < self.max_rows:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0 and self.queue.empty():
+                break
+            try:
+                item = self.queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            rows += len(item[0])
+        return batch, rows
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch, rows = await self._collect()
+            frames = [df for df, _ in batch]
+            try:
+                predictions = await loop.run_in_executor(None, self.predict, pd.concat(frames, ignore_index=True, sort=False))
+            except Exception as e:
+                logging.error(f"Batch of {rows} rows failed: {e}")
+                if len(batch) > 1: # Retry each request on its own, so only the one at fault fails
+                    await self._run_each(batch)
+                elif not batch[0][1].done():
+                    batch[0][1].set_exception(e)
+                continue
+            self.metrics.record_batch(rows)
+            offset = 0
+            for df, future in batch:
+                if not future.done(): # The client may have gone away
+                    future.set_result(predictions[offset:offset + len(df)])
+                offset += len(df)
+
+    async def _run_each(self, batch):
+        loop = asyncio.get_running_loop()
+        for df, future in batch:
+            try:
+                predictions = await loop.run_in_executor(None, self.predict, df)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            self.metrics.record_batch(len(df))
+            if not future.done():
+                future.set_result(predictions)
+
+class PredictionService:
+    """ASGI app serving the saved model and feature pipeline.
+
+    POST /predict  JSON or Arrow rows of raw inputs -> {"aqi": [...]} (Arrow if Accept asks for it)
+    GET  /metrics  latency p50/p99, throughput and batch sizes as JSON
+    GET  /health   model and feature pipeline load times
+
+    The model and feature pipeline are reloaded before a batch when their files change on disk,
+    so the hourly retrain is picked up without restarting the service.
+    """
+
+    def __init__(self, model_file=model_path, feature_pipeline_file=feature_pipeline_path,
+                 max_batch_rows=MAX_BATCH_ROWS, max_batch_delay_ms=MAX_BATCH_DELAY_MS):
+        self.model_file = model_file
+        self.feature_pipeline_file = feature_pipeline_file
+        self.max_batch_rows = max_batch_rows
+        self.max_batch_delay_ms = max_batch_delay_ms
+        self.model = None
+        self.feature_pipeline = None
+        self.signature = None
+        self.loaded_at = None
+        self.metrics = ServiceMetrics()
+        self.batcher = None
+
+    def _load(self):
+        signature = (file_signature(self.model_file), file_signature(self.feature_pipeline_file))
+        if signature != self.signature:
+            self.model = load_model(self.model_file)
+            self.feature_pipeline = load_feature_pipeline(self.feature_pipeline_file)
+            self.signature = signature
+            self.loaded_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+            logging.info(f"Loaded model from {self.model_file} (feature pipeline fitted {self.feature_pipeline.fitted_at_}).")
+
+    def numeric_inputs(self):
+        """Request columns that must be numeric: the feature pipeline's inputs and the weather inputs."""
+        return set(self.feature_pipeline.numeric_columns_) | WEATHER_INPUTS | {'hour', 'day_of_week', 'month'}
+
+    def _predict(self, df):
+        self._load()
+        return predict_aqi(self.model, self.feature_pipeline, prepare_inputs(df))
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    self._load()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                self.batcher = MicroBatcher(self._predict, self.metrics, self.max_batch_rows, self.max_batch_delay_ms)
+                self.batcher.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.batcher.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _read_body(self, receive):
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body', False):
+                return body
+
+    async def _respond(self, send, status, body, content_type="application/json"):
+        await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', content_type.encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _predict_endpoint(self, scope, receive, send):
+        start = time.perf_counter()
+        headers = {key.decode().lower(): value.decode() for key, value in scope.get('headers', [])}
+        try:
+            df = decode_request(await self._read_body(receive), headers.get('content-type', 'application/json'))
+            df = validate_inputs(df, self.numeric_inputs())
+        except (ValueError, TypeError, KeyError) as e:
+            self.metrics.errors += 1
+            await self._respond(send, 400, json.dumps({'error': str(e)}).encode())
+            return
+        try:
+            predictions = await self.batcher.submit(df)
+        except Exception as e:
+            self.metrics.errors += 1
+            await self._respond(send, 500, json.dumps({'error': str(e)}).encode())
+            return
+        body, content_type = encode_response(np.asarray(predictions), headers.get('accept', ''))
+        await self._respond(send, 200, body, content_type)
+        self.metrics.record_request(time.perf_counter() - start, len(df))
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        route = (scope['method'], scope['path'])
+        if route == ('POST', '/predict'):
+            await self._predict_endpoint(scope, receive, send)
+        elif route == ('GET', '/metrics'):
+            await self._respond(send, 200, json.dumps(self.metrics.snapshot()).encode())
+        elif route == ('GET', '/health'):
+            body = {'status': 'ok', 'model_loaded_at': self.loaded_at,
+                    'feature_pipeline_fitted_at': getattr(self.feature_pipeline, 'fitted_at_', None)}
+            await self._respond(send, 200, json.dumps(body).encode())
+        else:
+            await self._respond(send, 404, json.dumps({'error': f"No route for {scope['method']} {scope['path']}"}).encode())
+
+app = PredictionService()
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=SERVICE_HOST, port=SERVICE_PORT, log_level="warning")
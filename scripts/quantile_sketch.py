@@ -0,0 +1,61 @@
+import numpy as np
+
+QUANTILE_SKETCH_SIZE = 100_000 # Centroids kept per sketch; exact below this many values
+
+class QuantileSketch:
+    """Mergeable streaming quantile sketch with bounded memory.
+
+    Values are kept as weighted centroids. Until the sketch holds more than `max_centroids` values
+    every value is its own centroid and quantile() matches np.nanquantile exactly. Beyond that,
+    centroids are merged into `max_centroids` buckets of equal weight, so the rank error of any
+    quantile stays below count / max_centroids.
+    """
+
+    def __init__(self, max_centroids=QUANTILE_SKETCH_SIZE):
+        self.max_centroids = max_centroids
+        self.values = np.empty(0)
+        self.weights = np.empty(0)
+        self.count = 0
+
+    def update(self, values):
+        """Adds a batch of values; NaNs are ignored."""
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return self
+        self.values = np.concatenate([self.values, values])
+        self.weights = np.concatenate([self.weights, np.ones(values.size)])
+        self.count += values.size
+        if self.values.size > 2 * self.max_centroids:
+            self._compress()
+        return self
+
+    def merge(self, other):
+        self.values = np.concatenate([self.values, other.values])
+        self.weights = np.concatenate([self.weights, other.weights])
+        self.count += other.count
+        if self.values.size > 2 * self.max_centroids:
+            self._compress()
+        return self
+
+    def _compress(self):
+        order = np.argsort(self.values, kind='stable')
+        values, weights = self.values[order], self.weights[order]
+        # Bucket by the centroid's mid-rank so every bucket holds about the same weight
+        mid_rank = np.cumsum(weights) - weights / 2
+        bucket = np.minimum((mid_rank / self.count * self.max_centroids).astype(np.int64), self.max_centroids - 1)
+        bucket_weights = np.bincount(bucket, weights=weights, minlength=self.max_centroids)
+        bucket_sums = np.bincount(bucket, weights=values * weights, minlength=self.max_centroids)
+        keep = bucket_weights > 0
+        self.values = bucket_sums[keep] / bucket_weights[keep]
+        self.weights = bucket_weights[keep]
+
+    def quantile(self, q):
+        """q-quantile with NumPy's default linear interpolation between order statistics; NaN if empty."""
+        if self.count == 0:
+            return np.nan
+        order = np.argsort(self.values, kind='stable')
+        values, weights = self.values[order], self.weights[order]
+        # Centroid i spans ranks [start, start + w - 1]; place its value at the middle of that span
+        centers = np.cumsum(weights) - weights + (weights - 1) / 2
+        return float(np.interp(q * (self.count - 1), centers, values))
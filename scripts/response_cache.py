@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import datetime
+import logging
+import threading
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+cache_path = os.getenv("API_CACHE_PATH", os.path.join(script_dir, "..", "data", "raw", "api_cache.json"))
+
+API_CACHE_ENABLED = os.getenv("API_CACHE_ENABLED", "1") == "1"
+API_READING_INTERVAL_SECONDS = float(os.getenv("API_READING_INTERVAL_SECONDS", "3600")) # AirVisual updates nearest_city about hourly
+API_CACHE_TTL_SECONDS = float(os.getenv("API_CACHE_TTL_SECONDS", "86400")) # Entries not refreshed for this long are evicted
+API_CACHE_COORD_DECIMALS = int(os.getenv("API_CACHE_COORD_DECIMALS", "2")) # ~1 km: nearby queries share one nearest city
+
+def reading_epoch(ts):
+    """Epoch seconds of an AirVisual reading timestamp such as '2025-01-01T10:00:00.000Z'."""
+    return datetime.datetime.fromisoformat(ts.replace("Z", "+00:00")).timestamp()
+
+class ResponseCache:
+    """Persistent nearest_city response cache plus the last stored reading per station.
+
+    Responses are keyed by the query point rounded to API_CACHE_COORD_DECIMALS and hold the reading
+    `ts` they carry. A cached response is served until its reading is API_READING_INTERVAL_SECONDS old,
+    i.e. until AirVisual can have published a newer one. Thread-safe for the ingestion workers.
+    """
+
+    def __init__(self, path=None, entries=None, stations=None):
+        self.path = path or cache_path
+        self.entries = entries or {}
+        self.stations = stations or {} # "lat,lon" of the returned station -> last stored reading ts
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path=None):
+        """Loads the cache file (module-level cache_path by default, read at call time); empty if missing or corrupt."""
+        path = path or cache_path
+        try:
+            with open(path, "r") as f:
+                cached = json.load(f)
+            return cls(path, cached.get('responses', {}), cached.get('stations', {}))
+        except FileNotFoundError:
+            return cls(path)
+        except (json.JSONDecodeError, AttributeError) as e:
+            logging.warning(f"Ignoring unreadable API cache {path}: {e}")
+            return cls(path)
+
+    @staticmethod
+    def query_key(latitude, longitude):
+        return f"{round(float(latitude), API_CACHE_COORD_DECIMALS)},{round(float(longitude), API_CACHE_COORD_DECIMALS)}"
+
+    @staticmethod
+    def station_key(record):
+        return f"{record['latitude']},{record['longitude']}"
+
+    def get(self, latitude, longitude, now=None):
+        """The cached response for a query point, or None if a newer reading may be available."""
+        now = time.time() if now is None else now
+        with self.lock:
+            entry = self.entries.get(self.query_key(latitude, longitude))
+            if entry is None or now - reading_epoch(entry['ts']) >= API_READING_INTERVAL_SECONDS:
+                return None
+            self.hits += 1
+            return entry['response']
+
+    def put(self, latitude, longitude, response, now=None):
+        """Caches a successful response under its query point and reading ts."""
+        try:
+            ts = response['data']['current']['pollution']['ts']
+        except (KeyError, TypeError):
+            return
+        with self.lock:
+            self.entries[self.query_key(latitude, longitude)] = {
+                'ts': ts, 'fetched_at': time.time() if now is None else now, 'response': response,
+            }
+
+    def new_readings(self, records):
+        """Drops records whose station's reading ts was already stored, including repeats within the batch."""
+        fresh, seen = [], set()
+        for record in records:
+            if not record:
+                continue
+            key = self.station_key(record)
+            if self.stations.get(key) == record['timestamp'] or (key, record['timestamp']) in seen:
+                continue
+            seen.add((key, record['timestamp']))
+            fresh.append(record)
+        return fresh
+
+    def mark_stored(self, records):
+        """Records the latest stored reading ts per station."""
+        for record in records:
+            key = self.station_key(record)
+            if key not in self.stations or reading_epoch(record['timestamp']) > reading_epoch(self.stations[key]):
+                self.stations[key] = record['timestamp']
+
+    def evict(self, now=None):
+        """Drops responses not refreshed, and stations without a stored reading, within API_CACHE_TTL_SECONDS.
+
+        Returns how many responses were dropped.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            expired = [key for key, entry in self.entries.items() if now - entry['fetched_at'] > API_CACHE_TTL_SECONDS]
+            for key in expired:
+                del self.entries[key]
+            stale = [key for key, ts in self.stations.items() if now - reading_epoch(ts) > API_CACHE_TTL_SECONDS]
+            for key in stale:
+                del self.stations[key]
+        return len(expired)
+
+    def save(self):
+        """Evicts expired entries and writes the cache atomically."""
+        self.evict()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with self.lock:
+            with open(tmp_path, "w") as f:
+                json.dump({'responses': self.entries, 'stations': self.stations}, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,251 @@
+import os
+import glob
+import json
+import logging
+import datetime
+import sqlite3
+import pandas as pd
+from storage import HAS_PYARROW
+from metrics import METRICS
+from database_operations import AIR_QUALITY_SELECT, NATURAL_KEY_COLUMNS, create_air_quality_table
+
+if HAS_PYARROW:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+db_path = os.path.join(script_dir, "..", "data", "raw", "air_quality_data.db")
+archive_dir = os.getenv("ARCHIVE_DIR", os.path.join(script_dir, "..", "data", "archive"))
+state_path = os.path.join(script_dir, "..", "data", "raw", "maintenance_state.json")
+
+RETENTION_DAYS = float(os.getenv("RETENTION_DAYS", "180")) # Hot window kept in SQLite; older readings move to the archive, <= 0 keeps everything
+MAINTENANCE_INTERVAL_HOURS = float(os.getenv("MAINTENANCE_INTERVAL_HOURS", "24")) # Archive, vacuum and analyze at most this often
+ARCHIVE_FORMAT = os.getenv("ARCHIVE_FORMAT", "parquet" if HAS_PYARROW else "csv") # "parquet" (zstd) or "csv" (gzip)
+ARCHIVE_CHUNK_ROWS = int(os.getenv("ARCHIVE_CHUNK_ROWS", "500000")) # Readings moved per transaction
+VACUUM_FREE_FRACTION = float(os.getenv("VACUUM_FREE_FRACTION", "0.1")) # Reclaim free pages once they exceed this share of the file
+
+EXTENSIONS = {'parquet': ".parquet", 'csv': ".csv.gz"}
+STAGING_PREFIX = "pending_"
+# Epoch seconds of a reading; its timestamps come in several ISO spellings
+READING_EPOCH = "CAST(strftime('%s', r.timestamp) AS INTEGER)"
+NATURAL_KEY = list(NATURAL_KEY_COLUMNS)
+
+def retention_cutoff(now=None, retention_days=RETENTION_DAYS):
+    """Start of the hot window, floored to UTC midnight so no daily rollup bucket straddles it."""
+    now = pd.Timestamp.now(tz='UTC') if now is None else pd.Timestamp(now)
+    return (now - pd.Timedelta(days=retention_days)).floor('D')
+
+def archive_files(directory=None):
+    """Promoted archive files, in month then id order."""
+    directory = directory or archive_dir
+    return sorted(path for ext in EXTENSIONS.values() for path in glob.glob(os.path.join(directory, f"readings_*{ext}")))
+
+def _write_archive(df, path):
+    if path.endswith(EXTENSIONS['parquet']):
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path, compression='zstd')
+    else:
+        df.to_csv(path, index=False, compression='gzip')
+
+def _read_archive(path, columns=None):
+    if path.endswith(EXTENSIONS['parquet']):
+        return pq.read_table(path, columns=columns).to_pandas()
+    return pd.read_csv(path, usecols=columns)
+
+def _iter_archive(path, chunksize):
+    if path.endswith(EXTENSIONS['parquet']):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize)
+
+def _promote(staged):
+    directory, name = os.path.split(staged)
+    os.replace(staged, os.path.join(directory, name[len(STAGING_PREFIX):]))
+
+def recover_pending(conn, directory=None):
+    """Finishes or discards archive files left staged by an interrupted run.
+
+    A file's readings are deleted in one transaction. If its first and last readings are still in
+    SQLite, that delete never committed and the file is discarded (the readings are archived again);
+    otherwise it is promoted. Either way each reading ends up in exactly one place.
+    """
+    for staged in glob.glob(os.path.join(directory or archive_dir, f"{STAGING_PREFIX}readings_*")):
+        ids = _read_archive(staged, columns=['id'])['id']
+        hot = conn.execute("SELECT COUNT(*) FROM readings WHERE id IN (?, ?)", (int(ids.min()), int(ids.max()))).fetchone()[0]
+        if hot:
+            os.remove(staged)
+        else:
+            _promote(staged)
+        logging.info(f"Recovered staged archive {staged} ({'discarded' if hot else 'promoted'}).")
+
+def seed_archived_keys(conn, directory=None):
+    """Records the natural keys of archive files written before archived_keys existed; a no-op once it holds any."""
+    files = archive_files(directory)
+    if not files or conn.execute("SELECT 1 FROM archived_keys LIMIT 1").fetchone():
+        return 0
+    seeded = 0
+    with conn:
+        for path in files:
+            keys = _read_archive(path, columns=NATURAL_KEY)[NATURAL_KEY]
+            conn.executemany("INSERT OR IGNORE INTO archived_keys (station_id, timestamp) VALUES (?, ?)",
+                             zip(keys['station_id'].astype(int).tolist(), keys['timestamp'].astype(str).tolist()))
+            seeded += len(keys)
+    logging.info(f"Recorded the keys of {seeded} previously archived readings.")
+    return seeded
+
+def archive_old_readings(conn, cutoff, max_id=None, directory=None, archive_format=None, chunk_rows=ARCHIVE_CHUNK_ROWS):
+    """Moves readings older than `cutoff` (and with id <= max_id) from SQLite to compressed archive files.
+
+    Works in id-ordered chunks: each chunk is written as one staged file per month, deleted from
+    SQLite in one transaction that also records its natural keys in archived_keys (so the insert
+    path never stores those readings again), then the files are promoted. Rollups are left alone, so trends still
+    cover the archived months. Returns the number of readings archived.
+    """
+    directory = directory or archive_dir
+    extension = EXTENSIONS[archive_format or ARCHIVE_FORMAT]
+    os.makedirs(directory, exist_ok=True)
+    recover_pending(conn, directory)
+    seed_archived_keys(conn, directory)
+
+    predicate = f"{READING_EPOCH} < ? AND r.id <= ?"
+    bounds = (int(cutoff.timestamp()), max_id if max_id is not None else 2 ** 63 - 1)
+    archived, after_id = 0, 0
+    while True:
+        # The base tables rather than the air_quality view, which the planner cannot drive by r.id
+        chunk = pd.read_sql_query(f"{AIR_QUALITY_SELECT} WHERE r.id > ? AND {predicate} ORDER BY r.id LIMIT ?",
+                                  conn, params=(after_id, *bounds, chunk_rows))
+        if chunk.empty:
+            break
+        first, last = int(chunk['id'].min()), int(chunk['id'].max())
+        months = pd.to_datetime(chunk['timestamp'], utc=True, format='ISO8601').dt.strftime('%Y-%m')
+        staged = []
+        for month, rows in chunk.groupby(months, sort=True):
+            path = os.path.join(directory, f"{STAGING_PREFIX}readings_{month}_{rows['id'].min():012d}-{rows['id'].max():012d}{extension}")
+            _write_archive(rows, path)
+            staged.append(path)
+        with conn: # Same predicate over the chunk's id range: exactly the rows just written
+            conn.execute(f"INSERT OR IGNORE INTO archived_keys (station_id, timestamp) SELECT r.station_id, r.timestamp "
+                         f"FROM readings r WHERE r.id BETWEEN ? AND ? AND {predicate}", (first, last, *bounds))
+            conn.execute(f"DELETE FROM readings AS r WHERE r.id BETWEEN ? AND ? AND {predicate}", (first, last, *bounds))
+        for path in staged:
+            _promote(path)
+        archived += len(chunk)
+        after_id = last
+    if archived:
+        logging.info(f"Archived {archived} readings older than {cutoff:%Y-%m-%d} to {directory}.")
+    return archived
+
+def compact(conn, free_fraction=VACUUM_FREE_FRACTION):
+    """Returns free pages to the filesystem and refreshes the query planner's statistics.
+
+    The first call switches the file to incremental auto-vacuum (a one-off full VACUUM); later calls
+    release free pages with PRAGMA incremental_vacuum once they exceed free_fraction of the file.
+    Returns (pages before, pages after).
+    """
+    pages_before = conn.execute("PRAGMA page_count").fetchone()[0]
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2: # 2 = INCREMENTAL
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    else:
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if pages_before and free / pages_before > free_fraction:
+            conn.execute("PRAGMA incremental_vacuum").fetchall()
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    return pages_before, conn.execute("PRAGMA page_count").fetchone()[0]
+
+def load_maintenance_state():
+    try:
+        with open(state_path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def maintenance_due(now=None):
+    state = load_maintenance_state()
+    if state is None:
+        return True
+    now = datetime.datetime.utcnow() if now is None else now
+    return now - datetime.datetime.fromisoformat(state['last_run']) >= datetime.timedelta(hours=MAINTENANCE_INTERVAL_HOURS)
+
+def run_maintenance(max_id=None, force=False, db_file=None):
+    """Archives readings past the hot window, then compacts and analyzes the database.
+
+    Runs at most every MAINTENANCE_INTERVAL_HOURS unless forced. Pass the cleaning watermark as
+    max_id so readings the incremental cleaner has not seen yet stay in SQLite.
+    Returns a summary dict, or None when maintenance is not due.
+    """
+    if not force and not maintenance_due():
+        return None
+    conn = sqlite3.connect(db_file or db_path)
+    try:
+        conn.execute("PRAGMA busy_timeout=5000;")
+        create_air_quality_table(conn) # Migrates a legacy database before anything reads `readings`
+        archived = 0
+        if RETENTION_DAYS > 0:
+            with METRICS.stage('maintenance.archive') as record:
+                archived = archive_old_readings(conn, retention_cutoff(), max_id)
+                record['rows'] = archived
+        with METRICS.stage('maintenance.compact'):
+            pages_before, pages_after = compact(conn)
+    finally:
+        conn.close()
+    summary = {
+        'last_run': datetime.datetime.utcnow().isoformat(),
+        'archived': archived, 'pages_before': pages_before, 'pages_after': pages_after,
+    }
+    with open(state_path, "w") as f:
+        json.dump(summary, f, indent=2)
+    logging.info(f"Maintenance archived {archived} readings; database {pages_before} -> {pages_after} pages.")
+    return summary
+
+#-----Reads over hot and archived readings-----#
+def load_history(conn, directory=None):
+    """Every reading, archived then hot, with the air_quality view's columns; one row per natural key."""
+    archived = [_read_archive(path) for path in archive_files(directory)]
+    hot = pd.read_sql_query("SELECT * FROM air_quality", conn)
+    frames = [frame for frame in archived + [hot] if not frame.empty]
+    if not frames:
+        return hot
+    history = pd.concat(frames, ignore_index=True)
+    if not archived: # Nothing archived yet (the database may not even be migrated); the unique index holds
+        return history
+    history['timestamp'] = history['timestamp'].astype(str)
+    # Readings stored twice before archived_keys existed: the archived (earlier) copy wins
+    return history.drop_duplicates(subset=NATURAL_KEY, keep='first', ignore_index=True)
+
+def iter_history(conn, chunksize, after_id=0, directory=None):
+    """Yields readings with id > after_id, `chunksize` at a time: the archive files, then the hot table in id order.
+
+    Hot readings whose natural key is archived are skipped, as are repeats within a chunk.
+    """
+    files = archive_files(directory)
+    for path in files:
+        for chunk in _iter_archive(path, chunksize):
+            chunk = chunk[chunk['id'] > after_id]
+            if not chunk.empty:
+                yield chunk.drop_duplicates(subset=NATURAL_KEY)
+    query = "SELECT * FROM air_quality a WHERE id > ?"
+    if files: # Only an archived (so migrated) database has archived_keys
+        query += " AND NOT EXISTS (SELECT 1 FROM archived_keys k WHERE k.station_id = a.station_id AND k.timestamp = a.timestamp)"
+    yield from pd.read_sql_query(f"{query} ORDER BY id", conn, params=(after_id,), chunksize=chunksize)
+
+def load_recent_history(conn, rows, directory=None):
+    """The `rows` most recent readings by id: the hot table, topped up from the newest archive files when it holds fewer."""
+    frames = [pd.read_sql_query("SELECT * FROM air_quality ORDER BY id DESC LIMIT ?", conn, params=(rows,))]
+    missing = rows - len(frames[0])
+    for path in reversed(archive_files(directory)):
+        if missing <= 0:
+            break
+        archived = _read_archive(path).sort_values('id', ascending=False).head(missing)
+        frames.append(archived)
+        missing -= len(archived)
+    frames = [frame for frame in frames if not frame.empty]
+    return pd.concat(frames, ignore_index=True) if frames else pd.read_sql_query("SELECT * FROM air_quality LIMIT 0", conn)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    from data_cleaning import load_cleaning_state
+    state = load_cleaning_state()
+    run_maintenance(max_id=state['last_id'] if state else 0, force=True)
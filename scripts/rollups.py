@@ -0,0 +1,186 @@
+import os
+import logging
+import pandas as pd
+
+# Per-station hourly and daily aggregates of `readings`, kept current at insert time. Each level
+# stores min, max, sum and count per field, so buckets can be merged exactly into coarser ones
+# (mean = sum / count) and a trend over months reads hundreds of rows instead of millions.
+ROLLUP_FIELDS = ['aqi', 'pm25', 'pm10', 'temperature', 'humidity', 'wind_speed', 'wind_direction', 'pressure']
+# (table, bucket width in seconds, strftime format of the bucket start), coarsest first
+ROLLUP_LEVELS = [
+    ('rollup_daily', 86400, '%Y-%m-%dT00:00:00Z'),
+    ('rollup_hourly', 3600, '%Y-%m-%dT%H:00:00Z'),
+]
+AGGREGATES = ['min', 'max', 'sum', 'count']
+
+def _columns():
+    return [f"{field}_{agg}" for field in ROLLUP_FIELDS for agg in AGGREGATES]
+
+def create_rollup_tables(conn):
+    """Creates the rollup tables; returns True if any of them is new (and so needs a rebuild)."""
+    created = False
+    for table, _, _ in ROLLUP_LEVELS:
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+        columns = ",\n".join(f"{col} INTEGER" if col.endswith('_count') else f"{col} REAL" for col in _columns())
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                station_id INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                {columns},
+                PRIMARY KEY (station_id, bucket)
+            ) WITHOUT ROWID;
+        """)
+        created = created or not exists
+    return created
+
+def _merge_sql(table, bucket_format, source="readings NOT INDEXED", where="id > ?"):
+    """Aggregates `source` rows matching `where` per (station, bucket) and merges them into existing buckets.
+
+    The default source is the readings inserted after an id. The planner hint skips a whole
+    (station_id, timestamp) index scan that would only avoid a sort.
+    """
+    selects = ", ".join(f"MIN({f}), MAX({f}), TOTAL({f}), COUNT({f})" for f in ROLLUP_FIELDS)
+    # Scalar MIN/MAX return NULL if either side is NULL, so an all-NULL side defers to the other
+    updates = ", ".join(
+        f"{f}_min = MIN(COALESCE({f}_min, excluded.{f}_min), COALESCE(excluded.{f}_min, {f}_min)), "
+        f"{f}_max = MAX(COALESCE({f}_max, excluded.{f}_max), COALESCE(excluded.{f}_max, {f}_max)), "
+        f"{f}_sum = {f}_sum + excluded.{f}_sum, "
+        f"{f}_count = {f}_count + excluded.{f}_count"
+        for f in ROLLUP_FIELDS
+    )
+    return f"""
+        INSERT INTO {table} (station_id, bucket, {", ".join(_columns())})
+        SELECT station_id, strftime('{bucket_format}', timestamp) AS bucket, {selects}
+        FROM {source}
+        WHERE {where}
+        GROUP BY station_id, bucket
+        ON CONFLICT (station_id, bucket) DO UPDATE SET {updates};
+    """
+
+def last_reading_id(conn):
+    """Highest reading id so far; rows inserted afterwards have larger ids (AUTOINCREMENT)."""
+    return conn.execute("SELECT COALESCE(MAX(id), 0) FROM readings").fetchone()[0]
+
+def update_rollups(conn, after_id):
+    """Folds the readings inserted after `after_id` into every rollup level, in the caller's transaction."""
+    for table, _, bucket_format in ROLLUP_LEVELS:
+        conn.execute(_merge_sql(table, bucket_format), (after_id,))
+
+def _hot_buckets(bucket_format):
+    """(station_id, bucket) pairs that have readings in the hot table."""
+    return f"SELECT station_id, strftime('{bucket_format}', timestamp) FROM readings"
+
+def _load_archived_overlap(conn, directory=None):
+    """Copies the archived readings that share a daily bucket with hot readings into a temp table; returns the count.
+
+    Retention cuts at UTC midnight, so this is normally empty; a backfill of old readings can
+    put hot readings back into archived days.
+    """
+    import retention # Deferred: retention pulls in the optional Parquet stack
+    daily_format = ROLLUP_LEVELS[0][2]
+    conn.execute("DROP TABLE IF EXISTS temp.archived_readings")
+    conn.execute(f"CREATE TEMP TABLE archived_readings (station_id INTEGER, timestamp TEXT, {', '.join(f'{f} REAL' for f in ROLLUP_FIELDS)})")
+    files = retention.archive_files(directory)
+    oldest = conn.execute("SELECT MIN(CAST(strftime('%s', timestamp) AS INTEGER)) FROM readings").fetchone()[0]
+    if not files or oldest is None:
+        return 0
+    first_month = pd.Timestamp(oldest, unit='s').strftime('%Y-%m')
+    hot_days = pd.read_sql_query(f"SELECT DISTINCT station_id, strftime('{daily_format}', timestamp) AS day FROM readings", conn)
+    copied = 0
+    for path in files:
+        if os.path.basename(path)[len("readings_"):][:7] < first_month: # Files are named readings_<YYYY-MM>_...
+            continue
+        columns = ['station_id', 'timestamp'] + ROLLUP_FIELDS
+        rows = retention._read_archive(path, columns=columns)[columns] # CSV keeps the file's column order
+        rows['timestamp'] = rows['timestamp'].astype(str)
+        rows['day'] = pd.to_datetime(rows['timestamp'], utc=True, format='ISO8601').dt.strftime(daily_format)
+        rows = rows.merge(hot_days, on=['station_id', 'day']).drop(columns='day')
+        rows = rows.astype(object).where(rows.notna(), None)
+        conn.executemany(f"INSERT INTO archived_readings VALUES ({', '.join('?' for _ in rows.columns)})", rows.itertuples(index=False))
+        copied += len(rows)
+    return copied
+
+def rebuild_rollups(conn, archive_directory=None):
+    """Recomputes the rollup buckets that have readings in the hot table (after migrations or deletes).
+
+    Buckets holding only archived readings (see retention.py) are kept as they are. A bucket with
+    both hot and archived readings is recomputed from both, so no archived reading is dropped.
+    """
+    with conn:
+        archived = _load_archived_overlap(conn, archive_directory)
+        for table, _, bucket_format in ROLLUP_LEVELS:
+            conn.execute(f"DELETE FROM {table} WHERE (station_id, bucket) IN ({_hot_buckets(bucket_format)});")
+            conn.execute(_merge_sql(table, bucket_format), (0,))
+            if archived:
+                conn.execute(_merge_sql(table, bucket_format, source="temp.archived_readings",
+                                        where=f"(station_id, strftime('{bucket_format}', timestamp)) IN ({_hot_buckets(bucket_format)})"))
+        conn.execute("DROP TABLE IF EXISTS temp.archived_readings")
+    logging.info(f"Rebuilt {', '.join(t for t, _, _ in ROLLUP_LEVELS)} from {last_reading_id(conn)} readings"
+                 f" and {archived} archived readings sharing their buckets.")
+
+def _utc(value):
+    """A bound as a UTC Timestamp (naive values are taken as UTC); None passes through."""
+    if value is None:
+        return None
+    value = pd.Timestamp(value)
+    return value.tz_localize('UTC') if value.tzinfo is None else value.tz_convert('UTC')
+
+def _epoch(value):
+    return None if value is None else int(_utc(value).timestamp())
+
+def choose_level(interval_seconds, start=None, end=None):
+    """The coarsest rollup whose buckets tile both the interval and the [start, end) range; None means raw readings."""
+    for table, width, bucket_format in ROLLUP_LEVELS:
+        if interval_seconds % width == 0 and all(t is None or t % width == 0 for t in (_epoch(start), _epoch(end))):
+            return table, width, bucket_format
+    return None
+
+def query_rollups(conn, interval='1D', start=None, end=None, station_ids=None, fields=None):
+    """Per-station min/mean/max/count of `fields` per `interval` (a pandas offset such as '1h', '6h', '1D', '7D').
+
+    Reads the coarsest rollup that answers the query exactly; intervals or bounds finer than an hour
+    fall back to the raw readings. Keeps start <= bucket < end. Returns one row per (station, bucket)
+    with the station's coordinates and names, bucket as a UTC timestamp.
+    """
+    fields = fields or ROLLUP_FIELDS
+    interval_seconds = int(pd.Timedelta(interval).total_seconds())
+    level = choose_level(interval_seconds, start, end)
+    if level is None:
+        source = f"""(SELECT station_id, timestamp AS bucket,
+            {", ".join(f"{f} AS {f}_min, {f} AS {f}_max, {f} AS {f}_sum, ({f} IS NOT NULL) AS {f}_count" for f in fields)}
+            FROM readings)"""
+        logging.info(f"Aggregating raw readings per {interval}.")
+    else:
+        source = level[0]
+        logging.info(f"Aggregating {level[0]} per {interval}.")
+
+    conditions, params = [], [interval_seconds, interval_seconds]
+    for bound, op in ((start, ">="), (end, "<")):
+        if bound is None:
+            continue
+        if level is None: # Raw timestamps come in several ISO spellings; compare as epochs
+            conditions.append(f"CAST(strftime('%s', r.bucket) AS INTEGER) {op} ?")
+            params.append(_epoch(bound))
+        else: # Bucket text sorts chronologically, so the (station_id, bucket) key serves the range
+            conditions.append(f"r.bucket {op} ?")
+            params.append(_utc(bound).strftime('%Y-%m-%dT%H:%M:%SZ'))
+    if station_ids is not None:
+        conditions.append(f"r.station_id IN ({', '.join('?' for _ in station_ids)})")
+        params.extend(station_ids)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    aggregates = ", ".join(
+        f"MIN(r.{f}_min) AS {f}_min, TOTAL(r.{f}_sum) / SUM(r.{f}_count) AS {f}_mean, "
+        f"MAX(r.{f}_max) AS {f}_max, SUM(r.{f}_count) AS {f}_count"
+        for f in fields
+    )
+    query = f"""
+        SELECT r.station_id, CAST(strftime('%s', r.bucket) AS INTEGER) / ? * ? AS bucket_start,
+               s.latitude, s.longitude, s.city, s.state, s.country, {aggregates}
+        FROM {source} r JOIN stations s ON s.station_id = r.station_id
+        {where}
+        GROUP BY r.station_id, bucket_start
+        ORDER BY r.station_id, bucket_start;
+    """
+    df = pd.read_sql_query(query, conn, params=params)
+    df.insert(1, 'bucket', pd.to_datetime(df.pop('bucket_start'), unit='s', utc=True))
+    return df
@@ -0,0 +1,47 @@
+import logging
+import numpy as np
+import pandas as pd
+
+# One dtype schema for every stage, applied at load time:
+#   timestamps          -> datetime64[ns, UTC], parsed once
+#   repeated text       -> category
+#   coordinates         -> float64 (station keys, joined by exact equality)
+#   ids                 -> int64 (row and station keys; never cleaned or used as features)
+#   every other numeric -> float32 (the tree models bin features as float32 anyway)
+TIMESTAMP_COLUMNS = ['timestamp']
+CATEGORICAL_COLUMNS = ['city', 'state', 'country', 'main_pollutant']
+FLOAT64_COLUMNS = ['latitude', 'longitude']
+INTEGER_COLUMNS = ['id', 'station_id']
+FLOAT_DTYPE = np.float32
+
+def apply_schema(df):
+    """Casts a frame from any stage to the pipeline schema; columns the schema does not know are left alone."""
+    dtypes = {}
+    for col in df.columns:
+        if col in TIMESTAMP_COLUMNS:
+            continue
+        if col in CATEGORICAL_COLUMNS:
+            if not isinstance(df[col].dtype, pd.CategoricalDtype):
+                dtypes[col] = 'category'
+        elif col in FLOAT64_COLUMNS:
+            dtypes[col] = np.float64
+        elif col in INTEGER_COLUMNS:
+            if not df[col].isna().any():
+                dtypes[col] = np.int64
+        elif pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col]):
+            dtypes[col] = FLOAT_DTYPE
+    df = df.astype({col: dtype for col, dtype in dtypes.items() if df[col].dtype != dtype})
+    for col in TIMESTAMP_COLUMNS:
+        if col in df.columns and df[col].dtype != 'datetime64[ns, UTC]':
+            df[col] = pd.to_datetime(df[col], utc=True).astype('datetime64[ns, UTC]')
+    return df
+
+def memory_mb(df):
+    """Deep memory usage of a frame in MB (includes string and category payloads)."""
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
+
+def log_memory(stage, df):
+    """Logs the rows and deep memory of a stage's frame; returns the MB figure."""
+    mb = memory_mb(df)
+    logging.info(f"Stage '{stage}' frame: {len(df)} rows x {df.shape[1]} columns, {mb:.2f} MB.")
+    return mb
@@ -0,0 +1,126 @@
+import os
+import json
+import logging
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+from temporal_features import epoch_seconds
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+locations_path = os.path.join(script_dir, "..", "locations.json")
+# Cached station table: recomputed only when a new station or city center appears
+station_table_path = os.path.join(script_dir, "..", "data", "processed", "stations.json")
+
+EARTH_RADIUS_KM = 6371.0088
+STATION_KEYS = ['latitude', 'longitude']
+N_NEIGHBOURS = int(os.getenv("N_NEIGHBOURS", "3")) # Nearest other stations per station
+NEIGHBOUR_RADIUS_KM = float(os.getenv("NEIGHBOUR_RADIUS_KM", "1000")) # Farther stations are not neighbours
+NEIGHBOUR_MAX_AGE_HOURS = float(os.getenv("NEIGHBOUR_MAX_AGE_HOURS", "3")) # Older neighbour readings are ignored
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km between arrays of points given in degrees."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=float)) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+def load_city_centers(path=locations_path):
+    """The configured query points from locations.json, one per city."""
+    with open(path, "r") as f:
+        return pd.DataFrame(json.load(f))[STATION_KEYS]
+
+def build_station_table(stations, centers, n_neighbours=N_NEIGHBOURS):
+    """Per-station spatial attributes, computed once per station rather than once per row.
+
+    Each station is assigned to its nearest city center, and its nearest other stations are found
+    with a haversine BallTree; neighbours beyond NEIGHBOUR_RADIUS_KM are marked -1.
+    """
+    stations = stations[STATION_KEYS].drop_duplicates().sort_values(STATION_KEYS).reset_index(drop=True)
+    station_radians = np.radians(stations[STATION_KEYS].to_numpy(dtype=float))
+
+    center_tree = BallTree(np.radians(centers[STATION_KEYS].to_numpy(dtype=float)), metric='haversine')
+    center_idx = center_tree.query(station_radians, k=1, return_distance=False)[:, 0]
+    table = stations.copy()
+    table['station_id'] = np.arange(len(table))
+    table['center_id'] = center_idx
+    center = centers.iloc[center_idx]
+    table['distance_from_city_center'] = haversine_km(table['latitude'], table['longitude'], center['latitude'], center['longitude'])
+
+    k = min(n_neighbours + 1, len(table)) # +1: a station is its own nearest point
+    distance, idx = BallTree(station_radians, metric='haversine').query(station_radians, k=k)
+    distance, idx = distance[:, 1:] * EARTH_RADIUS_KM, idx[:, 1:]
+    idx = np.where(distance <= NEIGHBOUR_RADIUS_KM, idx, -1)
+    table['nearest_station_km'] = distance[:, 0] if k > 1 else np.nan
+    for j in range(n_neighbours):
+        table[f'neighbour_{j}'] = idx[:, j] if j < idx.shape[1] else -1
+    return table
+
+def load_station_table(stations, path=None, centers_path=None):
+    """Returns the cached station table, rebuilding and saving it if it misses any station or center.
+
+    Paths default to the module-level station_table_path and locations_path, read at call time.
+    """
+    path = path or station_table_path
+    centers = load_city_centers(centers_path or locations_path)
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            cached = json.load(f)
+        table = pd.DataFrame(cached['stations'])
+        known = table.merge(stations[STATION_KEYS].drop_duplicates(), on=STATION_KEYS)
+        if cached['centers'] == centers.to_dict('records') and cached['n_neighbours'] == N_NEIGHBOURS \
+                and len(known) == len(stations[STATION_KEYS].drop_duplicates()):
+            return table
+        stations = pd.concat([table[STATION_KEYS], stations[STATION_KEYS]]) # Keep previously seen stations
+
+    table = build_station_table(stations, centers)
+    with open(path, "w") as f:
+        json.dump({'centers': centers.to_dict('records'), 'n_neighbours': N_NEIGHBOURS,
+                   'stations': table.to_dict('records')}, f)
+    logging.info(f"Built station table for {len(table)} stations ({len(centers)} city centers).")
+    return table
+
+def neighbour_aqi(station_ids, seconds, aqi, neighbours, max_age_hours=NEIGHBOUR_MAX_AGE_HOURS):
+    """Mean of each row's neighbour stations' latest AQI strictly before the row's timestamp.
+
+    Readings older than max_age_hours are ignored; NaN when no neighbour has a recent reading.
+    One searchsorted per neighbour rank on a (station, time) composite key: O(rows * k log rows).
+    """
+    order = np.lexsort((seconds, station_ids))
+    sorted_ids, sorted_seconds, sorted_aqi = station_ids[order], seconds[order], aqi[order]
+    offset = seconds.min()
+    span = int(seconds.max() - offset) + 1
+    key = sorted_ids.astype(np.int64) * span + (sorted_seconds - offset)
+
+    total = np.zeros(len(station_ids))
+    count = np.zeros(len(station_ids))
+    max_age = max_age_hours * 3600
+    for j in range(neighbours.shape[1]):
+        neighbour = neighbours[station_ids, j]
+        idx = np.searchsorted(key, np.maximum(neighbour, 0).astype(np.int64) * span + (seconds - offset), side='left') - 1
+        safe = np.maximum(idx, 0)
+        valid = (neighbour >= 0) & (idx >= 0) & (sorted_ids[safe] == neighbour) \
+            & (seconds - sorted_seconds[safe] <= max_age) & ~np.isnan(sorted_aqi[safe])
+        total += np.where(valid, sorted_aqi[safe], 0.0)
+        count += valid
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, total / count, np.nan)
+
+def add_spatial_features(df, station_table=None):
+    """Adds geodesic spatial features, keeping the frame's row order.
+
+    distance_from_city_center  km from the station to its nearest city in locations.json
+    nearest_station_km         km to the nearest other station
+    neighbour_aqi              mean recent AQI of the nearest stations (needs 'aqi' and 'timestamp')
+    """
+    if station_table is None:
+        station_table = load_station_table(df)
+    attributes = df[STATION_KEYS].merge(station_table, on=STATION_KEYS, how='left')
+    df = df.copy()
+    df['distance_from_city_center'] = attributes['distance_from_city_center'].to_numpy()
+    df['nearest_station_km'] = attributes['nearest_station_km'].to_numpy()
+
+    if 'aqi' in df.columns and 'timestamp' in df.columns:
+        neighbour_columns = [col for col in station_table.columns if col.startswith('neighbour_')]
+        neighbours = station_table.sort_values('station_id')[neighbour_columns].to_numpy(dtype=np.int64)
+        df['neighbour_aqi'] = neighbour_aqi(attributes['station_id'].to_numpy(dtype=np.int64), epoch_seconds(df['timestamp']),
+                                            df['aqi'].to_numpy(dtype=float), neighbours)
+    return df
@@ -0,0 +1,169 @@
+import os
+import shutil
+import logging
+import pandas as pd
+from schema import apply_schema
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError: # Fall back to the legacy CSV files
+    HAS_PYARROW = False
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+processed_dir = os.path.join(script_dir, "..", "data", "processed")
+
+DATA_FORMAT = os.getenv("DATA_FORMAT", "parquet" if HAS_PYARROW else "csv") # "parquet" or "csv"
+
+# Parquet datasets are directories partitioned as year_month=YYYY-MM/location=<city>/, one file per partition
+DATASETS = {
+    'cleaned': {'parquet': os.path.join(processed_dir, "cleaned"), 'csv': os.path.join(processed_dir, "cleaned_data.csv")},
+    'featured': {'parquet': os.path.join(processed_dir, "featured"), 'csv': os.path.join(processed_dir, "featured_data.csv")},
+}
+PARTITION_COLUMNS = ['year_month', 'location']
+
+def dataset_path(name, data_format=None):
+    return DATASETS[name][data_format or DATA_FORMAT]
+
+def convert_legacy_csv(name):
+    """One-off: converts a dataset left as CSV (from before Parquet, or written without pyarrow) to Parquet.
+
+    Runs when the Parquet dataset is missing but the CSV exists; the CSV is kept. Returns True if it converted.
+    """
+    if DATA_FORMAT != "parquet" or os.path.exists(dataset_path(name)):
+        return False
+    csv_path = dataset_path(name, "csv")
+    if not os.path.exists(csv_path):
+        return False
+    df = apply_schema(pd.read_csv(csv_path))
+    save_dataset(df, name)
+    logging.info(f"Converted {csv_path} ({len(df)} rows) to the Parquet {name} dataset.")
+    return True
+
+def dataset_exists(name):
+    convert_legacy_csv(name)
+    return os.path.exists(dataset_path(name))
+
+def _utc(value):
+    if value is None:
+        return None
+    value = pd.Timestamp(value)
+    return value.tz_localize('UTC') if value.tzinfo is None else value.tz_convert('UTC')
+
+def _with_partitions(df):
+    table = apply_schema(df).reset_index(drop=True)
+    table['year_month'] = table['timestamp'].dt.strftime('%Y-%m')
+    table['location'] = table['city'].astype(str) if 'city' in table.columns else 'unknown'
+    return table
+
+def save_dataset(df, name, append=False):
+    """Writes a processed dataset. append=True adds rows; otherwise the dataset is replaced.
+
+    Parquet appends rewrite only the (month, location) partitions the new rows fall in, so each
+    partition stays a single compact file instead of gaining a tiny file every hour.
+    """
+    path = dataset_path(name)
+    if DATA_FORMAT == "csv":
+        if append and os.path.exists(path):
+            header = pd.read_csv(path, nrows=0).columns
+            df[header].to_csv(path, mode='a', header=False, index=False)
+        else:
+            df.to_csv(path, index=False)
+        return path
+
+    if append: # Append to the legacy CSV's rows, not to an empty dataset
+        convert_legacy_csv(name)
+    table = _with_partitions(df)
+    if append and os.path.exists(path):
+        touched = table[PARTITION_COLUMNS].drop_duplicates()
+        dataset = ds.dataset(path, format="parquet", partitioning="hive")
+        expression = ds.field('year_month').isin(touched['year_month'].unique().tolist()) & \
+            ds.field('location').isin(touched['location'].unique().tolist())
+        existing = dataset.to_table(filter=expression).to_pandas()
+        existing = existing.merge(touched, on=PARTITION_COLUMNS) # only the exact (month, location) pairs
+        table = _with_partitions(pd.concat([existing.astype({c: str for c in PARTITION_COLUMNS}), table], ignore_index=True))
+    elif os.path.exists(path):
+        shutil.rmtree(path)
+
+    pq.write_to_dataset(
+        pa.Table.from_pandas(table, preserve_index=False),
+        root_path=path,
+        partition_cols=PARTITION_COLUMNS,
+        basename_template="part-{i}.parquet",
+        existing_data_behavior='delete_matching', # replaces just the partitions being written
+    )
+    logging.info(f"Wrote {len(df)} rows to {name} dataset ({'append' if append else 'replace'}).")
+    return path
+
+def clear_dataset(name):
+    """Deletes a processed dataset, e.g. before it is rewritten chunk by chunk with save_dataset_chunk."""
+    path = dataset_path(name)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+def save_dataset_chunk(df, name, chunk):
+    """Adds rows as new files, one per (month, location) partition touched, leaving existing files alone.
+
+    For bulk rewrites after clear_dataset: each chunk costs only its own rows, where save_dataset's
+    append would re-read and rewrite every partition the chunk touches. `chunk` (a per-rewrite
+    sequence number) keeps the file names unique; later appends fold a partition's files back into one.
+    """
+    path = dataset_path(name)
+    if DATA_FORMAT == "csv":
+        df.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+        return path
+    pq.write_to_dataset(
+        pa.Table.from_pandas(_with_partitions(df), preserve_index=False),
+        root_path=path,
+        partition_cols=PARTITION_COLUMNS,
+        basename_template=f"chunk-{chunk:06d}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore',
+    )
+    return path
+
+def load_dataset(name, columns=None, start=None, end=None, locations=None):
+    """Reads a processed dataset, optionally projecting `columns`, keeping start <= timestamp < end
+    and restricting to the given city `locations`.
+
+    For Parquet, the filters are pushed down to partition pruning (year_month, location) and row-group
+    statistics (timestamp), so only the requested columns, months and cities are read from disk.
+    """
+    convert_legacy_csv(name)
+    path = dataset_path(name)
+    start, end = _utc(start), _utc(end)
+
+    if DATA_FORMAT == "csv":
+        usecols = None
+        if columns is not None:
+            extra = (['timestamp'] if start is not None or end is not None else []) + (['city'] if locations is not None else [])
+            usecols = list(dict.fromkeys(list(columns) + extra))
+        df = apply_schema(pd.read_csv(path, usecols=usecols))
+        if start is not None:
+            df = df[df['timestamp'] >= start]
+        if end is not None:
+            df = df[df['timestamp'] < end]
+        if locations is not None:
+            df = df[df['city'].isin(locations)]
+        return df[list(columns)] if columns is not None else df
+
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    expression = None
+    conditions = []
+    if start is not None:
+        conditions += [ds.field('year_month') >= start.strftime('%Y-%m'), ds.field('timestamp') >= start]
+    if end is not None:
+        conditions += [ds.field('year_month') <= end.strftime('%Y-%m'), ds.field('timestamp') < end]
+    if locations is not None:
+        conditions.append(ds.field('location').isin(list(locations)))
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    if columns is None:
+        columns = [field for field in dataset.schema.names if field not in PARTITION_COLUMNS]
+    df = apply_schema(dataset.to_table(columns=list(columns), filter=expression).to_pandas())
+    if 'timestamp' in df.columns:
+        df = df.sort_values('timestamp', kind='stable').reset_index(drop=True)
+    return df
@@ -1,22 +1,80 @@
 import streamlit as st
 import pandas as pd
-import joblib
 import os
+import json
+import sqlite3
 import matplotlib.pyplot as plt
-from sklearn.preprocessing import StandardScaler
+import storage
+from model import load_model, compile_model, predict_aqi, model_path
+from feature_pipeline import load_feature_pipeline, feature_pipeline_path
+from feature_engineering import add_weather_features, build_dashboard_summary, summary_path
+from data_cleaning import db_path
+from rollups import query_rollups
+
+TREND_DAYS = 90 # Days of daily AQI shown in the trend chart
+
+def file_signature(path):
+    """(mtime_ns, size) of a file, or of the newest file under a directory; None if missing.
+
+    Passed into every cached loader so a new hourly model or dataset invalidates the cache.
+    """
+    if os.path.isdir(path):
+        stats = [os.stat(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names]
+        if not stats:
+            return None
+        return max(s.st_mtime_ns for s in stats), sum(s.st_size for s in stats), len(stats)
+    if os.path.exists(path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    return None
+
+@st.cache_resource(max_entries=1)
+def load_model_cached(path, signature):
+    return compile_model(load_model(path)) # Flat arrays: the app predicts one row at a time
+
+@st.cache_resource(max_entries=1)
+def load_feature_pipeline_cached(path, signature):
+    return load_feature_pipeline(path)
+
+@st.cache_resource(max_entries=1)
+def load_summary_cached(path, signature, dataset_signature, _feature_pipeline):
+    """Reads the precomputed dashboard summary; rebuilds it from the dataset only if it is missing or stale."""
+    if signature is not None and dataset_signature is not None and signature[0] >= dataset_signature[0]:
+        with open(path, "r") as f:
+            return json.load(f)
+    print(f"Dashboard summary missing or stale; rebuilding from {storage.dataset_path('featured')}")
+    return build_dashboard_summary(storage.load_dataset('featured'), _feature_pipeline)
+
+@st.cache_resource(max_entries=1)
+def load_trend_cached(path, signature, wal_signature):
+    """Daily mean AQI across stations for the last TREND_DAYS days, read from the daily rollup."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        end = pd.Timestamp.now(tz='UTC').floor('D') + pd.Timedelta(days=1)
+        daily = query_rollups(conn, '1D', start=end - pd.Timedelta(days=TREND_DAYS), end=end, fields=['aqi'])
+    finally:
+        conn.close()
+    # Station means weighted by their reading counts
+    daily['aqi_sum'] = daily['aqi_mean'] * daily['aqi_count']
+    trend = daily.groupby('bucket')[['aqi_sum', 'aqi_count']].sum()
+    return trend['aqi_sum'] / trend['aqi_count']
 
 def main():
     try:
-        # Load data and model
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        csv_path = os.path.join(script_dir, "..", "data", "processed", "featured_data.csv")
-        print(f"Loading data from: {csv_path}")
-        df = pd.read_csv(csv_path)
-        print(df.columns)
-        model = joblib.load('gb_best_model.joblib')
+        # Fitted model and feature pipeline (scaler, dropped columns, interaction terms, defaults),
+        # plus the dashboard summary; all cached until their files change on disk
+        model = load_model_cached(model_path, file_signature(model_path))
+        feature_pipeline = load_feature_pipeline_cached(feature_pipeline_path, file_signature(feature_pipeline_path))
+        summary = load_summary_cached(
+            summary_path, file_signature(summary_path),
+            file_signature(storage.dataset_path('featured')), feature_pipeline,
+        )
+        bounds = summary['bounds']
+        defaults = summary['defaults']
 
-        # Get the features the model was trained on
-        model_features = model.feature_names_in_.tolist()
+        def feature_slider(label, col):
+            """Slider in raw units, bounded by the training range and defaulting to the training mean."""
+            return st.sidebar.slider(label, float(bounds[col][0]), float(bounds[col][1]), float(defaults[col]))
 
         # Streamlit app layout
         st.title("Air Quality Prediction App")
@@ -26,36 +84,23 @@ def main():
         hour = st.sidebar.slider("Hour of the Day", 0, 23, 12)
         day_of_week = st.sidebar.slider("Day of the Week (0=Monday, 6=Sunday)", 0, 6, 3)
         month = st.sidebar.slider("Month", 1, 12, 7)
-        wind_speed = st.sidebar.slider("Wind Speed", float(df['wind_speed'].min()), float(df['wind_speed'].max()), float(df['wind_speed'].mean()))
-        wind_direction = st.sidebar.slider("Wind Direction", float(df['wind_direction'].min()), float(df['wind_direction'].max()), float(df['wind_direction'].mean()))
-        humidity = st.sidebar.slider("Humidity", float(df['humidity'].min()), float(df['humidity'].max()), float(df['humidity'].mean()))
-        temperature = st.sidebar.slider("Temperature", float(df['temperature'].min()), float(df['temperature'].max()), float(df['temperature'].mean()))
-        pressure = st.sidebar.slider("Pressure", float(df['pressure'].min()), float(df['pressure'].max()), float(df['pressure'].mean()))
-        wind_east = st.sidebar.slider("Wind East Component", float(df['wind_east'].min()), float(df['wind_east'].max()), float(df['wind_east'].mean()))
-        wind_north = st.sidebar.slider("Wind North Component", float(df['wind_north'].min()), float(df['wind_north'].max()), float(df['wind_north'].mean()))
-        humidity_temp_interaction = st.sidebar.slider("Humidity Temp Interaction", float(df['humidity_temp_interaction'].min()), float(df['humidity_temp_interaction'].max()), float(df['humidity_temp_interaction'].mean()))
-
-        # Default values for missing features
-        pm25_mean = df['pm25'].mean()
-        time_since_last_peak_mean = df['time_since_last_peak'].mean()
-        hour_day_of_week_mean = df['hour day_of_week'].mean()
-        hour_month_mean = df['hour month'].mean()
-        day_of_week_month_mean = df['day_of_week month'].mean()
-
-        # Create input_data DataFrame with all features
-        input_data = pd.DataFrame([[hour, day_of_week, month, wind_speed, wind_direction, humidity, temperature, pressure, wind_east, wind_north, humidity_temp_interaction, pm25_mean, time_since_last_peak_mean, hour_day_of_week_mean, hour_month_mean, day_of_week_month_mean]],
-                                  columns=['hour', 'day_of_week', 'month', 'wind_speed', 'wind_direction', 'humidity', 'temperature', 'pressure', 'wind_east', 'wind_north', 'humidity_temp_interaction', 'pm25', 'time_since_last_peak', 'hour day_of_week', 'hour month', 'day_of_week month'])
-
-        # Scale the data
-        numerical_cols = input_data.select_dtypes(include=['number']).columns
-        scaler = StandardScaler()
-        input_data[numerical_cols] = scaler.fit_transform(input_data[numerical_cols])
-
-        # Select only the features the model was trained on
-        input_data = input_data[model_features]
-
-        # Prediction
-        prediction = model.predict(input_data)
+        wind_speed = feature_slider("Wind Speed", 'wind_speed')
+        wind_direction = feature_slider("Wind Direction", 'wind_direction')
+        humidity = feature_slider("Humidity", 'humidity')
+        temperature = feature_slider("Temperature", 'temperature')
+        pressure = feature_slider("Pressure", 'pressure')
+
+        # Raw inputs; wind components and the humidity/temperature interaction are derived from them,
+        # and every other feature takes its training mean inside the feature pipeline
+        input_data = pd.DataFrame([{
+            'hour': hour, 'day_of_week': day_of_week, 'month': month,
+            'wind_speed': wind_speed, 'wind_direction': wind_direction,
+            'humidity': humidity, 'temperature': temperature, 'pressure': pressure,
+        }])
+        input_data = add_weather_features(input_data)
+
+        # Prediction (scaled with the training-time scaler, returned in AQI units)
+        prediction = predict_aqi(model, feature_pipeline, input_data)
 
         # Main content area
         col1, col2 = st.columns(2)  # Divide into two columns
@@ -65,26 +110,37 @@ def main():
             st.write(f"Predicted AQI: {prediction[0]:.2f}")
 
         with col2:
-            # Data visualizations
+            # Data visualizations (from the precomputed summary, independent of dataset size)
             st.subheader("AQI Distribution")
             fig_hist, ax_hist = plt.subplots()
-            ax_hist.hist(df['aqi'])
+            ax_hist.stairs(summary['aqi_histogram']['counts'], summary['aqi_histogram']['edges'], fill=True)
             ax_hist.set_xlabel("AQI Value")  # Add x-axis label
             ax_hist.set_ylabel("Frequency")  # Add y-axis label
             st.pyplot(fig_hist)
 
+            st.subheader("Daily Mean AQI")
+            try:
+                trend = load_trend_cached(db_path, file_signature(db_path), file_signature(f"{db_path}-wal"))
+                if trend.empty:
+                    st.write(f"No readings in the last {TREND_DAYS} days.")
+                else:
+                    st.line_chart(trend.rename("AQI"))
+            except (sqlite3.Error, pd.errors.DatabaseError) as e: # Database missing or not yet migrated to the rollup schema
+                print(f"AQI trend unavailable: {e}")
+                st.write("AQI trend unavailable until the database is migrated (`python database_operations.py`).")
+
             st.subheader("Feature Correlations")
-            numeric_df = df.select_dtypes(include=['number'])
+            columns = summary['correlation']['columns']
             fig_corr, ax_corr = plt.subplots()
-            ax_corr.matshow(numeric_df.corr())
-            ax_corr.set_xticks(range(len(numeric_df.columns)))  # Add x-axis ticks
-            ax_corr.set_xticklabels(numeric_df.columns, rotation=90)  # Add x-axis labels
-            ax_corr.set_yticks(range(len(numeric_df.columns)))  # Add y-axis ticks
-            ax_corr.set_yticklabels(numeric_df.columns)  # Add y-axis labels
+            ax_corr.matshow(summary['correlation']['matrix'])
+            ax_corr.set_xticks(range(len(columns)))  # Add x-axis ticks
+            ax_corr.set_xticklabels(columns, rotation=90)  # Add x-axis labels
+            ax_corr.set_yticks(range(len(columns)))  # Add y-axis ticks
+            ax_corr.set_yticklabels(columns)  # Add y-axis labels
             st.pyplot(fig_corr)
 
     except Exception as e:
         st.error(f"An error occurred: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
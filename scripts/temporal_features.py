@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+
+# Per-station temporal features. Every feature only looks at a station's *earlier* readings, so
+# AQI history can be used without leaking the target of the row being predicted.
+STATION_KEYS = ['latitude', 'longitude']
+TEMPORAL_COLUMNS = ['aqi', 'pm25', 'pm10', 'temperature', 'humidity', 'wind_speed']
+ROLLING_WINDOWS_HOURS = [3, 24] # Mean of the readings in the previous N hours
+LAG_STEPS = [1] # Value N readings earlier
+EWM_HALFLIFE_HOURS = [6] # Time-aware exponentially weighted mean of earlier readings
+PEAK_QUANTILE = 0.95 # A reading is a peak above this quantile of its station's earlier AQI readings
+
+def station_keys(df):
+    """The integer station_id from the stations table when every row has one, else the coordinate pair."""
+    if 'station_id' in df.columns and df['station_id'].notna().all():
+        return ['station_id']
+    return STATION_KEYS
+
+def sort_by_station(df, keys=None):
+    """Sorts by station then timestamp and returns (sorted frame, integer station codes).
+
+    Codes are 0..n_stations-1 and non-decreasing in the sorted frame, so every station is one
+    contiguous segment; the helpers below rely on that.
+    """
+    keys = keys or station_keys(df)
+    df = df.sort_values(by=keys + ['timestamp'], kind='stable')
+    codes = df.groupby(keys, sort=False, observed=True).ngroup().to_numpy()
+    return df, codes
+
+def _segment_starts(codes):
+    """Boolean mask of the first row of every station segment."""
+    starts = np.ones(len(codes), dtype=bool)
+    starts[1:] = codes[1:] != codes[:-1]
+    return starts
+
+def _naive_utc(timestamps):
+    """datetime64 values in UTC without a timezone (tz-aware to_numpy() would build Python objects)."""
+    return pd.to_datetime(timestamps, utc=True).dt.tz_localize(None)
+
+def epoch_seconds(timestamps):
+    return _naive_utc(timestamps).to_numpy().astype('datetime64[s]').astype(np.int64)
+
+def hours_since_last_peak(values, seconds, codes, q=PEAK_QUANTILE):
+    """Hours since the station's most recent earlier reading above the q-quantile of the readings before it.
+
+    Both the peak test and the threshold only use earlier readings, so a row's own AQI never
+    affects its value. Before a station's first peak, hours since its first reading. Grouped
+    expanding quantile, then a segmented forward fill with a running maximum of row positions.
+    """
+    expanding = pd.Series(values).groupby(codes).expanding().quantile(q).droplevel(0).sort_index().to_numpy()
+    thresholds = lag(expanding, codes, 1) # Quantile of the readings strictly before each row
+    with np.errstate(invalid='ignore'):
+        peak = values > thresholds # NaN thresholds (a station's first reading) never peak
+    rows = np.arange(len(values))
+    starts = _segment_starts(codes)
+    previous_peak = np.zeros(len(values), dtype=bool)
+    previous_peak[1:] = peak[:-1]
+    previous_peak &= ~starts
+    # Each row points at the previous row when that row peaked, or at itself when it starts a station
+    positions = np.where(starts, rows, np.where(previous_peak, rows - 1, 0))
+    last = np.maximum.accumulate(positions)
+    return (seconds - seconds[last]) / 3600.0
+
+def window_bounds(seconds, codes, window_hours):
+    """Row ranges [start, end) holding each row's station readings in [t - window, t).
+
+    One searchsorted on a (station, time) composite key; the current row and same-timestamp
+    duplicates are excluded. Shared by every column rolled over the same window.
+    """
+    window = int(window_hours * 3600)
+    span = int(seconds.max() - seconds.min()) + window + 1
+    base = codes.astype(np.int64) * span
+    key = base + (seconds - seconds.min())
+    start = np.searchsorted(key, np.maximum(key - window, base), side='left')
+    end = np.searchsorted(key, key, side='left')
+    return start, end
+
+def rolling_means(values, start, end):
+    """Mean of values[start:end] per row from cumulative sums, NaNs ignored; NaN if the window is empty.
+
+    O(rows) after window_bounds, whatever the number of stations.
+    """
+    valid = ~np.isnan(values)
+    sums = np.concatenate([[0.0], np.cumsum(np.where(valid, values, 0.0))])
+    counts = np.concatenate([[0], np.cumsum(valid)])
+    n = counts[end] - counts[start]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(n > 0, (sums[end] - sums[start]) / n, np.nan)
+
+def lag(values, codes, steps):
+    """Value `steps` readings earlier at the same station; NaN where the station has no such reading."""
+    source = np.arange(len(values)) - steps
+    valid = source >= 0
+    valid[valid] = codes[source[valid]] == codes[valid]
+    return np.where(valid, values[np.where(valid, source, 0)], np.nan)
+
+def add_temporal_features(df, columns=TEMPORAL_COLUMNS, windows=ROLLING_WINDOWS_HOURS,
+                          lags=LAG_STEPS, halflives=EWM_HALFLIFE_HOURS):
+    """Adds per-station temporal features; returns the frame sorted by station and timestamp.
+
+    time_since_last_peak  hours since the station's last earlier AQI peak
+    <col>_mean_<N>h       mean over the previous N hours
+    <col>_lag_<N>         value N readings earlier
+    <col>_ewm_<N>h        exponentially weighted mean of earlier readings, half-life N hours
+    """
+    df, codes = sort_by_station(df)
+    seconds = epoch_seconds(df['timestamp'])
+    columns = [col for col in columns if col in df.columns]
+    features = {}
+
+    if 'aqi' in df.columns:
+        features['time_since_last_peak'] = hours_since_last_peak(df['aqi'].to_numpy(dtype=float), seconds, codes)
+
+    bounds = {hours: window_bounds(seconds, codes, hours) for hours in windows}
+    for col in columns:
+        values = df[col].to_numpy(dtype=float)
+        for hours in windows:
+            features[f'{col}_mean_{hours}h'] = rolling_means(values, *bounds[hours])
+        for steps in lags:
+            features[f'{col}_lag_{steps}'] = lag(values, codes, steps)
+
+    if halflives and columns:
+        # pandas' grouped EWM runs one compiled pass over all station segments
+        previous = pd.DataFrame({col: lag(df[col].to_numpy(dtype=float), codes, 1) for col in columns})
+        previous['station'] = codes
+        times = pd.Series(_naive_utc(df['timestamp']).to_numpy())
+        for hours in halflives:
+            ewm = previous.groupby('station')[columns].ewm(halflife=f'{hours}h', times=times).mean()
+            ewm = ewm.droplevel(0).sort_index()
+            for col in columns:
+                features[f'{col}_ewm_{hours}h'] = ewm[col].to_numpy()
+
+    return pd.concat([df, pd.DataFrame(features, index=df.index)], axis=1)
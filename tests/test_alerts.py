@@ -0,0 +1,102 @@
+import email
+import os
+import sys
+import threading
+import warnings
+
+import pytest
+
+# Make the pipeline modules in scripts/ importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    asyncore = pytest.importorskip("asyncore") # asyncore and smtpd were removed in Python 3.12
+    smtpd = pytest.importorskip("smtpd")
+
+from alerts import AlertDispatcher, SMTPPool
+
+
+class RecordingServer(smtpd.SMTPServer):
+    """Local stand-in mail server that keeps every message it receives."""
+
+    def __init__(self):
+        self.socket_map = {}
+        super().__init__(("127.0.0.1", 0), None, map=self.socket_map, decode_data=True)
+        self.messages = []
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        self.messages.append(email.message_from_string(data).get_payload(decode=True).decode())
+
+    def drop_connections(self):
+        """Closes every client connection, as a server timing out an idle session would."""
+        for channel in list(self.socket_map.values()):
+            if isinstance(channel, smtpd.SMTPChannel):
+                channel.close()
+
+
+@pytest.fixture
+def server():
+    server = RecordingServer()
+    stop = threading.Event()
+
+    def serve():
+        while not stop.is_set():
+            asyncore.loop(timeout=0.01, count=1, map=server.socket_map)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    yield server
+    stop.set()
+    thread.join()
+    server.close()
+
+
+@pytest.fixture
+def make_dispatcher(server):
+    dispatchers = []
+
+    def make(**kwargs):
+        pool = SMTPPool(host="127.0.0.1", port=server.socket.getsockname()[1], use_ssl=False)
+        options = {'batch_seconds': 0.2, 'cooldown_seconds': 3600, 'max_per_hour': 0, 'idle_seconds': 60}
+        options.update(kwargs)
+        dispatcher = AlertDispatcher(pool, sender="pipeline@example.com", recipient="team@example.com", **options)
+        dispatchers.append(dispatcher)
+        return dispatcher
+
+    yield make
+    for dispatcher in dispatchers:
+        dispatcher.close(timeout=5)
+
+
+def test_submits_within_the_batch_window_share_one_email(server, make_dispatcher):
+    dispatcher = make_dispatcher()
+    for key in ("aqi_range", "pm25_range", "humidity_range"):
+        dispatcher.submit({key: f"Data validation failed: {key}"})
+    assert dispatcher.flush(timeout=5)
+    assert len(server.messages) == 1
+    assert all(f"Data validation failed: {key}" in server.messages[0] for key in ("aqi_range", "pm25_range", "humidity_range"))
+    assert dispatcher.pool.connections == 1
+    assert dispatcher.stats['emails'] == 1 and dispatcher.stats['sent'] == 3
+
+
+def test_repeated_key_is_suppressed_within_the_cooldown(server, make_dispatcher):
+    dispatcher = make_dispatcher(batch_seconds=0.05)
+    dispatcher.submit({'aqi_range': "Data validation failed: aqi_range"})
+    assert dispatcher.flush(timeout=5)
+    dispatcher.submit({'aqi_range': "Data validation failed: aqi_range"})
+    assert dispatcher.flush(timeout=5)
+    assert len(server.messages) == 1
+    assert dispatcher.stats['suppressed'] == 1
+
+
+def test_pool_reconnects_after_the_server_drops_the_connection(server, make_dispatcher):
+    dispatcher = make_dispatcher(batch_seconds=0.05)
+    dispatcher.submit({'aqi_range': "first"})
+    assert dispatcher.flush(timeout=5)
+    server.drop_connections()
+    dispatcher.submit({'pm25_range': "second"})
+    assert dispatcher.flush(timeout=5)
+    assert len(server.messages) == 2
+    assert dispatcher.pool.connections == 2
+    assert dispatcher.stats['failed'] == 0
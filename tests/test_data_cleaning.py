@@ -0,0 +1,57 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Make the pipeline modules in scripts/ importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from data_cleaning import run_validation
+
+
+def make_readings(**overrides):
+    """Four valid readings of two stations; keyword arguments replace whole columns."""
+    df = pd.DataFrame({
+        'station_id': [1, 1, 2, 2],
+        'timestamp': pd.date_range('2025-01-01', periods=4, freq='h', tz='UTC'),
+        'aqi': [10.0, 20.0, 30.0, 40.0],
+        'pm25': [5.0, 6.0, 7.0, 8.0],
+        'pm10': [9.0, 10.0, 11.0, 12.0],
+        'humidity': [40.0, 50.0, 60.0, 70.0],
+        'wind_direction': [0.0, 90.0, 180.0, 360.0],
+        'pressure': [1000.0, 1005.0, 1010.0, 1015.0],
+    })
+    for column, values in overrides.items():
+        df[column] = values
+    return df
+
+
+def failed(report):
+    return {check: result['failed_rows'] for check, result in report['checks'].items() if result['failed_rows']}
+
+
+def test_valid_readings_pass():
+    report = run_validation(make_readings())
+    assert report['rows'] == 4 and report['failed_rows'] == 0 and failed(report) == {}
+
+
+def test_missing_values_pass_min_checks_and_fail_range_checks():
+    report = run_validation(make_readings(aqi=[np.nan, 20.0, 30.0, 40.0], humidity=[40.0, np.nan, 60.0, 70.0],
+                                          wind_direction=[0.0, 90.0, np.nan, 360.0]))
+    assert failed(report) == {'humidity_range': 1, 'wind_direction_range': 1}
+    assert report['checks']['aqi_range']['missing'] == 1
+
+
+def test_pressure_must_be_strictly_above_900():
+    report = run_validation(make_readings(pressure=[900.0, 900.5, 1010.0, 899.0]))
+    assert failed(report) == {'pressure_range': 2}
+    assert report['checks']['pressure_range']['stations'] == {'1': 1, '2': 1}
+
+
+def test_out_of_range_values_fail_and_are_listed():
+    report = run_validation(make_readings(aqi=[-1.0, 20.0, 30.0, 40.0], humidity=[40.0, 50.0, 101.0, 70.0],
+                                          timestamp=[pd.Timestamp('2025-01-01', tz='UTC'), None, None, None]))
+    assert failed(report) == {'timestamp': 3, 'aqi_range': 1, 'humidity_range': 1}
+    assert report['failed_rows'] == 4
+    assert report['checks']['aqi_range']['min'] == -1.0
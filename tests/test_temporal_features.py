@@ -0,0 +1,40 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Make the pipeline modules in scripts/ importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from temporal_features import add_temporal_features, hours_since_last_peak
+
+
+def make_frame(n_rows=2000, n_stations=5, seed=0):
+    rng = np.random.default_rng(seed)
+    station = rng.integers(0, n_stations, n_rows)
+    return pd.DataFrame({
+        'latitude': -40 + station * 0.01,
+        'longitude': -120 + station * 0.02,
+        'timestamp': pd.Timestamp('2024-01-01', tz='UTC') + pd.to_timedelta(rng.permutation(n_rows), unit='h'),
+        'aqi': rng.gamma(2.0, 30.0, n_rows),
+    })
+
+
+def test_hours_since_last_peak_counts_only_earlier_peaks():
+    values = np.array([10, 20, 5, 30, 1, 50.0])
+    seconds = np.arange(6) * 3600
+    codes = np.zeros(6, dtype=int)
+    # Peaks (above the median of the earlier readings) at rows 1, 3 and 5
+    assert hours_since_last_peak(values, seconds, codes, q=0.5).tolist() == [0, 1, 1, 2, 1, 2]
+
+
+def test_own_aqi_does_not_change_own_features():
+    df = make_frame()
+    features = add_temporal_features(df)
+    derived = [col for col in features.columns if col not in df.columns]
+    for row in df.index[[0, 17, 500, 1999]]:
+        for aqi in (0.0, 1e6):
+            changed = df.copy()
+            changed.loc[row, 'aqi'] = aqi
+            pd.testing.assert_series_equal(add_temporal_features(changed).loc[row, derived], features.loc[row, derived])